@@ -0,0 +1,43 @@
+# conftest.py
+import numpy as np
+import pytest
+from helpers.price_array_helper import BAR_DTYPE
+
+# Builders shared by the test modules, the database factories live in tests/factories.py
+
+
+@pytest.fixture
+def make_bars():
+    """
+    Returns a builder of a bar array from timestamps, with consistent OHLC around each open (high = open + 1,
+    low = open - 1, close = open + 0.5) so the bars pass validation. Any field can be overridden with a keyword.
+    """
+    def make(timestamps, opens=10.0, volumes=1.0, dtype=BAR_DTYPE, **columns):
+        bars = np.zeros(len(timestamps), dtype=dtype)
+        opens = np.broadcast_to(np.asarray(opens, dtype=np.float64), len(timestamps))
+        bars['timestamp'] = timestamps
+        bars['open'] = opens
+        bars['high'] = opens + 1
+        bars['low'] = opens - 1
+        bars['close'] = opens + 0.5
+        bars['volume'] = volumes
+        if 'adjusted_close' in bars.dtype.names:
+            bars['adjusted_close'] = bars['close']
+        if 'is_regular_trading_hours' in bars.dtype.names:
+            bars['is_regular_trading_hours'] = True
+        for name, values in columns.items():
+            bars[name] = values
+        return bars
+    return make
+
+
+@pytest.fixture
+def make_candles():
+    """
+    Returns a builder of TD Ameritrade style candles (the 'candles' list of a price history response) at the given times,
+    with the same OHLC as make_bars.
+    """
+    def make(times, close=10.5):
+        return [{'datetime': time, 'open': 10.0, 'high': 11.0, 'low': 9.0, 'close': close, 'volume': 100} for time in times]
+    return make
+
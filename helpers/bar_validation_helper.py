@@ -0,0 +1,104 @@
+# helpers/bar_validation_helper.py
+import numpy as np
+from typing import Dict, List, Optional
+
+# Purpose:
+# 1. Validate whole batches of bars at once with vectorized NumPy checks instead of looping over every field of every record.
+# 2. Give every rejected bar reason codes, so it can be quarantined (models/price_quarantine.py) and the batch summarized
+#    in a single log line instead of one error per bad field.
+#
+# Criteria (one bit per reason, a bar can fail several checks):
+# 1. null_value: timestamp, open, high, low or volume missing (NaN, or a timestamp <= 0). close may be missing.
+# 2. high_below_open_close: high < max(open, close).
+# 3. low_above_open_close: low > min(open, close).
+# 4. negative_volume: volume < 0.
+# 5. duplicate_timestamp: the timestamp was already used by an earlier bar of the batch, the first one is kept.
+# 6. off_grid_timestamp: the timestamp is not a multiple of the grid of the bar frequency (see Historical_Price_Data.partition_grids).
+#
+# Usage:
+#     reasons = find_invalid_bars(bars, grid_ms=60000)
+#     valid_bars, rejected_bars = bars[reasons == 0], bars[reasons != 0]
+#     logger.warning(f"Rejected {len(rejected_bars)} bars: {format_reason_counts(count_reasons(reasons))}")
+
+REASON_CODES = (
+    'null_value',
+    'high_below_open_close',
+    'low_above_open_close',
+    'negative_volume',
+    'duplicate_timestamp',
+    'off_grid_timestamp',
+)
+
+# Bit of each reason code in the masks returned by find_invalid_bars
+REASON_BITS = {reason: np.uint8(1 << bit) for bit, reason in enumerate(REASON_CODES)}
+
+
+def find_invalid_bars(bars: np.ndarray, grid_ms: Optional[int] = None, entity_ids: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Checks a batch of bars and returns the reasons each bar is rejected for.
+
+    Args:
+        bars (np.ndarray): Structured array with 'timestamp', 'open', 'high', 'low', 'close' and 'volume' fields, in any order.
+        grid_ms (int, optional): Timestamps must be a multiple of grid_ms (UTC ms). Defaults to None, no grid check.
+        entity_ids (np.ndarray, optional): Entity of each bar when the batch holds several entities, timestamps are only
+            duplicates within the same entity. Defaults to None, the batch is one entity.
+
+    Returns:
+        np.ndarray: uint8 bitmask per bar (see REASON_BITS), 0 for a valid bar.
+    """
+    reasons = np.zeros(len(bars), dtype=np.uint8)
+    if not len(bars):
+        return reasons
+
+    timestamps = bars['timestamp']
+    opens, highs, lows, closes, volumes = (bars[name] for name in ('open', 'high', 'low', 'close', 'volume'))
+
+    null_value = np.isnan(opens) | np.isnan(highs) | np.isnan(lows) | np.isnan(volumes) | (timestamps <= 0)
+    reasons[null_value] |= REASON_BITS['null_value']
+
+    # fmax/fmin ignore a missing close, comparisons with NaN are False so bars with a missing open are only null_value
+    with np.errstate(invalid='ignore'):
+        reasons[highs < np.fmax(opens, closes)] |= REASON_BITS['high_below_open_close']
+        reasons[lows > np.fmin(opens, closes)] |= REASON_BITS['low_above_open_close']
+        reasons[volumes < 0] |= REASON_BITS['negative_volume']
+
+    # Stable sorts keep the batch order within equal keys, every bar after the first of its key is a duplicate
+    repeated = np.zeros(len(bars), dtype=bool)
+    if entity_ids is None:
+        order = np.argsort(timestamps, kind='stable')
+        repeated[1:] = timestamps[order[1:]] == timestamps[order[:-1]]
+    else:
+        entity_ids = np.asarray(entity_ids)
+        order = np.lexsort((timestamps, entity_ids))
+        repeated[1:] = (timestamps[order[1:]] == timestamps[order[:-1]]) & (entity_ids[order[1:]] == entity_ids[order[:-1]])
+    reasons[order[repeated]] |= REASON_BITS['duplicate_timestamp']
+
+    if grid_ms:
+        reasons[(timestamps % grid_ms) != 0] |= REASON_BITS['off_grid_timestamp']
+
+    return reasons
+
+
+def describe_reasons(reasons: np.ndarray) -> List[str]:
+    """
+    Returns the comma separated reason codes of each bitmask, e.g. 'high_below_open_close,negative_volume'.
+    """
+    descriptions = {}
+    for mask in np.unique(reasons).tolist():
+        descriptions[mask] = ','.join(reason for reason in REASON_CODES if mask & REASON_BITS[reason])
+    return [descriptions[mask] for mask in reasons.tolist()]
+
+
+def count_reasons(reasons: np.ndarray) -> Dict[str, int]:
+    """
+    Counts the bars failing each check, reasons no bar failed are left out.
+    """
+    counts = {reason: int(np.count_nonzero(reasons & REASON_BITS[reason])) for reason in REASON_CODES}
+    return {reason: count for reason, count in counts.items() if count}
+
+
+def format_reason_counts(counts: Dict[str, int]) -> str:
+    """
+    Formats count_reasons for a log line, e.g. 'null_value=3, negative_volume=1'.
+    """
+    return ', '.join(f'{reason}={count}' for reason, count in counts.items())
@@ -0,0 +1,124 @@
+# helpers/candle_merge_helper.py
+import heapq
+from typing import Dict, Iterable, Iterator, List, Optional
+
+# Purpose:
+# 1. Merge the candle chunks returned by several api requests into one time ordered list, dropping candles that more
+#    than one request returned, without building a DataFrame and hashing every column of every candle.
+# 2. Report how much the requests overlapped, so the chunk planner (process_date_ranges_for_td_ameritrade_historical_data)
+#    can be tuned to request less data twice.
+#
+# Criteria:
+# 1. Chunks arrive sorted by time, they are merged with a k-way heap merge (heapq.merge) keyed on the candle time, O(n log k)
+#    for k chunks, and duplicates are dropped in the same pass since equal keys come out next to each other.
+# 2. When two chunks hold the same candle time the candle of the earlier chunk is kept. Same time with different values
+#    is counted as a conflict.
+# 3. A chunk that is not sorted is sorted first (checked in O(n)).
+#
+# Usage:
+#     stats = Candle_Merge_Stats()
+#     candles = list(merge_candle_chunks(chunks, key='datetime', stats=stats))
+#     logger.info(stats.summary())
+
+
+class Candle_Merge_Stats:
+    """
+    Overlap statistics of a merge of candle chunks.
+
+    Attributes:
+        chunk_count (int): Number of chunks.
+        candle_count (int): Number of candles in all chunks.
+        unique_count (int): Number of candles after dropping duplicates.
+        duplicate_count (int): Number of candles dropped because an earlier chunk had the same time.
+        conflict_count (int): Duplicates whose values differed from the kept candle.
+        duplicates_by_chunk (dict): Maps a chunk index to the number of its candles that were dropped.
+        overlapping_chunk_count (int): Number of chunks whose time span overlaps the spans of the chunks starting before it.
+        overlap_ms (int): Total time the chunk spans overlap (ms of the candle time key).
+    """
+
+    def __init__(self):
+        self.chunk_count = 0
+        self.candle_count = 0
+        self.unique_count = 0
+        self.duplicate_count = 0
+        self.conflict_count = 0
+        self.duplicates_by_chunk: Dict[int, int] = {}
+        self._spans: List[tuple] = []
+
+    def record_chunk(self, first: int, last: int, candle_count: int) -> None:
+        """
+        Records the time span and size of a chunk, can also be used on its own for chunks that are not merged in memory.
+        """
+        self.chunk_count += 1
+        self.candle_count += candle_count
+        if candle_count:
+            self._spans.append((first, last))
+
+    def _overlap(self) -> tuple:
+        # Spans sorted by start, the overlap of each span is its part already covered by the union of the spans before it
+        overlapping_chunk_count, overlap_ms, covered_until = 0, 0, None
+        for first, last in sorted(self._spans):
+            if covered_until is not None and first <= covered_until:
+                overlapping_chunk_count += 1
+                overlap_ms += min(last, covered_until) - first
+            covered_until = last if covered_until is None else max(covered_until, last)
+        return overlapping_chunk_count, overlap_ms
+
+    @property
+    def overlapping_chunk_count(self) -> int:
+        return self._overlap()[0]
+
+    @property
+    def overlap_ms(self) -> int:
+        return self._overlap()[1]
+
+    @property
+    def duplicate_ratio(self) -> float:
+        return self.duplicate_count / self.candle_count if self.candle_count else 0.0
+
+    def summary(self) -> str:
+        overlapping_chunk_count, overlap_ms = self._overlap()
+        return (
+            f"{self.chunk_count} chunks, {self.candle_count} candles, {self.duplicate_count} duplicates ({self.duplicate_ratio:.1%}, "
+            f"{self.conflict_count} conflicting), {overlapping_chunk_count} overlapping chunks, {overlap_ms / 3_600_000:.1f} hours overlapped"
+        )
+
+
+def merge_candle_chunks(chunks: Iterable[List[dict]], key: str = 'datetime', stats: Optional[Candle_Merge_Stats] = None) -> Iterator[dict]:
+    """
+    Merges candle chunks into one sequence ordered by key, keeping the first candle of every key.
+
+    Args:
+        chunks (Iterable[List[dict]]): The candles of each request, each chunk ideally sorted by key.
+        key (str, optional): The candle time key. Defaults to 'datetime' (TD Ameritrade, UTC ms).
+        stats (Candle_Merge_Stats, optional): Filled with the overlap statistics of the merge.
+
+    Yields:
+        dict: The candles, ordered by key, without duplicates.
+    """
+    stats = stats if stats is not None else Candle_Merge_Stats()
+    sorted_chunks = []
+    for chunk in chunks:
+        if any(chunk[index][key] > chunk[index + 1][key] for index in range(len(chunk) - 1)):
+            chunk = sorted(chunk, key=lambda candle: candle[key])
+        stats.record_chunk(chunk[0][key] if chunk else 0, chunk[-1][key] if chunk else 0, len(chunk))
+        sorted_chunks.append(chunk)
+
+    # (time, chunk index, position) is unique, so the heap never compares the candles themselves and earlier chunks win ties
+    merged = heapq.merge(*(_keyed_candles(chunk, chunk_index, key) for chunk_index, chunk in enumerate(sorted_chunks)))
+    previous_time, previous_candle = None, None
+    for candle_time, chunk_index, _, candle in merged:
+        if previous_candle is not None and candle_time == previous_time:
+            stats.duplicate_count += 1
+            stats.duplicates_by_chunk[chunk_index] = stats.duplicates_by_chunk.get(chunk_index, 0) + 1
+            if candle != previous_candle:
+                stats.conflict_count += 1
+            continue
+        previous_time, previous_candle = candle_time, candle
+        stats.unique_count += 1
+        yield candle
+
+
+def _keyed_candles(chunk: List[dict], chunk_index: int, key: str) -> Iterator[tuple]:
+    for position, candle in enumerate(chunk):
+        yield candle[key], chunk_index, position, candle
@@ -8,24 +8,29 @@ from models import Exchange_EODHistoricalData
 from models import Symbol_EODHistoricalData
 from models import Entity
 from support.db import DB
+from support.trading_calendar import Trading_Calendar
 from helpers.data_helper import single_column_list_to_csv
 from helpers.logging_helper import configure_logging, logger
 
 configure_logging()
 db = DB()
 
-def get_market_hours(symbol):
-    # Get entity associated with the symbol
-    with db.session_scope() as session:
-        entity = session.query(Entity).filter(Entity.code == symbol).one_or_none()
+def get_market_hours(symbol, day=None):
+    """
+    Retrieves the regular session open and close of the symbol's exchange in UTC.
 
-    # Get associated exchange
-    exchange = entity.exchange_data
+    Args:
+        symbol (str): The symbol (Entity.code) to look up.
+        day (date, optional): The trading day, the next session is used if the exchange is closed that day. Defaults to today (UTC).
 
-    # Parse trading hours
-    trading_hours = json.loads(exchange.trading_hours)
-    open_time_utc = datetime.strptime(trading_hours["OpenUTC"], "%H:%M:%S").time()
-    close_time_utc = datetime.strptime(trading_hours["CloseUTC"], "%H:%M:%S").time()
+    Returns:
+        tuple[time, time]: The open and close time (UTC) of the session, daylight saving time is taken into account.
+    """
+    if day is None:
+        day = datetime.utcnow().date()
+    open_timestamp, close_timestamp = Trading_Calendar.for_symbol(symbol).session_on_or_after(day)
+    open_time_utc = datetime.utcfromtimestamp(open_timestamp / 1000).time()
+    close_time_utc = datetime.utcfromtimestamp(close_timestamp / 1000).time()
 
     return open_time_utc, close_time_utc
 
@@ -38,15 +43,31 @@ def get_gics_sector(entity_id):
 
 def get_symbols_by_gics_sector(gics_sector):
     with db.session_scope() as session:
-        symbols = session.query(Entity.symbol).filter(Entity.gics_sector == gics_sector).all()
+        symbols = session.query(Entity.code).filter(Entity.gics_sector == gics_sector).all()
         # Flatten the list of tuples returned by the query
         symbols = [symbol[0] for symbol in symbols]
         return symbols
 
 def get_entity_id_from_symbol(symbol):
+    """
+    Returns the entity id (int) of a symbol (Entity.code), None when the symbol is unknown.
+    """
+    with db.session_scope() as session:
+        return session.query(Entity.id).filter(Entity.code == symbol).scalar()
+
+def get_entity_ids_from_symbols(symbols):
+    """
+    Resolves the entity ids of many symbols with a single query.
+
+    Args:
+        symbols (list): The symbols (Entity.code) to look up.
+
+    Returns:
+        dict: Maps each symbol that was found to its entity id, unknown symbols are left out.
+    """
     with db.session_scope() as session:
-        entity_id = session.query(Entity.id).filter(Entity.code == symbol).one_or_none()
-        return entity_id
+        rows = session.query(Entity.code, Entity.id).filter(Entity.code.in_(list(symbols))).all()
+        return {code: entity_id for code, entity_id in rows}
 
 def get_exchange_for_symbol(symbol):
     with db.session_scope() as session:
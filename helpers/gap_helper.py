@@ -0,0 +1,351 @@
+# helpers/gap_helper.py
+import numpy as np
+import pandas as pd
+from datetime import datetime, date, timedelta
+from dateutil.easter import easter
+from typing import Iterable, List, Optional, Tuple, Union
+from helpers.interval_helper import Interval_Set
+
+# Purpose:
+# 1. Build the grid of bars we expect an exchange to have produced between two points in time.
+# 2. Diff that grid against the timestamps we already have stored and return merged missing ranges.
+#
+# Criteria:
+# 1. Everything is done on NumPy arrays of UTC millisecond timestamps, no per-bar Python loops.
+# 2. Sessions respect the exchange working days, holidays and local timezone (so DST is handled).
+# 3. Consecutive missing bars (including across nights/weekends) are merged into one range so the
+#    API sources receive as few windows as possible.
+#
+# Usage:
+#     session_days = build_session_days(start_date, end_date, 'Mon,Tue,Wed,Thu,Fri', ['2023-07-04'])
+#     bucket_starts, bucket_ends = build_expected_buckets(session_days, '09:30:00', '16:00:00', 'America/New_York', 1, 'minute')
+#     range_starts, range_ends = find_missing_bucket_ranges(stored_timestamps_ms, bucket_starts, bucket_ends)
+
+MS_PER_SECOND = 1_000
+MS_PER_MINUTE = 60 * MS_PER_SECOND
+MS_PER_HOUR = 60 * MS_PER_MINUTE
+
+WEEKDAY_NAMES = ('Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun')
+
+# Defaults used when we do not have exchange details for a symbol (regular US equity session)
+DEFAULT_TIMEZONE = 'America/New_York'
+DEFAULT_OPEN_TIME = '09:30:00'
+DEFAULT_CLOSE_TIME = '16:00:00'
+DEFAULT_WORKING_DAYS = 'Mon,Tue,Wed,Thu,Fri'
+# Close of a shortened session (half-day), e.g. US equities the day after Thanksgiving
+DEFAULT_EARLY_CLOSE_TIME = '13:00:00'
+
+
+def time_str_to_seconds(time_str: str) -> int:
+    """
+    Converts a 'HH:MM' or 'HH:MM:SS' string into the number of seconds since midnight.
+
+    Args:
+        time_str (str): The time of day, e.g. '09:30:00'.
+
+    Returns:
+        int: Seconds since midnight.
+    """
+    parts = [int(part) for part in time_str.split(':')]
+    while len(parts) < 3:
+        parts.append(0)
+    hours, minutes, seconds = parts[:3]
+    return hours * 3600 + minutes * 60 + seconds
+
+
+def working_days_to_weekmask(working_days: Union[str, Iterable[str]]) -> List[bool]:
+    """
+    Converts the exchange 'WorkingDays' value (e.g. 'Mon,Tue,Wed,Thu,Fri') into a NumPy busday weekmask.
+    """
+    if isinstance(working_days, str):
+        working_days = working_days.split(',')
+    working_days = {day.strip()[:3].capitalize() for day in working_days}
+    return [day in working_days for day in WEEKDAY_NAMES]
+
+
+def build_session_days(start_date: Union[date, datetime], end_date: Union[date, datetime], working_days: Union[str, Iterable[str]] = DEFAULT_WORKING_DAYS, holiday_dates: Optional[Iterable[Union[str, date]]] = None) -> np.ndarray:
+    """
+    Returns every trading day (as datetime64[D]) between start_date and end_date inclusive.
+
+    Args:
+        start_date (date or datetime): The first day to consider.
+        end_date (date or datetime): The last day to consider.
+        working_days (str or list): Exchange working days, e.g. 'Mon,Tue,Wed,Thu,Fri'.
+        holiday_dates (list, optional): Dates ('YYYY-MM-DD' strings or dates) the exchange is closed.
+
+    Returns:
+        np.ndarray: Sorted array of datetime64[D] trading days.
+    """
+    if isinstance(start_date, datetime):
+        start_date = start_date.date()
+    if isinstance(end_date, datetime):
+        end_date = end_date.date()
+
+    days = np.arange(np.datetime64(start_date, 'D'), np.datetime64(end_date, 'D') + 1, dtype='datetime64[D]')
+    holidays = np.array([str(holiday)[:10] for holiday in (holiday_dates or [])], dtype='datetime64[D]')
+    mask = np.is_busday(days, weekmask=working_days_to_weekmask(working_days), holidays=holidays)
+    return days[mask]
+
+
+def us_equity_early_close_days(start_date: Union[date, datetime], end_date: Union[date, datetime]) -> np.ndarray:
+    """
+    Returns the recurring US equity half-days (NYSE/Nasdaq close at 13:00 New York time) between start_date and end_date inclusive:
+    July 3 when Independence Day falls Tuesday to Friday, the day after Thanksgiving, and Christmas Eve Monday to Thursday.
+    Days the exchange is closed anyway (weekends, observed holidays) are not returned.
+
+    Returns:
+        np.ndarray: Sorted array of datetime64[D] days.
+    """
+    if isinstance(start_date, datetime):
+        start_date = start_date.date()
+    if isinstance(end_date, datetime):
+        end_date = end_date.date()
+
+    early_close_days = []
+    for year in range(start_date.year, end_date.year + 1):
+        independence_eve = date(year, 7, 3)
+        if independence_eve.weekday() <= 3:
+            early_close_days.append(independence_eve)
+        # Thanksgiving is the fourth Thursday of November
+        november_first = date(year, 11, 1)
+        thanksgiving_day = 1 + (3 - november_first.weekday()) % 7 + 21
+        early_close_days.append(date(year, 11, thanksgiving_day + 1))
+        christmas_eve = date(year, 12, 24)
+        if christmas_eve.weekday() <= 3:
+            early_close_days.append(christmas_eve)
+
+    days = np.array(early_close_days, dtype='datetime64[D]')
+    return days[(days >= np.datetime64(start_date, 'D')) & (days <= np.datetime64(end_date, 'D'))]
+
+
+def us_equity_holiday_days(start_date: Union[date, datetime], end_date: Union[date, datetime]) -> np.ndarray:
+    """
+    Returns the recurring US equity full holidays (NYSE/Nasdaq closed) between start_date and end_date inclusive: New Year's
+    Day, Martin Luther King Jr. Day (from 1998), Washington's Birthday, Good Friday, Memorial Day, Juneteenth (from 2022),
+    Independence Day, Labor Day, Thanksgiving and Christmas. A holiday on a Sunday is observed the Monday after and one on a
+    Saturday the Friday before, except New Year's Day which is then not observed. One-off closures are not included.
+
+    Returns:
+        np.ndarray: Sorted array of datetime64[D] days.
+    """
+    if isinstance(start_date, datetime):
+        start_date = start_date.date()
+    if isinstance(end_date, datetime):
+        end_date = end_date.date()
+
+    def nth_weekday(year: int, month: int, weekday: int, n: int) -> date:
+        # n-th (1-based) weekday of the month, n = -1 for the last one
+        if n > 0:
+            first = date(year, month, 1)
+            return first + timedelta(days=(weekday - first.weekday()) % 7 + 7 * (n - 1))
+        last = date(year, month + 1, 1) - timedelta(days=1)
+        return last - timedelta(days=(last.weekday() - weekday) % 7)
+
+    def observed(day: date) -> date:
+        if day.weekday() == 5:
+            return day - timedelta(days=1)
+        if day.weekday() == 6:
+            return day + timedelta(days=1)
+        return day
+
+    holiday_days = []
+    for year in range(start_date.year, end_date.year + 1):
+        new_years_day = date(year, 1, 1)
+        if new_years_day.weekday() != 5:
+            holiday_days.append(observed(new_years_day))
+        if year >= 1998:
+            holiday_days.append(nth_weekday(year, 1, 0, 3))
+        holiday_days.append(nth_weekday(year, 2, 0, 3))
+        holiday_days.append(easter(year) - timedelta(days=2))
+        holiday_days.append(nth_weekday(year, 5, 0, -1))
+        if year >= 2022:
+            holiday_days.append(observed(date(year, 6, 19)))
+        holiday_days.append(observed(date(year, 7, 4)))
+        holiday_days.append(nth_weekday(year, 9, 0, 1))
+        holiday_days.append(nth_weekday(year, 11, 3, 4))
+        holiday_days.append(observed(date(year, 12, 25)))
+
+    days = np.unique(np.array(holiday_days, dtype='datetime64[D]'))
+    return days[(days >= np.datetime64(start_date, 'D')) & (days <= np.datetime64(end_date, 'D'))]
+
+
+def local_times_to_utc_ms(days: np.ndarray, seconds_after_midnight: Union[int, np.ndarray], timezone: str) -> np.ndarray:
+    """
+    Converts local wall-clock times on each of the given days into UTC millisecond timestamps.
+    The conversion is done per day through pandas, so DST transitions are respected.
+
+    Args:
+        days (np.ndarray): Array of datetime64[D] days.
+        seconds_after_midnight (int or np.ndarray): Local time of day in seconds, scalar or one per day.
+        timezone (str): IANA timezone of the exchange, e.g. 'America/New_York'.
+
+    Returns:
+        np.ndarray: int64 array of UTC timestamps in milliseconds.
+    """
+    if len(days) == 0:
+        return np.empty(0, dtype=np.int64)
+    local_naive = days.astype('datetime64[ms]') + np.asarray(seconds_after_midnight, dtype=np.int64) * MS_PER_SECOND
+    local_index = pd.DatetimeIndex(local_naive.astype('datetime64[ns]'))
+    utc_index = local_index.tz_localize(timezone, ambiguous=False, nonexistent='shift_forward').tz_convert('UTC').tz_localize(None)
+    return utc_index.values.astype('datetime64[ms]').astype(np.int64)
+
+
+def bar_length_ms(frequency: int, frequency_type: str) -> Optional[int]:
+    """
+    Returns the length of one intraday bar in milliseconds, or None for daily and longer frequencies.
+    """
+    if frequency_type == 'minute':
+        return int(frequency) * MS_PER_MINUTE
+    if frequency_type == 'hour':
+        return int(frequency) * MS_PER_HOUR
+    return None
+
+
+def build_expected_buckets(session_days: np.ndarray, open_time: str, close_time: str, timezone: str, frequency: int, frequency_type: str) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Builds the grid of bars the exchange should have produced on the given session days.
+
+    Intraday frequencies produce one bucket per bar, aligned to the session open. Daily, weekly and monthly
+    frequencies produce one bucket per local calendar day, week (Monday based) or month containing at least one session.
+    A stored bar "fills" a bucket if its timestamp falls in [bucket_start, bucket_end).
+
+    Args:
+        session_days (np.ndarray): datetime64[D] trading days, see build_session_days.
+        open_time (str): Local session open, e.g. '09:30:00'.
+        close_time (str): Local session close, e.g. '16:00:00'.
+        timezone (str): IANA timezone of the exchange.
+        frequency (int): The frequency of the data.
+        frequency_type (str): 'minute', 'hour', 'daily', 'weekly' or 'monthly'.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: Sorted int64 bucket start and end timestamps (UTC ms).
+    """
+    bar_ms = bar_length_ms(frequency, frequency_type)
+    if bar_ms is not None:
+        opens = local_times_to_utc_ms(session_days, time_str_to_seconds(open_time), timezone)
+        closes = local_times_to_utc_ms(session_days, time_str_to_seconds(close_time), timezone)
+        return build_intraday_buckets(opens, closes, bar_ms)
+
+    if frequency_type == 'daily':
+        bucket_days = session_days
+        next_bucket_days = session_days + np.timedelta64(1, 'D')
+    elif frequency_type == 'weekly':
+        # datetime64[D] counts days since Thursday 1970-01-01, shift so weeks start on Monday
+        bucket_days = np.unique(session_days - ((session_days.astype(np.int64) + 3) % 7).astype('timedelta64[D]'))
+        next_bucket_days = bucket_days + np.timedelta64(7, 'D')
+    elif frequency_type == 'monthly':
+        months = np.unique(session_days.astype('datetime64[M]'))
+        bucket_days = months.astype('datetime64[D]')
+        next_bucket_days = (months + np.timedelta64(1, 'M')).astype('datetime64[D]')
+    else:
+        raise ValueError(f"Invalid frequency_type: {frequency_type}")
+
+    return local_times_to_utc_ms(bucket_days, 0, timezone), local_times_to_utc_ms(next_bucket_days, 0, timezone)
+
+
+def build_intraday_buckets(session_opens_ms: np.ndarray, session_closes_ms: np.ndarray, bar_ms: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Expands session [open, close) bounds into one bucket per bar, the last bar of a session is clipped to the close.
+
+    Args:
+        session_opens_ms (np.ndarray): Session open timestamps (UTC ms).
+        session_closes_ms (np.ndarray): Session close timestamps (UTC ms).
+        bar_ms (int): Bar length in milliseconds.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: int64 bucket start and end timestamps (UTC ms).
+    """
+    session_opens_ms = np.asarray(session_opens_ms, dtype=np.int64)
+    session_closes_ms = np.asarray(session_closes_ms, dtype=np.int64)
+    bars_per_session = np.maximum(-(-(session_closes_ms - session_opens_ms) // bar_ms), 0)
+    session_index = np.repeat(np.arange(len(session_opens_ms)), bars_per_session)
+    first_bar_index = np.cumsum(bars_per_session) - bars_per_session
+    bar_in_session = np.arange(len(session_index)) - first_bar_index[session_index]
+
+    starts = session_opens_ms[session_index] + bar_in_session * bar_ms
+    ends = np.minimum(starts + bar_ms, session_closes_ms[session_index])
+    return starts, ends
+
+
+def find_missing_bucket_ranges(timestamps_ms: np.ndarray, bucket_starts_ms: np.ndarray, bucket_ends_ms: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Marks every bucket that contains at least one stored timestamp and merges the runs of empty buckets
+    into (start, end) ranges in one pass.
+
+    Args:
+        timestamps_ms (np.ndarray): Stored bar timestamps (UTC ms), any order.
+        bucket_starts_ms (np.ndarray): Sorted bucket starts (UTC ms).
+        bucket_ends_ms (np.ndarray): Bucket ends (UTC ms), same length as bucket_starts_ms.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: Start of the first and end of the last missing bucket of each merged range.
+    """
+    bucket_count = len(bucket_starts_ms)
+    if bucket_count == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+
+    timestamps_ms = np.asarray(timestamps_ms, dtype=np.int64)
+    covered = np.zeros(bucket_count, dtype=bool)
+    if len(timestamps_ms):
+        bucket_index = np.searchsorted(bucket_starts_ms, timestamps_ms, side='right') - 1
+        in_bucket = bucket_index >= 0
+        in_bucket[in_bucket] = timestamps_ms[in_bucket] < bucket_ends_ms[bucket_index[in_bucket]]
+        covered[bucket_index[in_bucket]] = True
+
+    return merge_uncovered_buckets(covered, bucket_starts_ms, bucket_ends_ms)
+
+
+def find_uncovered_bucket_ranges(covered_from_ms: np.ndarray, covered_to_ms: np.ndarray, bucket_starts_ms: np.ndarray, bucket_ends_ms: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Same as find_missing_bucket_ranges, but checks the buckets against covered intervals (see models/price_coverage.py)
+    instead of stored timestamps. A bucket is covered if its start falls inside a covered interval.
+
+    Args:
+        covered_from_ms (np.ndarray): Start of each covered interval (UTC ms).
+        covered_to_ms (np.ndarray): End of each covered interval (UTC ms, inclusive), same length as covered_from_ms.
+        bucket_starts_ms (np.ndarray): Sorted bucket starts (UTC ms).
+        bucket_ends_ms (np.ndarray): Bucket ends (UTC ms), same length as bucket_starts_ms.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: Start of the first and end of the last uncovered bucket of each merged range.
+    """
+    if len(bucket_starts_ms) == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+
+    # Overlapping and touching intervals are merged, each bucket is then checked against the last interval starting at or
+    # before it
+    covered_intervals = np.array(Interval_Set(zip(np.asarray(covered_from_ms).tolist(), np.asarray(covered_to_ms).tolist())).to_list(), dtype=np.int64).reshape(-1, 2)
+    covered_from_ms, covered_to_ms = covered_intervals[:, 0], covered_intervals[:, 1]
+    covered = np.zeros(len(bucket_starts_ms), dtype=bool)
+    if len(covered_from_ms):
+        interval_index = np.searchsorted(covered_from_ms, bucket_starts_ms, side='right') - 1
+        covered = interval_index >= 0
+        covered[covered] = bucket_starts_ms[covered] <= covered_to_ms[interval_index[covered]]
+
+    return merge_uncovered_buckets(covered, bucket_starts_ms, bucket_ends_ms)
+
+
+def merge_uncovered_buckets(covered: np.ndarray, bucket_starts_ms: np.ndarray, bucket_ends_ms: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Merges the runs of buckets flagged as not covered into (start, end) ranges.
+    """
+    # +1 where a run of missing buckets starts and -1 one past where it ends
+    edges = np.diff(np.concatenate(([0], (~covered).astype(np.int8), [0])))
+    run_starts = np.flatnonzero(edges == 1)
+    run_ends = np.flatnonzero(edges == -1) - 1
+    return bucket_starts_ms[run_starts], bucket_ends_ms[run_ends]
+
+
+def extract_timestamps_ms(data) -> np.ndarray:
+    """
+    Returns the 'timestamp' values of stored bars as an int64 array. Accepts a NumPy structured array,
+    a pandas DataFrame or a list of dicts/rows.
+    """
+    if data is None:
+        return np.empty(0, dtype=np.int64)
+    if isinstance(data, np.ndarray):
+        return data['timestamp'].astype(np.int64, copy=False)
+    if isinstance(data, pd.DataFrame):
+        return data['timestamp'].to_numpy(dtype=np.int64)
+    return np.fromiter((row['timestamp'] for row in data), dtype=np.int64, count=len(data))
+
@@ -0,0 +1,119 @@
+# helpers/price_array_helper.py
+import numpy as np
+import pandas as pd
+from typing import Iterable, Optional, Sequence
+
+# Purpose:
+# 1. Define the compact columnar layout we use for historical price bars in memory.
+# 2. Fill those arrays straight from database row chunks without building a dict per row.
+# 3. Convert the arrays into the output format the caller asked for (numpy, pandas or arrow).
+# 4. Turn provider candles JSON into arrays the partition writer consumes directly (no ORM object per candle).
+#
+# A bar costs 48 bytes in BAR_DTYPE (int64 timestamp + five float64 values), compared to several hundred bytes
+# for a Python dict per row.
+
+BAR_DTYPE = np.dtype([
+    ('timestamp', np.int64),
+    ('open', np.float64),
+    ('high', np.float64),
+    ('low', np.float64),
+    ('close', np.float64),
+    ('volume', np.float64),
+])
+
+# Same as BAR_DTYPE with the entity the bar belongs to, used when a query spans several entities
+ENTITY_BAR_DTYPE = np.dtype([('entity_id', np.int32)] + BAR_DTYPE.descr)
+
+# BAR_DTYPE with both the raw and the adjusted close, used when bars are read to be resampled and written back
+RESAMPLE_SOURCE_DTYPE = np.dtype(BAR_DTYPE.descr[:5] + [('adjusted_close', np.float64)] + BAR_DTYPE.descr[5:])
+
+# What a writer needs per bar, produced straight from the provider's candles JSON (see candles_to_bar_array)
+CANDLE_DTYPE = np.dtype(RESAMPLE_SOURCE_DTYPE.descr + [('is_regular_trading_hours', np.bool_)])
+
+COLUMNAR_OUTPUTS = ('numpy', 'pandas', 'arrow')
+
+
+def rows_to_bar_array(row_chunks: Iterable[Sequence[Sequence]], dtype: np.dtype = BAR_DTYPE, initial_capacity: int = 65536) -> np.ndarray:
+    """
+    Copies chunks of database rows into one structured array. The rows must have their columns in the same order
+    as the fields of dtype. The array is preallocated and doubled when it fills up, so rows are never held as dicts.
+
+    Args:
+        row_chunks (Iterable[Sequence[Sequence]]): Chunks of rows, e.g. Result.partitions(chunk_size).
+        dtype (np.dtype): Structured dtype to fill, BAR_DTYPE or ENTITY_BAR_DTYPE.
+        initial_capacity (int): Number of rows to allocate up front.
+
+    Returns:
+        np.ndarray: Structured array with one element per row.
+    """
+    bars = np.empty(initial_capacity, dtype=dtype)
+    count = 0
+    for chunk in row_chunks:
+        chunk_size = len(chunk)
+        if not chunk_size:
+            continue
+        if count + chunk_size > len(bars):
+            grown = np.empty(max(len(bars) * 2, count + chunk_size), dtype=dtype)
+            grown[:count] = bars[:count]
+            bars = grown
+        # Transpose the chunk into columns so each field is filled with one vectorized assignment
+        for name, column in zip(dtype.names, zip(*chunk)):
+            bars[name][count:count + chunk_size] = column
+        count += chunk_size
+
+    if count == len(bars):
+        return bars
+    return bars[:count].copy()
+
+
+def bar_array_to_output(bars: np.ndarray, output: str):
+    """
+    Converts a structured bar array into the requested output format.
+
+    Args:
+        bars (np.ndarray): Structured array created by rows_to_bar_array.
+        output (str): 'numpy', 'pandas' or 'arrow'.
+
+    Returns:
+        np.ndarray, pd.DataFrame or pyarrow.Table: The bars in the requested format.
+    """
+    if output == 'numpy':
+        return bars
+    if output == 'pandas':
+        return pd.DataFrame({name: bars[name] for name in bars.dtype.names})
+    if output == 'arrow':
+        try:
+            import pyarrow as pa
+        except ImportError as e:
+            raise ImportError("output='arrow' requires the pyarrow package, install it with 'pip install pyarrow'") from e
+        return pa.Table.from_arrays([pa.array(bars[name]) for name in bars.dtype.names], names=list(bars.dtype.names))
+    raise ValueError(f"Invalid output: {output}. Please use one of the following: {', '.join(COLUMNAR_OUTPUTS)}")
+
+
+def candles_to_bar_array(candles: Sequence[dict], timestamp_key: str = 'datetime', timestamp_scale: int = 1) -> np.ndarray:
+    """
+    Builds a CANDLE_DTYPE array straight from a provider's candles JSON (e.g. TD Ameritrade's 'candles' list), one column at
+    a time, without creating an object per candle. Missing values become NaN, is_regular_trading_hours is left True for the
+    caller to set.
+
+    Args:
+        candles (Sequence[dict]): The candles, with 'open', 'high', 'low', 'close', 'volume' and optionally 'adjusted_close'.
+        timestamp_key (str, optional): The key holding the candle time. Defaults to 'datetime' (TD Ameritrade, UTC ms).
+        timestamp_scale (int, optional): Multiplier turning the candle time into UTC ms, e.g. 1000 for epoch seconds (eodhistoricaldata intraday). Defaults to 1.
+
+    Returns:
+        np.ndarray: Structured array with one element per candle, in the order given.
+    """
+    bars = np.empty(len(candles), dtype=CANDLE_DTYPE)
+    bars['timestamp'] = np.fromiter((candle[timestamp_key] for candle in candles), dtype=np.int64, count=len(candles)) * timestamp_scale
+    for name in ('open', 'high', 'low', 'close', 'adjusted_close', 'volume'):
+        bars[name] = np.array([candle.get(name) for candle in candles], dtype=np.float64)
+    bars['is_regular_trading_hours'] = True
+    return bars
+
+
+def empty_bar_array(dtype: Optional[np.dtype] = None) -> np.ndarray:
+    """
+    Returns an empty structured bar array.
+    """
+    return np.empty(0, dtype=dtype or BAR_DTYPE)
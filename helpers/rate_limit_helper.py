@@ -0,0 +1,181 @@
+# helpers/rate_limit_helper.py
+import asyncio
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+# Purpose:
+# 1. Keep every api request of the process under the provider's request cap with one shared token bucket, so parallel
+#    fetchers run right at the cap instead of each being throttled on its own.
+# 2. Slow down when the provider throttles anyway (HTTP 429) and speed back up once it stops.
+#
+# Criteria:
+# 1. The bucket holds at most capacity tokens and refills at rate tokens per second. A request takes its weight in tokens
+#    and waits until they are available. Over any window of w seconds at most capacity + rate * w tokens are taken, so
+#    for a cap of N requests per minute use for_requests_per_minute, which picks rate = (N - capacity) / 60.
+# 2. throttle (a 429) empties the bucket, blocks every request for the Retry-After time (refilling only after it) and multiplies the rate by
+#    slowdown_factor (never below min_rate). Every recovery_seconds without a 429 the rate grows by recovery_factor until
+#    it is back at its configured rate.
+# 3. Thread safe for blocking callers (acquire) and usable from event loops (async_acquire), both sharing the same tokens.
+#
+# Usage:
+#     bucket = Token_Bucket.for_requests_per_minute(120, capacity=10)
+#     bucket.acquire(weight=1)          # or: await bucket.async_acquire(weight=1)
+#     if response.status_code == 429:
+#         bucket.throttle(retry_after_seconds)
+#     bucket.stats()
+
+
+class Token_Bucket:
+    """
+    Token bucket rate limiter with adaptive slowdown.
+
+    Args:
+        rate (float): Tokens added per second.
+        capacity (float): Most tokens the bucket holds, the largest burst and the largest weight of one request.
+        slowdown_factor (float, optional): Rate multiplier applied on every throttle. Defaults to 0.5.
+        min_rate (float, optional): Lowest rate after slowdowns. Defaults to a tenth of rate.
+        recovery_seconds (float, optional): Seconds without a throttle before the rate grows again. Defaults to 60.
+        recovery_factor (float, optional): Rate multiplier applied every recovery_seconds until rate is reached. Defaults to 1.25.
+        clock (Callable[[], float], optional): Monotonic clock in seconds. Defaults to time.monotonic.
+        sleep (Callable[[float], None], optional): Blocking sleep used by acquire. Defaults to time.sleep.
+    """
+
+    def __init__(self, rate: float, capacity: float, slowdown_factor: float = 0.5, min_rate: Optional[float] = None, recovery_seconds: float = 60.0, recovery_factor: float = 1.25, clock: Callable[[], float] = time.monotonic, sleep: Callable[[float], None] = time.sleep):
+        if rate <= 0 or capacity <= 0:
+            raise ValueError(f"rate and capacity must be positive, got rate={rate}, capacity={capacity}")
+        self.rate = rate
+        self.capacity = capacity
+        self.slowdown_factor = slowdown_factor
+        self.min_rate = min_rate if min_rate is not None else rate / 10
+        self.recovery_seconds = recovery_seconds
+        self.recovery_factor = recovery_factor
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+
+        now = clock()
+        self._tokens = capacity
+        self._current_rate = rate
+        self._refilled_at = now
+        self._rate_changed_at = now
+        self._blocked_until = now
+
+        self._requests = 0
+        self._tokens_taken = 0.0
+        self._waited_requests = 0
+        self._wait_seconds = 0.0
+        self._max_wait_seconds = 0.0
+        self._throttles = 0
+
+    @classmethod
+    def for_requests_per_minute(cls, requests_per_minute: float, capacity: float = 10, **kwargs) -> 'Token_Bucket':
+        """
+        Returns a bucket that never takes more than requests_per_minute tokens in any 60 second window.
+        """
+        if capacity >= requests_per_minute:
+            raise ValueError(f"capacity ({capacity}) must be below requests_per_minute ({requests_per_minute})")
+        return cls(rate=(requests_per_minute - capacity) / 60.0, capacity=capacity, **kwargs)
+
+    def _refill(self, now: float) -> None:
+        # Called with the lock held
+        while self._current_rate < self.rate and now - self._rate_changed_at >= self.recovery_seconds:
+            self._current_rate = min(self.rate, self._current_rate * self.recovery_factor)
+            self._rate_changed_at += self.recovery_seconds
+        if now > self._refilled_at:
+            self._tokens = min(self.capacity, self._tokens + (now - self._refilled_at) * self._current_rate)
+            self._refilled_at = now
+
+    def _try_take(self, weight: float) -> float:
+        """
+        Takes weight tokens when available and returns 0, otherwise returns the seconds to wait before trying again.
+        """
+        if weight > self.capacity:
+            raise ValueError(f"weight ({weight}) exceeds the bucket capacity ({self.capacity})")
+        with self._lock:
+            now = self._clock()
+            self._refill(now)
+            if now < self._blocked_until:
+                return self._blocked_until - now
+            # The tolerance keeps float rounding of the refill from asking for waits too small to move the clock
+            if self._tokens >= weight - 1e-9:
+                self._tokens = max(0.0, self._tokens - weight)
+                return 0.0
+            return (weight - self._tokens) / self._current_rate
+
+    def _record(self, weight: float, waited: float) -> None:
+        with self._lock:
+            self._requests += 1
+            self._tokens_taken += weight
+            if waited > 0:
+                self._waited_requests += 1
+                self._wait_seconds += waited
+                self._max_wait_seconds = max(self._max_wait_seconds, waited)
+
+    def acquire(self, weight: float = 1) -> float:
+        """
+        Blocks until weight tokens are taken.
+
+        Returns:
+            float: The seconds waited.
+        """
+        started = self._clock()
+        while True:
+            wait = self._try_take(weight)
+            if not wait:
+                break
+            self._sleep(wait)
+        waited = self._clock() - started
+        self._record(weight, waited)
+        return waited
+
+    async def async_acquire(self, weight: float = 1) -> float:
+        """
+        Waits on the running event loop until weight tokens are taken.
+
+        Returns:
+            float: The seconds waited.
+        """
+        started = self._clock()
+        while True:
+            wait = self._try_take(weight)
+            if not wait:
+                break
+            await asyncio.sleep(wait)
+        waited = self._clock() - started
+        self._record(weight, waited)
+        return waited
+
+    def throttle(self, retry_after: Optional[float] = None) -> None:
+        """
+        Records that the provider rejected a request (HTTP 429): empties the bucket, blocks requests for retry_after seconds
+        and slows the rate down.
+        """
+        with self._lock:
+            now = self._clock()
+            self._refill(now)
+            self._throttles += 1
+            self._tokens = 0.0
+            self._blocked_until = max(self._blocked_until, now + (retry_after or 0.0))
+            # No tokens accumulate while blocked, a burst right after the block would be throttled again
+            self._refilled_at = self._blocked_until
+            self._current_rate = max(self.min_rate, self._current_rate * self.slowdown_factor)
+            self._rate_changed_at = now
+
+    def stats(self) -> Dict[str, float]:
+        """
+        Returns the requests and tokens taken, time spent waiting, throttles (rejections) and the current rate and tokens.
+        """
+        with self._lock:
+            self._refill(self._clock())
+            return {
+                'requests': self._requests,
+                'tokens_taken': self._tokens_taken,
+                'tokens_available': self._tokens,
+                'rate_per_second': self._current_rate,
+                'configured_rate_per_second': self.rate,
+                'waited_requests': self._waited_requests,
+                'wait_seconds': self._wait_seconds,
+                'max_wait_seconds': self._max_wait_seconds,
+                'throttles': self._throttles,
+            }
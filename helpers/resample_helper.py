@@ -0,0 +1,103 @@
+# helpers/resample_helper.py
+import numpy as np
+from typing import Tuple
+
+# Purpose:
+# 1. Build coarser OHLCV bars (5m, 15m, 1h, 4h, daily, weekly, monthly) from finer stored bars instead of asking an api for them.
+# 2. Only return the coarser bars whose every expected finer bar is present, so a partial bucket is never stored as complete.
+#
+# Criteria:
+# 1. Buckets come from the exchange session calendar (see Trading_Calendar.expected_buckets), so intraday bars are aligned
+#    to the session open and daily/weekly/monthly bars follow the exchange's local days across DST changes.
+# 2. Everything is a vectorized NumPy reduce (ufunc.reduceat) over bars sorted by timestamp, no per-bar Python loops.
+#
+# Usage:
+#     bucket_starts, bucket_ends = calendar.expected_buckets(start_ms, end_ms, 1, 'hour')
+#     expected_counts = count_per_bucket(calendar.expected_buckets(start_ms, end_ms, 1, 'minute')[0], bucket_starts, bucket_ends)
+#     resampled, bucket_index = resample_bars(one_minute_bars, bucket_starts, bucket_ends)
+#     complete = count_per_bucket(one_minute_bars['timestamp'], bucket_starts, bucket_ends)[bucket_index] >= expected_counts[bucket_index]
+
+# How each field of a bar is aggregated into the coarser bar, fields that are not listed (e.g. entity_id) keep the value of the first bar
+FIELD_AGGREGATIONS = {
+    'open': 'first',
+    'high': 'max',
+    'low': 'min',
+    'close': 'last',
+    'adjusted_close': 'last',
+    'volume': 'sum',
+}
+
+
+def assign_buckets(timestamps_ms: np.ndarray, bucket_starts_ms: np.ndarray, bucket_ends_ms: np.ndarray) -> np.ndarray:
+    """
+    Returns the index of the bucket [start, end) each timestamp falls in, or -1 for timestamps outside every bucket
+    (e.g. extended hours bars when the buckets only cover regular sessions).
+
+    Args:
+        timestamps_ms (np.ndarray): Bar timestamps (UTC ms).
+        bucket_starts_ms (np.ndarray): Sorted bucket starts (UTC ms).
+        bucket_ends_ms (np.ndarray): Bucket ends (UTC ms), same length as bucket_starts_ms.
+
+    Returns:
+        np.ndarray: int64 bucket index per timestamp.
+    """
+    timestamps_ms = np.asarray(timestamps_ms, dtype=np.int64)
+    bucket_index = np.searchsorted(bucket_starts_ms, timestamps_ms, side='right') - 1
+    in_bucket = bucket_index >= 0
+    in_bucket[in_bucket] = timestamps_ms[in_bucket] < bucket_ends_ms[bucket_index[in_bucket]]
+    bucket_index[~in_bucket] = -1
+    return bucket_index
+
+
+def count_per_bucket(timestamps_ms: np.ndarray, bucket_starts_ms: np.ndarray, bucket_ends_ms: np.ndarray) -> np.ndarray:
+    """
+    Counts the timestamps that fall in each bucket.
+
+    Returns:
+        np.ndarray: int64 count per bucket, same length as bucket_starts_ms.
+    """
+    bucket_index = assign_buckets(timestamps_ms, bucket_starts_ms, bucket_ends_ms)
+    return np.bincount(bucket_index[bucket_index >= 0], minlength=len(bucket_starts_ms))
+
+
+def resample_bars(bars: np.ndarray, bucket_starts_ms: np.ndarray, bucket_ends_ms: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Aggregates bars into one bar per bucket, see FIELD_AGGREGATIONS. The coarser bar is stamped with its bucket start.
+
+    Args:
+        bars (np.ndarray): Structured array with a 'timestamp' field (UTC ms) and any of the FIELD_AGGREGATIONS fields, sorted by timestamp.
+        bucket_starts_ms (np.ndarray): Sorted bucket starts (UTC ms).
+        bucket_ends_ms (np.ndarray): Bucket ends (UTC ms), same length as bucket_starts_ms.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: The coarser bars (same dtype as bars), one per bucket that holds at least one bar,
+        and the index of the bucket of each coarser bar.
+    """
+    bucket_index = assign_buckets(bars['timestamp'], bucket_starts_ms, bucket_ends_ms)
+    in_bucket = bucket_index >= 0
+    bars, bucket_index = bars[in_bucket], bucket_index[in_bucket]
+    if not len(bars):
+        return bars, bucket_index
+
+    # Bars are sorted, so each bucket is one contiguous run [group_starts[i], group_ends[i])
+    group_starts = np.concatenate(([0], np.flatnonzero(np.diff(bucket_index)) + 1))
+    group_ends = np.concatenate((group_starts[1:], [len(bars)]))
+
+    resampled = np.empty(len(group_starts), dtype=bars.dtype)
+    resampled['timestamp'] = bucket_starts_ms[bucket_index[group_starts]]
+    for name in bars.dtype.names:
+        if name == 'timestamp':
+            continue
+        aggregation = FIELD_AGGREGATIONS.get(name, 'first')
+        if aggregation == 'first':
+            resampled[name] = bars[name][group_starts]
+        elif aggregation == 'last':
+            resampled[name] = bars[name][group_ends - 1]
+        elif aggregation == 'max':
+            resampled[name] = np.maximum.reduceat(bars[name], group_starts)
+        elif aggregation == 'min':
+            resampled[name] = np.minimum.reduceat(bars[name], group_starts)
+        elif aggregation == 'sum':
+            resampled[name] = np.add.reduceat(bars[name], group_starts)
+
+    return resampled, bucket_index[group_starts]
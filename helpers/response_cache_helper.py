@@ -0,0 +1,307 @@
+# helpers/response_cache_helper.py
+import copy
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, Optional
+import pytz
+
+# Purpose:
+# 1. Keep the bodies of historical price responses on disk, so a window that was downloaded once is not downloaded again
+#    when the database write failed, the tables were rebuilt or a benchmark is re-run.
+# 2. Replay-only mode: serve every request from the cache and fail on a miss, for rebuilds and offline benchmarks that
+#    must not touch the network.
+#
+# Workflow:
+# 1. The api classes (TD_Ameritrade_Historical, EODHistoricalData_Historical_Price_Data) pass each request through
+#    Response_Cache.get_instance().fetch(namespace, params, request, window_end) (async_fetch for the asyncio engine).
+# 2. The request parameters (never the api key) are hashed into the key of an index entry:
+#    {root}/index/{namespace}/{key[:2]}/{key}.json, which points at the body and holds its expiry.
+# 3. Bodies are content addressed, gzip compressed at {root}/blobs/{sha256[:2]}/{sha256}.gz, so identical bodies (e.g.
+#    the empty response of every holiday window) are stored once.
+#
+# Criteria:
+# 1. Windows that closed before the current day in the exchange timezone never change and never expire. Windows touching
+#    today (or of unknown end) expire after ttl_seconds.
+# 2. Only valid responses are cached: status 200 and, by default, a body that is not a JSON error object ({"error": ...},
+#    which TD Ameritrade sends with status 200 for some rejected requests). fetch takes another predicate with is_valid. Files are written to a temporary name and renamed, so concurrent
+#    writers and crashes never leave a partial file behind.
+# 3. Modes: 'read_write' (default) serves fresh entries and stores new responses, 'replay' serves any entry, expired or
+#    not, and raises Response_Cache_Miss instead of requesting, 'off' always requests. set_mode changes the mode of the
+#    shared instance for every user, with_mode returns a view of the same cache in another mode for one user.
+# 4. Price history that is split adjusted by the provider does change after a split, invalidate the affected requests or
+#    clear the cache after a split.
+#
+# Usage:
+#     cache = Response_Cache.get_instance()
+#     cache.set_mode('replay')
+#     response = cache.fetch('td_ameritrade/get_price_history', {'symbol': 'AAPL', ...}, lambda: client.get_price_history(...), window_end=end_datetime_utc)
+
+
+class Response_Cache_Miss(Exception):
+    pass
+
+
+class Cached_Response:
+    """
+    Response served from the cache, with the parts of httpx/requests responses the api classes use.
+    """
+
+    def __init__(self, status_code: int, content: bytes):
+        self.status_code = status_code
+        self.content = content
+        self.headers = {}
+        self.from_cache = True
+
+    @property
+    def text(self) -> str:
+        return self.content.decode('utf-8')
+
+    def json(self) -> Any:
+        return json.loads(self.content)
+
+    def raise_for_status(self) -> None:
+        # Only valid responses are cached
+        return None
+
+
+class Response_Cache:
+    MODES = ('read_write', 'replay', 'off')
+    DEFAULT_ROOT = './data/response_cache'
+    # Windows touching the current day expire after this many seconds
+    DEFAULT_TTL_SECONDS = 300
+    _instance = None
+    _lock = threading.Lock()
+
+    @classmethod
+    def get_instance(cls) -> 'Response_Cache':
+        """
+        Returns the process wide cache on DEFAULT_ROOT shared by the api classes.
+        """
+        with cls._lock:
+            if cls._instance is None:
+                cls._instance = cls()
+        return cls._instance
+
+    def __init__(self, root: str = DEFAULT_ROOT, mode: str = 'read_write', ttl_seconds: float = DEFAULT_TTL_SECONDS, timezone: str = 'US/Eastern', clock: Callable[[], float] = time.time):
+        """
+        Args:
+            root (str, optional): Directory of the cache. Defaults to DEFAULT_ROOT.
+            mode (str, optional): One of MODES. Defaults to 'read_write'.
+            ttl_seconds (float, optional): Lifetime of windows touching the current day. Defaults to DEFAULT_TTL_SECONDS.
+            timezone (str, optional): Timezone whose calendar day decides whether a window is closed. Defaults to 'US/Eastern'.
+            clock (Callable[[], float], optional): Current unix time in seconds. Defaults to time.time.
+        """
+        self.root = root
+        self.set_mode(mode)
+        self.ttl_seconds = ttl_seconds
+        self.timezone = pytz.timezone(timezone)
+        self._clock = clock
+        self._stats_lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'expired': 0, 'stored': 0, 'stored_bytes': 0}
+
+    def set_mode(self, mode: str) -> None:
+        if mode not in self.MODES:
+            raise ValueError(f"Invalid response cache mode '{mode}', use one of {self.MODES}")
+        self.mode = mode
+
+    def with_mode(self, mode: str) -> 'Response_Cache':
+        """
+        Returns a view of this cache in another mode, sharing its files and statistics, so one user (e.g. a manager
+        rebuilding in replay mode) does not change the mode of the others.
+        """
+        view = copy.copy(self)
+        view.set_mode(mode)
+        return view
+
+    def _count(self, name: str, amount: int = 1) -> None:
+        with self._stats_lock:
+            self._stats[name] += amount
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Returns the hits, misses, expired entries and responses (and compressed bytes) stored since the cache was created.
+        """
+        with self._stats_lock:
+            return dict(self._stats)
+
+    @staticmethod
+    def request_key(namespace: str, params: Dict[str, Any]) -> str:
+        """
+        Returns the sha256 of the namespace and the canonical JSON of the request parameters.
+        """
+        canonical = json.dumps({'namespace': namespace, 'params': params}, sort_keys=True, default=str, separators=(',', ':'))
+        return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+    def _index_path(self, namespace: str, key: str) -> str:
+        return os.path.join(self.root, 'index', namespace, key[:2], f'{key}.json')
+
+    def _blob_path(self, digest: str) -> str:
+        return os.path.join(self.root, 'blobs', digest[:2], f'{digest}.gz')
+
+    @staticmethod
+    def _write_atomic(path: str, data: bytes) -> None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temporary_path = f'{path}.{uuid.uuid4().hex}.tmp'
+        with open(temporary_path, 'wb') as f:
+            f.write(data)
+        os.replace(temporary_path, path)
+
+    def is_closed_window(self, window_end: Optional[datetime]) -> bool:
+        """
+        Whether a window ending at window_end (UTC, naive datetimes are taken as UTC) ended before the current day in the
+        exchange timezone, so its data can no longer change.
+        """
+        if window_end is None:
+            return False
+        if window_end.tzinfo is None:
+            window_end = pytz.UTC.localize(window_end)
+        today = datetime.fromtimestamp(self._clock(), tz=pytz.UTC).astimezone(self.timezone).date()
+        return window_end.astimezone(self.timezone).date() < today
+
+    def lookup(self, namespace: str, params: Dict[str, Any]) -> Optional[Cached_Response]:
+        """
+        Returns the cached response of a request, None when it is not cached or expired (expired entries are served in
+        replay mode).
+        """
+        key = self.request_key(namespace, params)
+        try:
+            with open(self._index_path(namespace, key), 'r') as f:
+                entry = json.load(f)
+            if self.mode != 'replay' and entry['expires_at'] is not None and entry['expires_at'] <= self._clock():
+                self._count('expired')
+                return None
+            with gzip.open(self._blob_path(entry['blob']), 'rb') as f:
+                content = f.read()
+        except (OSError, ValueError, KeyError):
+            return None
+        return Cached_Response(entry['status_code'], content)
+
+    @staticmethod
+    def is_valid_response(response) -> bool:
+        """
+        Whether a response is worth caching: status 200 and not a JSON error object ({"error": ...}). Bodies that are not
+        JSON (e.g. csv) are valid.
+        """
+        if getattr(response, 'status_code', None) != 200:
+            return False
+        try:
+            body = json.loads(response.content)
+        except ValueError:
+            return True
+        return not (isinstance(body, dict) and 'error' in body)
+
+    def store(self, namespace: str, params: Dict[str, Any], response, window_end: Optional[datetime] = None, is_valid: Optional[Callable[[Any], bool]] = None) -> bool:
+        """
+        Stores a valid response, forever when its window is closed, for ttl_seconds otherwise.
+
+        Args:
+            is_valid (Callable, optional): Whether the response may be cached. Defaults to is_valid_response.
+
+        Returns:
+            bool: Whether the response was stored.
+        """
+        if not (is_valid or self.is_valid_response)(response):
+            return False
+        content = response.content
+        digest = hashlib.sha256(content).hexdigest()
+        blob_path = self._blob_path(digest)
+        if not os.path.exists(blob_path):
+            compressed = gzip.compress(content)
+            self._write_atomic(blob_path, compressed)
+            self._count('stored_bytes', len(compressed))
+
+        now = self._clock()
+        entry = {
+            'namespace': namespace,
+            'params': params,
+            'blob': digest,
+            'status_code': 200,
+            'fetched_at': now,
+            'expires_at': None if self.is_closed_window(window_end) else now + self.ttl_seconds,
+        }
+        self._write_atomic(self._index_path(namespace, self.request_key(namespace, params)), json.dumps(entry, default=str).encode('utf-8'))
+        self._count('stored')
+        return True
+
+    def _cached_or_miss(self, namespace: str, params: Dict[str, Any]) -> Optional[Cached_Response]:
+        cached = self.lookup(namespace, params)
+        if cached is not None:
+            self._count('hits')
+            return cached
+        self._count('misses')
+        if self.mode == 'replay':
+            raise Response_Cache_Miss(f"No cached response for {namespace} {params} in replay mode")
+        return None
+
+    def fetch(self, namespace: str, params: Dict[str, Any], request: Callable[[], Any], window_end: Optional[datetime] = None, is_valid: Optional[Callable[[Any], bool]] = None) -> Any:
+        """
+        Returns the cached response of a request, or runs request() and caches its response.
+
+        Args:
+            namespace (str): The provider and endpoint, e.g. 'td_ameritrade/get_price_history'.
+            params (dict): The parameters identifying the response, JSON serializable (datetimes are written with str).
+                Never include api keys.
+            request (Callable): Makes the request, returns an httpx or requests response.
+            window_end (datetime, optional): End of the requested window (UTC), decides whether the response expires.
+            is_valid (Callable, optional): Whether the response may be cached. Defaults to is_valid_response.
+
+        Returns:
+            The response of request() or a Cached_Response.
+
+        Raises:
+            Response_Cache_Miss: In replay mode, when the response is not cached.
+        """
+        if self.mode == 'off':
+            return request()
+        cached = self._cached_or_miss(namespace, params)
+        if cached is not None:
+            return cached
+        response = request()
+        self.store(namespace, params, response, window_end=window_end, is_valid=is_valid)
+        return response
+
+    async def async_fetch(self, namespace: str, params: Dict[str, Any], request: Callable[[], Awaitable[Any]], window_end: Optional[datetime] = None, is_valid: Optional[Callable[[Any], bool]] = None) -> Any:
+        """
+        fetch for coroutines, request() returns an awaitable response.
+        """
+        if self.mode == 'off':
+            return await request()
+        cached = self._cached_or_miss(namespace, params)
+        if cached is not None:
+            return cached
+        response = await request()
+        self.store(namespace, params, response, window_end=window_end, is_valid=is_valid)
+        return response
+
+    def invalidate(self, namespace: str, params: Dict[str, Any]) -> bool:
+        """
+        Removes the index entry of a request. Bodies may be shared by other entries, they are only removed by clear.
+
+        Returns:
+            bool: Whether an entry was removed.
+        """
+        try:
+            os.remove(self._index_path(namespace, self.request_key(namespace, params)))
+            return True
+        except FileNotFoundError:
+            return False
+
+    def clear(self) -> None:
+        """
+        Removes every entry and body of the cache.
+        """
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def window_end_of_day(self, day: str) -> datetime:
+        """
+        Returns the end of a 'YYYY-MM-DD' day in the exchange timezone as a UTC datetime, the window end of a daily request.
+        """
+        start_of_day = self.timezone.localize(datetime.strptime(day, '%Y-%m-%d'))
+        return (start_of_day + timedelta(days=1) - timedelta(microseconds=1)).astimezone(pytz.UTC)
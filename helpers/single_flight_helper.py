@@ -0,0 +1,85 @@
+# helpers/single_flight_helper.py
+import threading
+from typing import Any, Callable, Dict, Hashable
+
+# Purpose:
+# 1. Coalesce identical calls made at the same time: the first caller of a key runs the call, callers of the same key that
+#    arrive while it is in flight wait for it and share its result (or its exception) instead of running it again.
+#    Used in front of the TD Ameritrade price history requests, so concurrent workers asking for the same
+#    symbol/frequency/window spend one request of the rate limit and write the bars once.
+#
+# Criteria:
+# 1. Only calls in flight are shared, nothing is cached: a call made after the previous one finished runs again.
+# 2. The shared result is the same object for every caller, callers must not modify it.
+#
+# Usage:
+#     single_flight = Single_Flight()
+#     candles = single_flight.do(('get_price_history', 'AAPL', 1, 'minute', start_ms, end_ms), fetch, 'AAPL')
+
+
+class _Call:
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class Single_Flight:
+    """
+    Shares the result of an in flight call with every concurrent caller of the same key.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, _Call] = {}
+        self._executed = 0
+        self._shared = 0
+
+    def do(self, key: Hashable, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """
+        Runs fn(*args, **kwargs), unless a call of the same key is in flight, then waits for that call and returns its
+        result or raises its exception.
+
+        Args:
+            key (Hashable): Identifies identical calls, e.g. the normalized request parameters.
+            fn (Callable): The call.
+
+        Returns:
+            Any: The result of fn, shared by all callers of the key that overlapped.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = self._calls[key] = _Call()
+                self._executed += 1
+                leader = True
+            else:
+                call.waiters += 1
+                self._shared += 1
+                leader = False
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn(*args, **kwargs)
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Returns the number of calls executed, calls that shared an in flight call and calls in flight now.
+        """
+        with self._lock:
+            return {'executed': self._executed, 'shared': self._shared, 'in_flight': len(self._calls)}
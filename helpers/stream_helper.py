@@ -0,0 +1,80 @@
+# helpers/stream_helper.py
+import threading
+from queue import Empty, Full, Queue
+from typing import Iterable, Iterator, TypeVar
+
+# Purpose:
+# 1. Let a slow producer (api requests) and a slow consumer (database writes) work at the same time without either
+#    side holding more than a few chunks in memory.
+#
+# Criteria:
+# 1. The producer runs in a background thread and hands items over thru a bounded queue, when the queue is full the
+#    producer waits (backpressure), so memory stays flat no matter how many items the producer yields.
+# 2. Items arrive in the order they were produced, an exception raised by the producer is re-raised in the consumer.
+# 3. If the consumer stops early (break, exception, generator closed) the producer is told to stop.
+#
+# Usage:
+#     for candles, requested_range in prefetch(td_hist_data.iter_historical_data_from_td_ameritrade(...), max_buffered=2):
+#         write(candles)  # the next request is already in flight
+
+T = TypeVar('T')
+
+# How long a blocked producer or consumer waits before checking whether the other side went away
+_POLL_SECONDS = 0.1
+
+
+class _End:
+    def __init__(self, exception: BaseException = None):
+        self.exception = exception
+
+
+def prefetch(iterable: Iterable[T], max_buffered: int = 2, name: str = 'prefetch') -> Iterator[T]:
+    """
+    Iterates iterable in a background thread, keeping at most max_buffered items ready ahead of the consumer.
+
+    Args:
+        iterable (Iterable): The producer, e.g. a generator making api requests.
+        max_buffered (int, optional): Number of items the producer may get ahead of the consumer. Defaults to 2.
+        name (str, optional): Name of the producer thread, shows up in logs. Defaults to 'prefetch'.
+
+    Yields:
+        The items of iterable, in order.
+    """
+    buffer = Queue(maxsize=max(1, max_buffered))
+    stopped = threading.Event()
+
+    def put(item) -> bool:
+        while not stopped.is_set():
+            try:
+                buffer.put(item, timeout=_POLL_SECONDS)
+                return True
+            except Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put(item):
+                    return
+            put(_End())
+        except BaseException as e:
+            put(_End(e))
+
+    producer = threading.Thread(target=produce, name=name, daemon=True)
+    producer.start()
+    try:
+        while True:
+            try:
+                item = buffer.get(timeout=_POLL_SECONDS)
+            except Empty:
+                if not producer.is_alive() and buffer.empty():
+                    return
+                continue
+            if isinstance(item, _End):
+                if item.exception is not None:
+                    raise item.exception
+                return
+            yield item
+    finally:
+        stopped.set()
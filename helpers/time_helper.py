@@ -26,16 +26,16 @@ def get_start_of_current_year(tz: str = 'US/Eastern') -> datetime:
 
 def timestamp_utc_ms_to_datetime_utc(timestamp_utc_ms: int) -> datetime:
     """
-    Converts a UNIX timestamp in milliseconds to a UTC datetime object.
+    Converts a UNIX timestamp in milliseconds to a timezone-aware UTC datetime object.
 
     Args:
-        unix_timestamp_ms (int): The UNIX timestamp in milliseconds.
+        timestamp_utc_ms (int): The UNIX timestamp in milliseconds.
 
     Returns:
-        datetime: The corresponding UTC datetime object.
+        datetime: The corresponding timezone-aware UTC datetime object.
     """
-    timestamp_s = timestamp_utc_ms / 1000  # Convert to seconds
-    datetime_utc = datetime.utcfromtimestamp(timestamp_s)  # Convert to UTC datetime
+    timestamp_s = int(timestamp_utc_ms) / 1000  # Convert to seconds
+    datetime_utc = datetime.fromtimestamp(timestamp_s, tz=pytz.UTC)  # Convert to UTC datetime
 
     return datetime_utc
 
@@ -110,9 +110,9 @@ def date_or_date_str_to_datetime_utc(date_string: Union[str, datetime, date], ti
     for fmt in formats:
         try:
             # Assume date string is in the specified timezone
-            date = datetime.strptime(date_string, fmt)
-            date = tz.localize(date)
-            return date.astimezone(utc)
+            parsed_datetime = datetime.strptime(date_string, fmt)
+            parsed_datetime = tz.localize(parsed_datetime)
+            return parsed_datetime.astimezone(utc)
         except ValueError:
             pass
     raise ValueError("No valid date format found for '{}'".format(date_string))
@@ -3,21 +3,38 @@ from sqlalchemy import Index, Table, inspect
 import pytz
 import json
 import os
-from typing import List, Optional, Tuple, Union, Dict
-from collections import defaultdict
+import threading
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Iterator, List, Optional, Tuple, Union, Dict
+import numpy as np
 import pandas as pd
 from models import Entity
 from models import Historical_Price_Data
+from models import Price_Coverage
+from models import Update_Tracking
+from models import Price_Rollup_Pending, ROLLUP_MODELS, ROLLUP_SOURCE_PARTITION_TYPE
+from models import Price_Staging
 from support.base import Base
 from support.db import DB
+from support.table_registry import Table_Registry
+from support.partition_manager import Partition_Manager
+from support.trading_calendar import Trading_Calendar
 from datetime import datetime, timedelta
 from dateutil.relativedelta import relativedelta
 from support.td_ameritrade_historical import TD_Ameritrade_Historical
 #from support.eodhistoricaldata_historical_price_data import EODHistoricalData_Historical_Price_Data
 from helpers.time_helper import datetime_utc_to_timestamp_utc_ms, get_current_datetime_utc, date_or_date_str_to_datetime_utc, timestamp_utc_ms_to_datetime_utc, get_start_of_current_year
-from helpers.db_query_helper import get_entity_id_from_symbol, get_symbols_by_gics_sector, get_market_hours
-from helpers.logging_helper import configure_logging, logger
-from sqlalchemy import MetaData, select
+from helpers.db_query_helper import get_entity_id_from_symbol, get_entity_ids_from_symbols, get_symbols_by_gics_sector
+from helpers.gap_helper import extract_timestamps_ms
+from helpers.stream_helper import prefetch
+from helpers.candle_merge_helper import Candle_Merge_Stats
+from helpers.single_flight_helper import Single_Flight
+from helpers.resample_helper import count_per_bucket, resample_bars
+from helpers.price_array_helper import BAR_DTYPE, ENTITY_BAR_DTYPE, RESAMPLE_SOURCE_DTYPE, COLUMNAR_OUTPUTS, rows_to_bar_array, bar_array_to_output, empty_bar_array, candles_to_bar_array
+from helpers.logging_helper import configure_logging, log_exception, logger
+from sqlalchemy import select, any_, bindparam, Integer, and_, func, literal, union_all, exists
+from sqlalchemy.dialects.postgresql import ARRAY, insert as postgresql_insert
 
 
 """
@@ -57,16 +74,31 @@ after reviewing all code and determining it looks as if it is ready)
 
 """
 class Historical_Price_Data_Mangager:
-    def __init__(self, user='Historical Price Data Manager'):
+    # Api responses fetched ahead of the writer while it writes, see get_historical_data_from_td_ameritrade_and_write_to_database
+    INGEST_MAX_BUFFERED_RESPONSES = 2
+    # Identical fetch-and-write calls running at the same time (several workers or backtests filling the same symbol and
+    # window) share one fetch and one write, across all manager instances
+    _ingest_single_flight = Single_Flight()
+
+    def __init__(self, user='Historical Price Data Manager', max_in_flight_api_calls: int = 4, response_cache_mode: Optional[str] = None):
         configure_logging()
         self.updater_name = user
         self.db = DB()
         self.td_hist_data = TD_Ameritrade_Historical()
+        # 'replay' serves every api request from the on-disk response cache (rebuilds, offline benchmarks), 'off' bypasses
+        # it, see helpers/response_cache_helper.py. The mode is this manager's own, other users of the cache keep theirs.
+        # Defaults to the cache's current mode.
+        if response_cache_mode is not None:
+            self.td_hist_data.response_cache = self.td_hist_data.response_cache.with_mode(response_cache_mode)
         #self.eod_historical_data = EODHistoricalData_Historical_Price_Data()
-        self.sources_used = [] # tracking of sources in gather_data() effort
+        # Shared cap on api source calls running at the same time, across every symbol pipeline run by gather_data_for_symbols
+        self.api_call_semaphore = threading.BoundedSemaphore(max_in_flight_api_calls)
+        # Fetched bars are staged first and merged into the partitions right after each fetch, see start_staging_merger
+        self.merge_staged_bars_inline = True
+        self._staging_merger = None
         
 
-    def get_data(self, symbol=None, symbols=None, gics_sector=None, start_date_str: str = None, end_date_str: str = None, period=None, period_type=None, frequency=None, frequency_type=None, need_extended_hours_data=False, adjusted_close=True, timezone='US/Eastern', **filters):
+    def get_data(self, symbol=None, symbols=None, gics_sector=None, start_date_str: str = None, end_date_str: str = None, period=None, period_type=None, frequency=None, frequency_type=None, need_extended_hours_data=False, adjusted_close=True, timezone='US/Eastern', max_workers: int = 1, output: Optional[str] = None, fetch_concurrently: bool = False, **filters):
         """
         Retrieve data based on provided parameters. The user can either provide date ranges (start_date, end_date) or
         period and period_type to fetch the data. Additional filtering options can be passed as keyword arguments.
@@ -81,10 +113,16 @@ class Historical_Price_Data_Mangager:
             period_type: The type of period (day, month, year, ytd).
             frequency: The frequency of the data.
             frequency_type: The type of frequency (minute, hour).
+            max_workers: Number of symbols gathered concurrently when symbols or gics_sector is provided. Api calls are still
+                capped by max_in_flight_api_calls across all symbols. Defaults to 1 (one symbol at a time).
+            output: 'numpy', 'pandas' or 'arrow' to receive a single symbol's data in columnar form instead of a list of dictionaries.
+            fetch_concurrently: Fetch the missing data of all symbols from TD Ameritrade in one pass of the asyncio fetch engine
+                when symbols or gics_sector is provided, see gather_data_for_symbols. Defaults to False.
             **filters: Additional filtering options based on columns available in entity table or historical price table partitions.
 
         Returns:
-            A list of data points based on the provided filtering options.
+            A list of data points based on the provided filtering options and the missing data ranges. When symbols or gics_sector
+            is provided, a dict mapping each symbol to its bars (structured array) and a dict mapping each symbol to its missing data ranges.
         """
         # Make sure we understand what the user expects the method to accomplish, they may have provided too many details, making it confusing how to handle
         if (symbol and symbols) or (symbol and gics_sector) or (symbols and gics_sector):
@@ -110,18 +148,23 @@ class Historical_Price_Data_Mangager:
         
         # If the user has provided a list of symbols or if the user wanted data by sector and we created a list from the sector
         if symbols:
-                # for each symbol in the list
-                for symbol in symbols:
-                     # reset sources used because this is a new symbol and we may have different results for this search than the prior
-                    self.sources_used = [] 
-                    # Get data thru various sources, gather_data will request the data, track sources used, make sure any new data is written to database before returning the data
-                    data, missing_data_ranges = self.gather_data(symbol=symbol, start_datetime_utc=start_datetime_utc, end_datetime_utc=end_datetime_utc, frequency=frequency, frequency_type=frequency_type, need_extended_hours_data=need_extended_hours_data)
+            # Read every symbol in one query, only symbols with missing data go thru the api sources, returns dicts keyed by symbol
+            data, missing_data_ranges = self.gather_data_for_symbols(symbols=symbols, start_datetime_utc=start_datetime_utc, end_datetime_utc=end_datetime_utc, frequency=frequency, frequency_type=frequency_type, need_extended_hours_data=need_extended_hours_data, adjusted_close=adjusted_close, max_workers=max_workers, fetch_concurrently=fetch_concurrently)
+            for symbol, symbol_missing_data_ranges in missing_data_ranges.items():
+                if symbol_missing_data_ranges:
+                    logger.error(f"Error retrieving data for {symbol} from database and backup servers, missing the following date ranges: {', '.join([f'({start}, {end})' for start, end in symbol_missing_data_ranges])}")
+            return data, missing_data_ranges
         # The user only provided one symbol, so they only need data for the one symbol
         else:
-            # reset sources used because this is a new symbol and we may have different results for this search than the prior
-            self.sources_used = []
             # Get data thru various sources, gather_data will request the data, track sources used, make sure any new data is written to database before returning the data
-            data, missing_data_ranges = self.gather_data(symbol=symbol, start_datetime_utc=start_datetime_utc, end_datetime_utc=end_datetime_utc, frequency=frequency, frequency_type=frequency_type, need_extended_hours_data=need_extended_hours_data)
+            data, missing_data_ranges = self.gather_data(symbol=symbol, start_datetime_utc=start_datetime_utc, end_datetime_utc=end_datetime_utc, frequency=frequency, frequency_type=frequency_type, need_extended_hours_data=need_extended_hours_data, adjusted_close=adjusted_close)
+            if output is None:
+                # Default to the list of dictionaries get_data has always returned for a single symbol, keyed 'timestamp',
+                # 'symbol', 'open', 'high', 'low', 'close', 'volume'
+                names = data.dtype.names
+                data = [{'timestamp': bar[0], 'symbol': symbol, **dict(zip(names[1:], bar[1:]))} for bar in data.tolist()]
+            else:
+                data = bar_array_to_output(data, output)
         # If there are any missing data ranges, we will log the missing data ranges because we have exhausted all endpoints
         if missing_data_ranges:
             logger.error(f"Error retrieving data from database and backup servers, missing the following date ranges: {', '.join([f'({start}, {end})' for start, end in missing_data_ranges])}")
@@ -129,49 +172,155 @@ class Historical_Price_Data_Mangager:
         return data, missing_data_ranges
 
 
-    def gather_data(self, symbol, start_datetime_utc: datetime, end_datetime_utc: datetime, frequency, frequency_type, need_extended_hours_data):
-        # methods we will utilize for each endpoint that will be attempted for the data request
-        sources = [self.get_historical_data_from_td_ameritrade_and_write_to_database,]
-        
-        while True:
-            # Fetch data from the database (changed declaration from data, missing_data_ranges to just 'data', also revised get_historical_price_data_from_database to only return the data)
+    def gather_data_for_symbols(self, symbols: List[str], start_datetime_utc: datetime, end_datetime_utc: datetime, frequency, frequency_type, need_extended_hours_data, adjusted_close: bool = True, max_workers: int = 1, fetch_concurrently: bool = False) -> Tuple[Dict[str, np.ndarray], Dict[str, List[Tuple[datetime, datetime]]]]:
+        """
+        Batch version of gather_data for many symbols. All symbols are read from the database with one query, only the
+        symbols that have missing data are sent thru the fill planner (gather_data), starting from the bars already read.
+
+        Args:
+            symbols (list[str]): The symbols to gather data for.
+            start_datetime_utc (datetime): The start of the requested window.
+            end_datetime_utc (datetime): The end of the requested window.
+            frequency, frequency_type, need_extended_hours_data, adjusted_close: See get_data.
+            max_workers (int, optional): Number of symbol fill pipelines run concurrently in a thread pool. Each pipeline
+                tracks its own sources, api calls are capped by self.api_call_semaphore. Defaults to 1.
+            fetch_concurrently (bool, optional): Fetch what resampling could not fill from TD Ameritrade for every symbol in
+                one pass of the asyncio fetch engine (see get_historical_data_from_td_ameritrade_for_symbols_and_write_to_database)
+                instead of one symbol pipeline after another. Defaults to False.
+
+        Returns:
+            Tuple[dict, dict]: Maps each symbol to its bars (structured array, see helpers/price_array_helper.py) and
+            each symbol to its remaining missing data ranges.
+        """
+        data = self.get_historical_price_data_from_database_for_symbols(symbols=symbols, start_datetime_utc=start_datetime_utc, end_datetime_utc=end_datetime_utc, frequency=frequency, frequency_type=frequency_type, need_extended_hours_data=need_extended_hours_data, adjusted_close=adjusted_close)
+        # Use the coverage index when it has been built, otherwise diff the bars we just read
+        missing_data_ranges = self.find_uncovered_data_ranges_for_symbols(symbols, start_datetime_utc, end_datetime_utc, frequency=frequency, frequency_type=frequency_type)
+        if missing_data_ranges is None:
+            missing_data_ranges = {symbol: self.find_missing_data_ranges(data[symbol], start_datetime_utc, end_datetime_utc, frequency=frequency, frequency_type=frequency_type, symbol=symbol) for symbol in symbols}
+
+        gather_kwargs = dict(start_datetime_utc=start_datetime_utc, end_datetime_utc=end_datetime_utc, frequency=frequency, frequency_type=frequency_type, need_extended_hours_data=need_extended_hours_data, adjusted_close=adjusted_close)
+        if not fetch_concurrently:
+            self._gather_data_in_pool(data, missing_data_ranges, max_workers, **gather_kwargs)
+            return data, missing_data_ranges
+
+        # Resample first, it costs no api quota
+        self._gather_data_in_pool(data, missing_data_ranges, max_workers, sources=[(self.resample_from_database_and_write_to_database, False)], **gather_kwargs)
+        incomplete_symbols = [symbol for symbol in symbols if missing_data_ranges[symbol]]
+        if not incomplete_symbols:
+            return data, missing_data_ranges
+
+        written_data_ranges = self.get_historical_data_from_td_ameritrade_for_symbols_and_write_to_database(
+            {symbol: missing_data_ranges[symbol] for symbol in incomplete_symbols}, frequency, frequency_type, need_extended_hours_data=need_extended_hours_data)
+        # The fill planner re-reads what the pass wrote and recomputes the missing ranges, as after any other source
+        self._gather_data_in_pool(data, missing_data_ranges, max_workers, sources=[(lambda symbol, **_: written_data_ranges.get(symbol, []), False)], **gather_kwargs)
+        return data, missing_data_ranges
+
+
+    def _gather_data_in_pool(self, data: Dict[str, np.ndarray], missing_data_ranges: Dict[str, List[Tuple[datetime, datetime]]], max_workers: int, sources: Optional[List[Tuple[Callable, bool]]] = None, **gather_kwargs) -> None:
+        """
+        Runs gather_data for every symbol of missing_data_ranges that has missing data, max_workers at a time, and updates
+        data and missing_data_ranges in place.
+        """
+        incomplete_symbols = [symbol for symbol, symbol_missing_data_ranges in missing_data_ranges.items() if symbol_missing_data_ranges]
+        if not incomplete_symbols:
+            return
+
+        # Fill the gaps thru the api sources, gather_data writes anything it finds to the database and re-reads what it wrote.
+        # Each symbol runs in its own pipeline, a failure in one symbol is logged and leaves its missing ranges as they were
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+            futures = {
+                executor.submit(self.gather_data, symbol=symbol, data=data[symbol], missing_data_ranges=missing_data_ranges[symbol], sources=sources, **gather_kwargs): symbol
+                for symbol in incomplete_symbols
+            }
+            for future in as_completed(futures):
+                symbol = futures[future]
+                try:
+                    data[symbol], missing_data_ranges[symbol] = future.result()
+                except Exception as e:
+                    logger.error(f"Error gathering data for {symbol}: {e}")
+                    log_exception(e)
+
+
+    def gather_data(self, symbol, start_datetime_utc: datetime, end_datetime_utc: datetime, frequency, frequency_type, need_extended_hours_data, adjusted_close: bool = True, data: Optional[np.ndarray] = None, missing_data_ranges: Optional[List[Tuple[datetime, datetime]]] = None, sources: Optional[List[Tuple[Callable, bool]]] = None) -> Tuple[np.ndarray, List[Tuple[datetime, datetime]]]:
+        """
+        Fill planner for a single symbol. The window is read from the database and its missing ranges are computed once,
+        then each api source is given only the ranges that earlier sources failed to fill. After a source writes, only the
+        ranges it actually wrote are re-read from the database and the missing ranges are recomputed inside those ranges.
+        Every source is tried at most once, so a request costs at most one api pass per source and one database read per
+        written range.
+
+        Args:
+            symbol (str): The symbol to gather data for.
+            start_datetime_utc (datetime): The start of the requested window.
+            end_datetime_utc (datetime): The end of the requested window.
+            frequency, frequency_type, need_extended_hours_data, adjusted_close: See get_data.
+            data (np.ndarray, optional): Bars for the window that the caller already read, skips the initial database read.
+            missing_data_ranges (list, optional): Missing ranges the caller already computed for data.
+            sources (list[tuple[Callable, bool]], optional): The (source, calls_api) pairs to try, in order. Defaults to
+                resampling stored bars, then TD Ameritrade.
+
+        Returns:
+            Tuple[np.ndarray, list]: The bars for the window (structured array ordered by timestamp) and the ranges no source could fill.
+        """
+        # methods we will utilize for each endpoint that will be attempted for the data request, in order of preference,
+        # with whether they call an api. Resampling finer stored bars costs no api quota so it goes first
+        if sources is None:
+            sources = [
+                (self.resample_from_database_and_write_to_database, False),
+                (self.get_historical_data_from_td_ameritrade_and_write_to_database, True),
+            ]
+
+        # Use the coverage index when it has been built, a few interval rows instead of diffing every bar of the window
+        if missing_data_ranges is None:
+            missing_data_ranges = self.find_uncovered_data_ranges(symbol, start_datetime_utc, end_datetime_utc, frequency=frequency, frequency_type=frequency_type)
+        if data is None:
             data = self.get_historical_price_data_from_database(
                 start_datetime_utc=start_datetime_utc, end_datetime_utc=end_datetime_utc, frequency=frequency, frequency_type=frequency_type, symbol=symbol,
-                need_extended_hours_data=need_extended_hours_data)
-            
-            # Check for and find missing data ranges
-            missing_data_ranges = self.find_missing_data_ranges(data, start_datetime_utc, end_datetime_utc, frequency=frequency, frequency_type=frequency_type)
-
-            # If there are missing data ranges
-            if missing_data_ranges:
-                # Reset variable 'source'
-                source = None
-                # for each source in sources
-                for s in sources:
-                    # if source is not yet used
-                    if s not in self.sources_used:
-                        # source = source
-                        source = s
-                        # break from loop so we can use the source
-                        break
-                # Made it through above for/if loop and determined that all sources have been used, or that there are no sources, so we should break out of the if missing_data_ranges statement and move to the else: part of the statment
-                if source is None:
-                    break
-                # Get data from api source and write to database, we are not returning data here because we want all data to come from the database even if we first had to retreive from api
-                source(symbol=symbol, start_datetime_utc=start_datetime_utc, end_datetime_utc=end_datetime_utc, frequency=frequency, frequency_type=frequency_type, need_extended_hours_data=need_extended_hours_data, missing_data_ranges=missing_data_ranges)   
-                # Add source to list of sources we have used for the request thus far
-                self.sources_used.append(source)
-                # Recursive call to check database and see if all data is present
-                self.gather_data(symbol=symbol, start_datetime_utc=start_datetime_utc, end_datetime_utc=end_datetime_utc, frequency=frequency, frequency_type=frequency_type, need_extended_hours_data=need_extended_hours_data)
+                need_extended_hours_data=need_extended_hours_data, adjusted_close=adjusted_close, output='numpy')
+        if missing_data_ranges is None:
+            missing_data_ranges = self.find_missing_data_ranges(data, start_datetime_utc, end_datetime_utc, frequency=frequency, frequency_type=frequency_type, symbol=symbol)
+
+        for source, calls_api in sources:
+            if not missing_data_ranges:
+                break
+
+            # Get data from the source and write to database, the source returns the ranges it actually wrote
+            # The semaphore caps api calls in flight across every symbol pipeline
+            with self.api_call_semaphore if calls_api else nullcontext():
+                written_data_ranges = source(symbol=symbol, start_datetime_utc=start_datetime_utc, end_datetime_utc=end_datetime_utc, frequency=frequency, frequency_type=frequency_type, need_extended_hours_data=need_extended_hours_data, missing_data_ranges=missing_data_ranges)
+            if not written_data_ranges:
+                continue
+
+            # Re-read only what was written, we want all data to come from the database even if we first had to retreive it from an api
+            written_data = [
+                self.get_historical_price_data_from_database(
+                    start_datetime_utc=written_start_datetime_utc, end_datetime_utc=written_end_datetime_utc, frequency=frequency, frequency_type=frequency_type, symbol=symbol,
+                    need_extended_hours_data=need_extended_hours_data, adjusted_close=adjusted_close, output='numpy')
+                for written_start_datetime_utc, written_end_datetime_utc in written_data_ranges
+            ]
+            data = self.merge_bar_arrays([data] + written_data)
+
+            # Whatever is still missing can only be inside the ranges that were missing before this source ran
+            missing_data_ranges = [
+                remaining_range
+                for missing_start_datetime_utc, missing_end_datetime_utc in missing_data_ranges
+                for remaining_range in self.find_missing_data_ranges(data, missing_start_datetime_utc, missing_end_datetime_utc, frequency=frequency, frequency_type=frequency_type, symbol=symbol)
+            ]
 
-            else:
-                # Made it through all api sources, here is the final data and missing_data_ranges we found
-                return data, missing_data_ranges
-            
         return data, missing_data_ranges
 
 
-    def get_historical_price_data_from_database(self, start_datetime_utc: datetime, end_datetime_utc: datetime, frequency: str, frequency_type: str, need_extended_hours_data: bool, symbol: Optional[str] = None, gics_sector: Optional[str] = None, adjusted_close: bool = True, **filters) -> List[Dict[str, Union[int, str, float]]]:
+    @staticmethod
+    def merge_bar_arrays(bar_arrays: List[np.ndarray]) -> np.ndarray:
+        """
+        Concatenates bar arrays of the same symbol, orders them by timestamp and keeps one bar per timestamp.
+        """
+        bars = np.concatenate([bar_array for bar_array in bar_arrays if len(bar_array)] or [empty_bar_array()])
+        _, first_index = np.unique(bars['timestamp'], return_index=True)
+        return bars[first_index]
+
+
+    def get_historical_price_data_from_database(self, start_datetime_utc: datetime, end_datetime_utc: datetime, frequency: str, frequency_type: str, need_extended_hours_data: bool, symbol: Optional[str] = None, gics_sector: Optional[str] = None, adjusted_close: bool = True, output: Optional[str] = None, chunk_size: int = 50000, **filters) -> Union[List[Dict[str, Union[int, str, float]]], np.ndarray, pd.DataFrame]:
         """
         Fetches historical price data from the database for a given symbol and specified date range and frequency.
 
@@ -184,11 +333,19 @@ class Historical_Price_Data_Mangager:
             symbol (str, optional): The stock or ETF symbol. If not provided, data for all entities will be returned.
             gics_sector (str, optional): The GICS sector of the entity. If provided, data for entities in the specified sector will be returned.
             adjusted_close (bool, optional): Whether to use the adjusted close price. Defaults to True.
+            output (str, optional): 'numpy', 'pandas' or 'arrow' to receive columnar data instead of a list of dictionaries. Rows are
+                streamed through a server-side cursor in chunks of chunk_size into preallocated typed arrays (see helpers/price_array_helper.py).
+                The columns are 'timestamp', 'open', 'high', 'low', 'close' and 'volume', plus 'entity_id' when no symbol is provided.
+            chunk_size (int, optional): Number of rows fetched per round-trip when output is columnar. Defaults to 50000.
             **filters: Additional filters to apply to the query. The keyword argument should be the column name and the value should be the filter value.
 
         Returns:
             list: A list of dictionaries containing the historical price data for the specified symbol and parameters. Each dictionary contains the following keys: 'timestamp', 'symbol', 'open', 'high', 'low', 'close', and 'volume'.
+            If output is provided, a NumPy structured array, pandas DataFrame or pyarrow Table ordered by timestamp is returned instead.
         """
+        if output is not None and output not in COLUMNAR_OUTPUTS:
+            raise ValueError(f"Invalid output: {output}. Please use one of the following: {', '.join(COLUMNAR_OUTPUTS)}")
+
         if symbol:
             entity_id = get_entity_id_from_symbol(symbol)
         else:
@@ -206,24 +363,41 @@ class Historical_Price_Data_Mangager:
         partition_type = Historical_Price_Data.determine_partition_type(frequency, frequency_type)
 
         # Use partition type to determine the table to query from
-        # Reflect the partition table from the database
-        metadata = MetaData()
+        # The partition table is reflected once per process and cached by Table_Registry, None means it does not exist.
+        # Partition types with a rollup (1 hour, daily) are served from the rollup for its complete buckets
+        query_table = self.get_read_table(partition_type)
+
+        if query_table is None:
+            print(f"Table {Partition_Manager.parent_table_name(partition_type)} does not exist.")
+            if output is not None:
+                return bar_array_to_output(empty_bar_array(BAR_DTYPE if entity_id else ENTITY_BAR_DTYPE), output)
+            return []
 
-        # Check if the table exists
-        inspector = inspect(self.db.engine)
+        # The entities table is mapped by the Entity model, no need to reflect it
+        entity_table = Entity.__table__
 
-        if not inspector.has_table(f'Historical_Price_Data_{partition_type.capitalize()}'):
-            print(f"Table Historical_Price_Data_{partition_type.capitalize()} does not exist.")
-            return []
+        close_column = query_table.c.adjusted_close.label('close') if adjusted_close else query_table.c.close
 
-        query_table = Table(f'Historical_Price_Data_{partition_type.capitalize()}', metadata, autoload_with=self.db.engine)
-        entity_table = Table('Entity', metadata, autoload_with=self.db.engine)
-            
         # Construct the base query
-        if adjusted_close:
+        if output is not None:
+            # Columnar results, select the columns in the same order as the fields of the structured dtype we fill
+            bar_dtype = BAR_DTYPE if entity_id else ENTITY_BAR_DTYPE
+            columns = {
+                'entity_id': query_table.c.entity_id,
+                'timestamp': query_table.c.timestamp,
+                'open': query_table.c.open,
+                'high': query_table.c.high,
+                'low': query_table.c.low,
+                'close': close_column,
+                'volume': query_table.c.volume,
+            }
+            query = select([columns[name] for name in bar_dtype.names])
+            if gics_sector:
+                query = query.select_from(query_table.join(entity_table, query_table.c.entity_id == entity_table.c.id))
+        elif adjusted_close:
             query = select([
                 query_table.c.timestamp,
-                entity_table.c.symbol,
+                entity_table.c.code.label('symbol'),
                 query_table.c.open,
                 query_table.c.high,
                 query_table.c.low,
@@ -235,7 +409,7 @@ class Historical_Price_Data_Mangager:
         else:
             query = select([
                 query_table.c.timestamp,
-                entity_table.c.symbol,
+                entity_table.c.code.label('symbol'),
                 query_table.c.open,
                 query_table.c.high,
                 query_table.c.low,
@@ -267,6 +441,15 @@ class Historical_Price_Data_Mangager:
         for column, value in filters.items():
             query = query.where(getattr(query_table.c, column) == value)
 
+        query = query.order_by(query_table.c.timestamp)
+
+        # Stream columnar results through a server-side cursor so only one chunk of rows is held at a time
+        if output is not None:
+            with self.db.session_scope() as session:
+                result = session.execute(query.execution_options(stream_results=True))
+                bars = rows_to_bar_array(result.partitions(chunk_size), dtype=bar_dtype)
+            return bar_array_to_output(bars, output)
+
         # Execute the query and return the results
         with self.db.session_scope() as session:
             result = session.execute(query)
@@ -275,120 +458,689 @@ class Historical_Price_Data_Mangager:
         return data
 
 
-    def find_missing_data_ranges(self, data: List[dict], start_datetime_utc: datetime, end_datetime_utc: datetime, frequency: int, frequency_type: str) -> List[Tuple[int, int]]:
+    def get_historical_price_data_from_database_for_symbols(self, symbols: List[str], start_datetime_utc: datetime, end_datetime_utc: datetime, frequency: str, frequency_type: str, need_extended_hours_data: bool, adjusted_close: bool = True, chunk_size: int = 50000) -> Dict[str, np.ndarray]:
+        """
+        Fetches historical price data for many symbols with one entity lookup and one query against the partition table
+        (entity_id = ANY(:entity_ids)), instead of one lookup, reflection and query per symbol.
+
+        Parameters:
+            symbols (list[str]): The stock or ETF symbols.
+            start_datetime_utc (datetime): The start of the requested window.
+            end_datetime_utc (datetime): The end of the requested window.
+            frequency (str): The frequency of the historical price data.
+            frequency_type (str): The type of frequency for the historical price data.
+            need_extended_hours_data (bool): Whether to include extended hours data in the historical price data.
+            adjusted_close (bool, optional): Whether to use the adjusted close price. Defaults to True.
+            chunk_size (int, optional): Number of rows fetched per round-trip from the server-side cursor. Defaults to 50000.
+
+        Returns:
+            dict: Maps every requested symbol to a structured array of its bars (BAR_DTYPE) ordered by timestamp. Symbols
+            without data, or unknown to the entities table, map to an empty array.
         """
-        Finds and returns the missing data ranges (by timestamp) between the provided data and the specified start and end timestamps.
+        data = {symbol: empty_bar_array() for symbol in symbols}
+
+        entity_ids = get_entity_ids_from_symbols(symbols)
+        if not entity_ids:
+            return data
+        symbols_by_entity_id = {entity_id: symbol for symbol, entity_id in entity_ids.items()}
+
+        partition_type = Historical_Price_Data.determine_partition_type(frequency, frequency_type)
+        query_table = self.get_read_table(partition_type)
+        if query_table is None:
+            logger.error(f"Table {Partition_Manager.parent_table_name(partition_type)} does not exist.")
+            return data
+
+        close_column = query_table.c.adjusted_close if adjusted_close else query_table.c.close
+        query = select([
+            query_table.c.entity_id,
+            query_table.c.timestamp,
+            query_table.c.open,
+            query_table.c.high,
+            query_table.c.low,
+            close_column,
+            query_table.c.volume,
+        ]).where(
+            query_table.c.entity_id == any_(bindparam('entity_ids', value=list(entity_ids.values()), type_=ARRAY(Integer)))
+        ).where(
+            query_table.c.timestamp.between(datetime_utc_to_timestamp_utc_ms(start_datetime_utc), datetime_utc_to_timestamp_utc_ms(end_datetime_utc))
+        )
+
+        if not need_extended_hours_data:
+            query = query.where(query_table.c.is_regular_trading_hours)
+
+        query = query.order_by(query_table.c.entity_id, query_table.c.timestamp)
+
+        with self.db.session_scope() as session:
+            result = session.execute(query.execution_options(stream_results=True))
+            bars = rows_to_bar_array(result.partitions(chunk_size), dtype=ENTITY_BAR_DTYPE)
+
+        # Rows are ordered by entity_id, so each entity is one contiguous slice of the array
+        entity_boundaries = np.flatnonzero(np.diff(bars['entity_id'])) + 1
+        for entity_bars in np.split(bars, entity_boundaries):
+            if not len(entity_bars):
+                continue
+            symbol_bars = np.empty(len(entity_bars), dtype=BAR_DTYPE)
+            for name in BAR_DTYPE.names:
+                symbol_bars[name] = entity_bars[name]
+            data[symbols_by_entity_id[int(entity_bars['entity_id'][0])]] = symbol_bars
+
+        return data
+
+
+    def get_read_table(self, partition_type: str):
+        """
+        Returns what bars of a partition type are read from. For partition types with a rollup (models/price_rollup.py) this is
+        the complete rollup buckets (bar_count reached expected_bar_count) plus every partition table row whose bucket has no
+        complete rollup row, as one UNION ALL subquery with the partition table's columns. Partial rollup buckets are never
+        served, a bucket still being filled in is read from the partition table until its rollup is complete.
+
+        Returns:
+            Table or Alias: The partition table, the union subquery, or None if the partition table does not exist.
+        """
+        query_table = Table_Registry.get_table(Partition_Manager.parent_table_name(partition_type), self.db.engine)
+        rollup_model = ROLLUP_MODELS.get(partition_type)
+        if query_table is None or rollup_model is None:
+            return query_table
+
+        rollup_table = Table_Registry.get_table(rollup_model.__tablename__, self.db.engine)
+        if rollup_table is None:
+            return query_table
+
+        column_names = ['entity_id', 'timestamp', 'open', 'high', 'low', 'close', 'adjusted_close', 'volume', 'is_regular_trading_hours', 'source', 'last_updated']
+        complete = rollup_table.c.bar_count >= rollup_table.c.expected_bar_count
+        rollup_rows = select([literal('Rollup').label(name) if name == 'source' else rollup_table.c[name] for name in column_names]).where(complete)
+        # Anti-join, a partition row is only read when the rollup has no complete bucket for the same entity and timestamp
+        partition_rows = select([query_table.c[name] for name in column_names]).where(
+            ~exists().where(and_(rollup_table.c.entity_id == query_table.c.entity_id, rollup_table.c.timestamp == query_table.c.timestamp, complete))
+        )
+        return union_all(partition_rows, rollup_rows).alias(f'historical_price_data_{partition_type}_with_rollup')
+
+
+    @staticmethod
+    def select_rollup_buckets(calendar: Trading_Calendar, pending_ranges: List[Tuple[int, int]], frequency: int, frequency_type: str) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """
+        Returns the rollup buckets touched by the queued 1 minute ranges, as runs of consecutive buckets so each run is read
+        from the 1 minute partitions in one query.
 
         Args:
-            data (list[dict]): A list of dictionaries containing historical price data.
-            start_timestamp (int): The start timestamp for the data range.
-            end_timestamp (int): The end timestamp for the data range.
-            frequency (int): The frequency of the data ('1min', '5min', '30min', '1hour', '4hour', 'daily', 'weekly', 'monthly').
-            frequency_type (str): The frequency type of the data ('minute', 'hour', 'day', 'week', 'month').
+            calendar (Trading_Calendar): The calendar of the entity.
+            pending_ranges (list[tuple[int, int]]): The queued (first, last) UTC ms ranges, inclusive.
+            frequency (int), frequency_type (str): The frequency of the rollup.
 
         Returns:
-            list[tuple[int, int]]: A list of tuples containing the missing data ranges as start and end timestamps.
+            list[tuple[np.ndarray, np.ndarray]]: (bucket starts, bucket ends) UTC ms per run, in order.
         """
-        if not data:
-            return [(start_datetime_utc, end_datetime_utc)]
+        if not pending_ranges:
+            return []
+        firsts, lasts = np.array(pending_ranges, dtype=np.int64).reshape(-1, 2).T
+        bucket_starts, bucket_ends = calendar.expected_buckets(int(firsts.min()), int(lasts.max()), frequency, frequency_type)
+
+        # A bucket is touched when it overlaps any range, bucket_ends > first and bucket_starts <= last
+        touched = np.zeros(len(bucket_starts) + 1, dtype=np.int64)
+        np.add.at(touched, np.searchsorted(bucket_ends, firsts, side='right'), 1)
+        np.add.at(touched, np.searchsorted(bucket_starts, lasts, side='right'), -1)
+        affected = np.flatnonzero(np.cumsum(touched[:-1]) > 0)
+        if not len(affected):
+            return []
+        runs = np.split(affected, np.flatnonzero(np.diff(affected) > 1) + 1)
+        return [(bucket_starts[run], bucket_ends[run]) for run in runs]
+
+    @staticmethod
+    def rollup_source_bars(calendar: Trading_Calendar, source_bars: np.ndarray, bucket_starts: np.ndarray, bucket_ends: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Aggregates the regular session 1 minute bars of a run of buckets, see resample_bars.
 
-        missing_data_ranges = []
+        Returns:
+            tuple[np.ndarray, np.ndarray, np.ndarray]: The rolled up bars, one per bucket holding at least one bar, the number of
+            1 minute bars each was built from and the number of 1 minute bars the calendar expects in its bucket.
+        """
+        source_bars = source_bars[calendar.is_session(source_bars['timestamp'])]
+        bars, bucket_index = resample_bars(source_bars, bucket_starts, bucket_ends)
+        minute_starts, _ = calendar.expected_buckets(int(bucket_starts[0]), int(bucket_ends[-1]) - 1, 1, 'minute')
+        bar_counts = count_per_bucket(source_bars['timestamp'], bucket_starts, bucket_ends)[bucket_index]
+        expected_bar_counts = count_per_bucket(minute_starts, bucket_starts, bucket_ends)[bucket_index]
+        return bars, bar_counts, expected_bar_counts
+
+    def refresh_rollups(self, symbols: Optional[List[str]] = None, entity_ids: Optional[List[int]] = None, rebuild: bool = False, chunk_size: int = 50000) -> None:
+        """
+        Brings the rollups (models/price_rollup.py) up to date with the stored 1 minute bars. For each entity the 1 minute ranges
+        queued by Price_Staging.merge_pending are claimed, the buckets they touch are re-aggregated from every 1 minute bar of
+        those buckets and upserted, and the claimed ranges are deleted, all in one transaction. Ranges queued while we refresh
+        are left for the next refresh.
 
-        def process_gap(gap_start, gap_end):
-            while gap_start <= gap_end:
-                if self.is_during_trading_hours(gap_start):
-                    gap_start += delta
+        Args:
+            symbols (list[str], optional): Only refresh these symbols.
+            entity_ids (list[int], optional): Only refresh these entities. Defaults to every entity with queued ranges.
+            rebuild (bool, optional): Queue every stored 1 minute bar of the entities first, e.g. for bars written before
+                the rollups existed. Defaults to False.
+            chunk_size (int, optional): Number of rows fetched per round-trip. Defaults to 50000.
+        """
+        source_table = Table_Registry.get_table(Partition_Manager.parent_table_name(ROLLUP_SOURCE_PARTITION_TYPE), self.db.engine)
+        if source_table is None:
+            return
+        created_tables = [model.__table__ for model in ROLLUP_MODELS.values()] + [Price_Rollup_Pending.__table__]
+        Base.metadata.create_all(self.db.engine, tables=created_tables)
+        for table in created_tables:
+            Table_Registry.invalidate(table.name)
+
+        pending_table = Price_Rollup_Pending.__table__
+        with self.db.session_scope() as session:
+            if symbols:
+                entity_symbols = {entity_id: symbol for symbol, entity_id in get_entity_ids_from_symbols(symbols).items()}
+            else:
+                query = select([Entity.__table__.c.id, Entity.__table__.c.code])
+                if entity_ids:
+                    query = query.where(Entity.__table__.c.id.in_(entity_ids))
+                elif rebuild:
+                    query = query.where(Entity.__table__.c.id.in_(select([source_table.c.entity_id]).distinct()))
                 else:
-                    gap_start += timedelta(minutes=1)
-                if gap_start > gap_end:
-                    break
-                missing_data_ranges.append((gap_start, gap_end))
+                    query = query.where(Entity.__table__.c.id.in_(select([pending_table.c.entity_id]).distinct()))
+                entity_symbols = {row.id: row.code for row in session.execute(query)}
+
+            if rebuild and entity_symbols:
+                session.execute(pending_table.insert().from_select(
+                    ['id', 'entity_id', 'first_timestamp', 'last_timestamp', 'queued_at'],
+                    select([func.nextval('price_rollup_pending_id_seq'), source_table.c.entity_id, func.min(source_table.c.timestamp), func.max(source_table.c.timestamp), literal(get_current_datetime_utc())])
+                    .where(source_table.c.entity_id.in_(list(entity_symbols))).group_by(source_table.c.entity_id)
+                ))
+
+        for entity_id, symbol in entity_symbols.items():
+            calendar = Trading_Calendar.for_symbol(symbol)
+            with self.db.session_scope() as session:
+                # Claimed ranges stay locked until their buckets are upserted, a concurrent refresh skips them
+                pending = session.query(Price_Rollup_Pending).filter_by(entity_id=entity_id).with_for_update(skip_locked=True).all()
+                if not pending:
+                    continue
+                pending_ranges = [(pending_range.first_timestamp, pending_range.last_timestamp) for pending_range in pending]
+
+                for partition_type, rollup_model in ROLLUP_MODELS.items():
+                    frequency, frequency_type = Historical_Price_Data.partition_frequencies[partition_type]
+                    rollup_rows = []
+                    for run_starts, run_ends in self.select_rollup_buckets(calendar, pending_ranges, frequency, frequency_type):
+                        source_bars = self.get_resample_source_bars(entity_id, ROLLUP_SOURCE_PARTITION_TYPE, int(run_starts[0]), int(run_ends[-1]) - 1, chunk_size=chunk_size)
+                        bars, bar_counts, expected_bar_counts = self.rollup_source_bars(calendar, source_bars, run_starts, run_ends)
+                        rollup_rows.extend(
+                            {
+                                'entity_id': entity_id, 'timestamp': int(bar['timestamp']), 'open': float(bar['open']), 'high': float(bar['high']), 'low': float(bar['low']),
+                                'close': float(bar['close']), 'adjusted_close': float(bar['adjusted_close']), 'volume': float(bar['volume']),
+                                'is_regular_trading_hours': True, 'bar_count': int(bar_count), 'expected_bar_count': int(expected_bar_count), 'last_updated': get_current_datetime_utc(),
+                            }
+                            for bar, bar_count, expected_bar_count in zip(bars, bar_counts, expected_bar_counts)
+                        )
+
+                    if rollup_rows:
+                        upsert = postgresql_insert(rollup_model.__table__)
+                        session.execute(upsert.on_conflict_do_update(
+                            index_elements=['entity_id', 'timestamp'],
+                            set_={name: upsert.excluded[name] for name in ('open', 'high', 'low', 'close', 'adjusted_close', 'volume', 'bar_count', 'expected_bar_count', 'last_updated')},
+                        ), rollup_rows)
+                    logger.info(f"Refreshed {partition_type} rollup for {symbol}: {len(rollup_rows)} buckets from {len(pending_ranges)} queued 1 minute ranges")
+
+                session.query(Price_Rollup_Pending).filter(Price_Rollup_Pending.id.in_([pending_range.id for pending_range in pending])).delete(synchronize_session=False)
+
+
+    def find_missing_data_ranges(self, data: List[dict], start_datetime_utc: datetime, end_datetime_utc: datetime, frequency: int, frequency_type: str, symbol: Optional[str] = None) -> List[Tuple[datetime, datetime]]:
+        """
+        Finds and returns the missing data ranges between the provided data and the specified start and end datetimes.
 
-        data_start_timestamp = data[0].timestamp
-        data_end_timestamp = data[-1].timestamp
+        The expected bar grid is built from the exchange session calendar of the symbol (working days, holidays, local
+        open/close) and diffed against the stored timestamps with NumPy, see helpers/gap_helper.py. Consecutive missing
+        bars are merged into a single range so that we make as few API requests as possible.
 
+        Args:
+            data (list[dict] or np.ndarray): Historical price data as returned by get_historical_price_data_from_database.
+            start_datetime_utc (datetime): The start datetime for the data range.
+            end_datetime_utc (datetime): The end datetime for the data range.
+            frequency (int): The frequency of the data.
+            frequency_type (str): The frequency type of the data ('minute', 'hour', 'daily', 'weekly', 'monthly').
+            symbol (str, optional): The symbol the data belongs to, used to look up its exchange calendar. Regular US
+                equity hours are assumed if not provided or unknown.
+
+        Returns:
+            list[tuple[datetime, datetime]]: A list of tuples containing the missing data ranges as start and end datetimes (UTC).
+        """
         start_timestamp = datetime_utc_to_timestamp_utc_ms(start_datetime_utc)
-        if data_start_timestamp > start_timestamp:
-            process_gap(start_timestamp, data_start_timestamp - timedelta(minutes=1))
         end_timestamp = datetime_utc_to_timestamp_utc_ms(end_datetime_utc)
-        if data_end_timestamp < end_timestamp:
-            process_gap(data_end_timestamp + timedelta(minutes=1), end_timestamp)
 
-        for i in range(len(data) - 1):
-            current_data_timestamp = data[i].timestamp
-            next_data_timestamp = data[i + 1].timestamp
+        return Trading_Calendar.for_symbol(symbol).find_missing_ranges(
+            extract_timestamps_ms(data), start_timestamp, end_timestamp, frequency=frequency, frequency_type=frequency_type)
 
-            delta = None
-            if frequency_type == "minute":
-                delta = timedelta(minutes=frequency)
-            elif frequency_type == "hour":
-                delta = timedelta(hours=frequency)
-            elif frequency_type == "daily":
-                delta = timedelta(days=frequency)
-            elif frequency_type == "weekly":
-                delta = timedelta(weeks=frequency)
-            elif frequency_type == "monthly":
-                delta = timedelta(days=frequency * 30)
 
-            if current_data_timestamp + delta < next_data_timestamp:
-                process_gap(current_data_timestamp + delta, next_data_timestamp - delta)
+    def find_uncovered_data_ranges(self, symbol: str, start_datetime_utc: datetime, end_datetime_utc: datetime, frequency: int, frequency_type: str) -> Optional[List[Tuple[datetime, datetime]]]:
+        """
+        Finds the missing data ranges from the coverage index (models/price_coverage.py) instead of the stored bars.
 
-        return missing_data_ranges
+        Returns:
+            list[tuple[datetime, datetime]]: The uncovered ranges as start and end datetimes (UTC), or None if the
+            coverage index has not been built for this partition type yet and the bars have to be diffed instead.
+        """
+        uncovered_data_ranges = self.find_uncovered_data_ranges_for_symbols([symbol], start_datetime_utc, end_datetime_utc, frequency=frequency, frequency_type=frequency_type)
+        return None if uncovered_data_ranges is None else uncovered_data_ranges[symbol]
 
 
+    def find_uncovered_data_ranges_for_symbols(self, symbols: List[str], start_datetime_utc: datetime, end_datetime_utc: datetime, frequency: int, frequency_type: str) -> Optional[Dict[str, List[Tuple[datetime, datetime]]]]:
+        """
+        Batch version of find_uncovered_data_ranges, reads the coverage of every symbol with one query.
 
-    def get_historical_data_from_td_ameritrade_and_write_to_database(self, symbol: str, start_datetime_utc: datetime = None, end_datetime_utc: datetime = None, frequency: Union[str, int] = None, frequency_type: Optional[str] = None, need_extended_hours_data: bool = True, missing_data_ranges = None) -> List:   
+        Returns:
+            dict: Maps each symbol to its uncovered ranges, or None if the coverage index has not been built for this partition type.
+        """
+        partition_type = Historical_Price_Data.determine_partition_type(frequency, frequency_type)
         start_timestamp = datetime_utc_to_timestamp_utc_ms(start_datetime_utc)
         end_timestamp = datetime_utc_to_timestamp_utc_ms(end_datetime_utc)
+        entity_ids = get_entity_ids_from_symbols(symbols)
+
+        with self.db.session_scope() as session:
+            if not Price_Coverage.is_built(session, partition_type):
+                return None
+            covered_ranges = Price_Coverage.get_ranges_for_entities(session, list(entity_ids.values()), partition_type, start_timestamp, end_timestamp)
 
-        open_time, close_time = get_market_hours(symbol)
-        # Convert open and close times to timestamps for the comparison day
-        open_timestamp = datetime.combine(start_datetime_utc.date(), open_time).timestamp() * 1000
-        close_timestamp = datetime.combine(start_datetime_utc.date(), close_time).timestamp() * 1000
+        return {
+            symbol: Trading_Calendar.for_symbol(symbol).find_uncovered_ranges(
+                covered_ranges.get(entity_ids.get(symbol), []), start_timestamp, end_timestamp, frequency=frequency, frequency_type=frequency_type)
+            for symbol in symbols
+        }
 
-        data = self.td_hist_data.get_historical_data_from_td_ameritrade(symbol=symbol, start_timestamp=start_timestamp, end_timestamp=end_timestamp, frequency=frequency, frequency_type=frequency_type, need_extended_hours_data=need_extended_hours_data, missing_data_ranges=missing_data_ranges)
 
+    def rebuild_price_coverage(self, symbols: Optional[List[str]] = None, partition_types: Optional[List[str]] = None, chunk_size: int = 50000) -> None:
+        """
+        Rebuilds the coverage index (models/price_coverage.py) from the bars stored in the partition tables. Each entity's
+        timestamps are read on their own and split into the ranges that have no missing expected bar.
+
+        Args:
+            symbols (list[str], optional): Only rebuild these symbols. Defaults to every entity with stored bars.
+            partition_types (list[str], optional): Only rebuild these partition types. Defaults to all of them.
+            chunk_size (int, optional): Number of timestamps fetched per round-trip. Defaults to 50000.
+        """
+        Base.metadata.create_all(self.db.engine, tables=[Price_Coverage.__table__, Update_Tracking.__table__])
+        timestamp_dtype = np.dtype([('timestamp', np.int64)])
+
+        for partition_type in partition_types or list(Historical_Price_Data.partition_frequencies):
+            query_table = Table_Registry.get_table(Partition_Manager.parent_table_name(partition_type), self.db.engine)
+            if query_table is None:
+                continue
+            frequency, frequency_type = Historical_Price_Data.partition_frequencies[partition_type]
+
+            with self.db.session_scope() as session:
+                if symbols:
+                    entity_ids = get_entity_ids_from_symbols(symbols)
+                else:
+                    entity_ids = {row.code: row.entity_id for row in session.execute(
+                        select([Entity.__table__.c.code, query_table.c.entity_id]).distinct().select_from(
+                            query_table.join(Entity.__table__, query_table.c.entity_id == Entity.__table__.c.id)))}
+
+            for symbol, entity_id in entity_ids.items():
+                query = select([query_table.c.timestamp]).where(query_table.c.entity_id == entity_id).order_by(query_table.c.timestamp)
+                with self.db.session_scope() as session:
+                    result = session.execute(query.execution_options(stream_results=True))
+                    timestamps = rows_to_bar_array(result.partitions(chunk_size), dtype=timestamp_dtype)['timestamp']
+                    covered_from, covered_to = Trading_Calendar.for_symbol(symbol).find_covered_ranges(timestamps, frequency, frequency_type)
+                    Price_Coverage.replace_ranges(session, entity_id, partition_type, zip(covered_from, covered_to))
+                logger.info(f"Rebuilt {partition_type} price coverage for {symbol}: {len(covered_from)} ranges from {len(timestamps)} bars")
+
+            # A partial rebuild (only some symbols) does not make the whole partition type trustworthy
+            if not symbols:
+                with self.db.session_scope() as session:
+                    Price_Coverage.mark_built(session, partition_type)
+
+
+    def resample_from_database_and_write_to_database(self, symbol: str, start_datetime_utc: datetime = None, end_datetime_utc: datetime = None, frequency: Union[str, int] = None, frequency_type: Optional[str] = None, need_extended_hours_data: bool = True, missing_data_ranges = None) -> List[Tuple[datetime, datetime]]:
+        """
+        Builds the missing bars from finer bars already stored in the database (e.g. 1 hour bars from 1 minute bars) and
+        writes them to the partition table, so no api quota is spent on data we can compute. Buckets come from the
+        exchange session calendar and a coarser bar is only written if every finer bar it is built from is stored.
+        Same signature and return value as the api sources used by gather_data.
+
+        Returns:
+            list[tuple[datetime, datetime]]: The ranges that bars were written for, so the caller only has to re-read those.
+        """
+        partition_type = Historical_Price_Data.determine_partition_type(frequency, frequency_type)
+        target_frequency, target_frequency_type = Historical_Price_Data.partition_frequencies[partition_type]
+        entity_id = get_entity_id_from_symbol(symbol)
+        if entity_id is None:
+            return []
+
+        calendar = Trading_Calendar.for_symbol(symbol)
+        resampled_bars = []
+        for missing_start_datetime_utc, missing_end_datetime_utc in missing_data_ranges or [(start_datetime_utc, end_datetime_utc)]:
+            start_timestamp = datetime_utc_to_timestamp_utc_ms(missing_start_datetime_utc)
+            end_timestamp = datetime_utc_to_timestamp_utc_ms(missing_end_datetime_utc)
+            bucket_starts, bucket_ends = calendar.expected_buckets(start_timestamp, end_timestamp, target_frequency, target_frequency_type)
+            filled = np.zeros(len(bucket_starts), dtype=bool)
+
+            for source_partition_type in Historical_Price_Data.resample_sources.get(partition_type, []):
+                if filled.all():
+                    break
+                source_frequency, source_frequency_type = Historical_Price_Data.partition_frequencies[source_partition_type]
+                # Read the whole buckets, the missing range may start or end in the middle of one
+                source_bars = self.get_resample_source_bars(entity_id, source_partition_type, int(bucket_starts[~filled].min()), int(bucket_ends[~filled].max()) - 1)
+                if not len(source_bars):
+                    continue
+                if source_frequency_type in ('minute', 'hour'):
+                    # Coarser bars are built from regular session bars only
+                    source_bars = source_bars[calendar.is_session(source_bars['timestamp'])]
+
+                bars, bucket_index = resample_bars(source_bars, bucket_starts, bucket_ends)
+                source_bucket_starts, _ = calendar.expected_buckets(int(bucket_starts[0]), int(bucket_ends[-1]) - 1, source_frequency, source_frequency_type)
+                expected_counts = count_per_bucket(source_bucket_starts, bucket_starts, bucket_ends)
+                stored_counts = count_per_bucket(source_bars['timestamp'], bucket_starts, bucket_ends)
+                complete = (stored_counts[bucket_index] >= expected_counts[bucket_index]) & ~filled[bucket_index]
+
+                resampled_bars.append(bars[complete])
+                filled[bucket_index[complete]] = True
+
+        resampled_bars = [bars for bars in resampled_bars if len(bars)]
+        if not resampled_bars:
+            return []
+        bars = np.concatenate(resampled_bars)
+
+        Partition_Manager.ensure_partitions(self.db.engine, partition_type, int(bars['timestamp'].min()), int(bars['timestamp'].max()))
+        target_table = Table_Registry.get_table(Partition_Manager.parent_table_name(partition_type), self.db.engine)
+        last_updated = get_current_datetime_utc()
+        with self.db.session_scope() as session:
+            session.execute(postgresql_insert(target_table).on_conflict_do_nothing(), [
+                {
+                    'entity_id': entity_id, 'timestamp': int(bar['timestamp']), 'open': float(bar['open']), 'high': float(bar['high']), 'low': float(bar['low']),
+                    'close': float(bar['close']), 'adjusted_close': float(bar['adjusted_close']), 'volume': float(bar['volume']),
+                    'is_regular_trading_hours': True, 'source': 'Resampled', 'last_updated': last_updated, 'updated_by': self.updater_name,
+                }
+                for bar in bars
+            ])
+
+        requested_data_ranges = missing_data_ranges or [(start_datetime_utc, end_datetime_utc)]
+        written_data_ranges = self.get_written_data_ranges(bars['timestamp'], requested_data_ranges)
+        # Buckets that could not be resampled are left out of the coverage, the api sources still have to fill them
+        with self.db.session_scope() as session:
+            Price_Coverage.add_ranges(session, entity_id, partition_type, self.get_covered_data_ranges(
+                calendar, bars['timestamp'], self.data_ranges_to_timestamps(requested_data_ranges), target_frequency, target_frequency_type), calendar=calendar)
+
+        logger.info(f"Resampled {len(bars)} {partition_type} bars for {symbol} from stored data")
+        return written_data_ranges
+
+
+    def get_resample_source_bars(self, entity_id: int, partition_type: str, start_timestamp: int, end_timestamp: int, chunk_size: int = 50000) -> np.ndarray:
+        """
+        Reads the bars of one entity from a partition table with both close and adjusted_close, for resampling.
+
+        Returns:
+            np.ndarray: Structured array (RESAMPLE_SOURCE_DTYPE) ordered by timestamp, empty if the table does not exist.
+        """
+        query_table = Table_Registry.get_table(Partition_Manager.parent_table_name(partition_type), self.db.engine)
+        if query_table is None:
+            return empty_bar_array(RESAMPLE_SOURCE_DTYPE)
+
+        query = select([getattr(query_table.c, name) for name in RESAMPLE_SOURCE_DTYPE.names]).where(
+            query_table.c.entity_id == entity_id
+        ).where(
+            query_table.c.timestamp.between(start_timestamp, end_timestamp)
+        ).order_by(query_table.c.timestamp)
+
+        with self.db.session_scope() as session:
+            result = session.execute(query.execution_options(stream_results=True))
+            return rows_to_bar_array(result.partitions(chunk_size), dtype=RESAMPLE_SOURCE_DTYPE)
+
+
+    def get_historical_data_from_td_ameritrade_and_write_to_database(self, symbol: str, start_datetime_utc: datetime = None, end_datetime_utc: datetime = None, frequency: Union[str, int] = None, frequency_type: Optional[str] = None, need_extended_hours_data: bool = True, missing_data_ranges = None) -> List[Tuple[datetime, datetime]]:   
+        """
+        Fetches the missing data ranges from TD Ameritrade, stages the bars and merges them into the partition tables.
+        A call identical to one in flight waits for it and shares its result instead of fetching and writing again.
+
+        Returns:
+            list[tuple[datetime, datetime]]: The ranges that bars were written for, so the caller only has to re-read those.
+        """
+        requested_data_ranges = missing_data_ranges or [(start_datetime_utc, end_datetime_utc)]
+        key = (
+            TD_Ameritrade_Historical.get_request_key('ingest', symbol, frequency=frequency, frequency_type=frequency_type, need_extended_hours_data=need_extended_hours_data),
+            tuple((datetime_utc_to_timestamp_utc_ms(requested_start), datetime_utc_to_timestamp_utc_ms(requested_end)) for requested_start, requested_end in requested_data_ranges),
+        )
+        return self._ingest_single_flight.do(key, self._fetch_from_td_ameritrade_and_write_to_database, symbol, start_datetime_utc=start_datetime_utc, end_datetime_utc=end_datetime_utc, frequency=frequency, frequency_type=frequency_type, need_extended_hours_data=need_extended_hours_data, missing_data_ranges=missing_data_ranges)
+
+
+    def _fetch_from_td_ameritrade_and_write_to_database(self, symbol: str, start_datetime_utc: datetime = None, end_datetime_utc: datetime = None, frequency: Union[str, int] = None, frequency_type: Optional[str] = None, need_extended_hours_data: bool = True, missing_data_ranges = None) -> List[Tuple[datetime, datetime]]:
+        """
+        Body of get_historical_data_from_td_ameritrade_and_write_to_database, run once per set of identical concurrent calls.
+        """
+        # fetch -> parse -> validate -> stage, one api response at a time. The next request is in flight while a response
+        # is staged and at most INGEST_MAX_BUFFERED_RESPONSES wait to be staged, so memory stays flat for any range length.
+        responses = self.td_hist_data.iter_historical_data_from_td_ameritrade(symbol=symbol, frequency=frequency, frequency_type=frequency_type, start_datetime_utc=start_datetime_utc, end_datetime_utc=end_datetime_utc, need_extended_hours_data=need_extended_hours_data, missing_data_ranges=missing_data_ranges)
+        responses = prefetch(responses, max_buffered=self.INGEST_MAX_BUFFERED_RESPONSES, name=f'td_ameritrade_fetch_{symbol}')
+        return self._stage_td_ameritrade_responses(symbol, responses, frequency, frequency_type, missing_data_ranges or [(start_datetime_utc, end_datetime_utc)])
+
+
+    def get_historical_data_from_td_ameritrade_for_symbols_and_write_to_database(self, missing_data_ranges_by_symbol: Dict[str, List[Tuple[datetime, datetime]]], frequency: Union[str, int], frequency_type: str, need_extended_hours_data: bool = True) -> Dict[str, List[Tuple[datetime, datetime]]]:
+        """
+        Fetches the missing data ranges of many symbols from TD Ameritrade in one pass of the asyncio fetch engine (every
+        request window of every symbol in flight at once, see TD_Ameritrade_Historical.async_get_historical_data_for_symbols),
+        then stages and merges the bars of each symbol like get_historical_data_from_td_ameritrade_and_write_to_database.
+        Every response is held until the pass is done, so this is meant for batches of symbols with short missing ranges.
+
+        Returns:
+            dict[str, list[tuple[datetime, datetime]]]: Per symbol, the ranges that bars were written for.
+        """
+        # The whole pass counts as one api caller against api_call_semaphore, the engine caps its own requests in flight
+        with self.api_call_semaphore:
+            responses_by_symbol = self.td_hist_data.get_historical_data_for_symbols_concurrently(missing_data_ranges_by_symbol, frequency, frequency_type, need_extended_hours_data=need_extended_hours_data)
+
+        written_data_ranges = {}
+        for symbol, responses in responses_by_symbol.items():
+            try:
+                written_data_ranges[symbol] = self._stage_td_ameritrade_responses(symbol, iter(responses), frequency, frequency_type, missing_data_ranges_by_symbol[symbol])
+            except Exception as e:
+                logger.error(f"Error writing TD Ameritrade data for {symbol}: {e}")
+                log_exception(e)
+                written_data_ranges[symbol] = []
+        return written_data_ranges
+
+
+    def _stage_td_ameritrade_responses(self, symbol: str, responses: Iterator[Tuple[List[dict], Tuple[datetime, datetime]]], frequency: Union[str, int], frequency_type: str, requested_data_ranges: List[Tuple[datetime, datetime]]) -> List[Tuple[datetime, datetime]]:
+        """
+        Parses, validates and stages TD Ameritrade responses ((candles, requested range) pairs) of one symbol, then merges
+        them unless a background merger was asked for.
+
+        Returns:
+            list[tuple[datetime, datetime]]: The parts of requested_data_ranges that bars were written for.
+        """
         # Define variables related to the data source, entity_id, and user
         data_source = 'TD Ameritrade'
         entity_id = get_entity_id_from_symbol(symbol)
+        if entity_id is None:
+            raise ValueError(f"Unknown symbol {symbol}, there is no entity to stage its bars for")
         last_updated = get_current_datetime_utc()
         updated_by = self.updater_name  # Set the appropriate user
-        
+
         # Determine partition type based on frequency and frequency_type
-        partition_type = Historical_Price_Data.determine_partition_type(frequency, frequency_type)  # Implement this function based on your requirements
+        partition_type = Historical_Price_Data.determine_partition_type(frequency, frequency_type)
+        partition_frequency, partition_frequency_type = Historical_Price_Data.partition_frequencies[partition_type]
+        calendar = Trading_Calendar.for_symbol(symbol)
+
+        requested_timestamps = self.data_ranges_to_timestamps(requested_data_ranges)
+        written_first, written_last = self.empty_written_bounds(len(requested_timestamps))
+
+        # Staging is an append to the UNLOGGED price_staging table (models/price_staging.py), the partitions and their
+        # indexes are only touched by merge_staged_bars.
+        # Repeated candles of overlapping responses are dropped by the merge, only their spans are recorded to tune the chunk planner
+        overlap_stats = Candle_Merge_Stats()
+        for candles, _ in responses:
+            if not candles:
+                continue
+            # Candles go straight into a bar array, no ORM object per candle
+            bars = candles_to_bar_array(candles)
+            overlap_stats.record_chunk(int(bars['timestamp'].min()), int(bars['timestamp'].max()), len(bars))
+            if partition_frequency_type in ('minute', 'hour'):
+                # Determine which intraday bars fall within the regular session of their own day
+                bars['is_regular_trading_hours'] = calendar.is_session(bars['timestamp'])
+
+            # Rejected bars are quarantined and leave holes, the bounds and coverage below only count the bars that passed
+            bars = Historical_Price_Data.validate_bars(bars, entity_id, partition_type, db=self.db, source=data_source, last_updated=last_updated, updated_by=updated_by)
+            if not len(bars):
+                continue
+
+            # The parts of the requested ranges this response covers without a missing bar, recorded in the coverage index
+            # once the batch is merged
+            covered_ranges = self.get_covered_data_ranges(calendar, bars['timestamp'], requested_timestamps, partition_frequency, partition_frequency_type)
+            Price_Staging.stage_bars(self.db, bars, entity_id, partition_type, data_source, last_updated, updated_by, covered_ranges)
+            self.update_written_bounds(bars['timestamp'], requested_timestamps, written_first, written_last)
+
+        if overlap_stats.overlapping_chunk_count:
+            logger.info(f"Fetched {symbol} {frequency} {frequency_type} responses: {overlap_stats.summary()}")
+
+        written = written_first <= written_last
+        if not written.any():
+            return []
+
+        # gather_data reads the bars back right away, so they are merged now unless a background merger was asked for.
+        # merge_staged_bars also refreshes the rollups of new 1 minute bars.
+        if self.merge_staged_bars_inline:
+            self.merge_staged_bars(partition_types=[partition_type], entity_ids=[entity_id])
+
+        # Report the ranges we actually wrote so gather_data only re-reads those
+        return [
+            (timestamp_utc_ms_to_datetime_utc(first), timestamp_utc_ms_to_datetime_utc(last))
+            for first, last in zip(written_first[written].tolist(), written_last[written].tolist())
+        ]
+
+
+    def merge_staged_bars(self, partition_types: Optional[List[str]] = None, entity_ids: Optional[List[int]] = None, max_batches: int = 500) -> int:
+        """
+        Merges the staged api responses (models/price_staging.py) into the partitions, max_batches responses per transaction,
+        and refreshes the 1 hour and daily rollups of the entities that got new 1 minute bars.
+
+        Args:
+            partition_types (list[str], optional): The partition types to merge. Defaults to all of them.
+            entity_ids (list[int], optional): Only merge the responses of these entities. Defaults to all entities.
+            max_batches (int, optional): Number of staged responses merged per transaction. Defaults to 500.
+
+        Returns:
+            int: The number of staged responses merged.
+        """
+        merged_batches = 0
+        for partition_type in partition_types or list(Historical_Price_Data.partition_ranges):
+            merged_entity_ids = set()
+            while True:
+                batch_count, batch_entity_ids = Price_Staging.merge_pending(self.db, partition_type, entity_ids=entity_ids, max_batches=max_batches, calendar_for_entity=Trading_Calendar.for_entity)
+                if not batch_count:
+                    break
+                merged_batches += batch_count
+                merged_entity_ids.update(batch_entity_ids)
+            # New 1 minute bars change the 1 hour and daily rollups of the buckets they fall in
+            if merged_entity_ids and partition_type == ROLLUP_SOURCE_PARTITION_TYPE:
+                self.refresh_rollups(entity_ids=sorted(merged_entity_ids))
+        return merged_batches
+
+    def start_staging_merger(self, interval_seconds: float = 30.0) -> None:
+        """
+        Starts a background thread merging staged responses every interval_seconds, and stops merging inline after each
+        fetch. For bulk backfills: fetching is no longer held up by the partition writes, but bars are only readable from
+        the partitions (and gather_data only sees them) once the merger got to them.
+        """
+        if self._staging_merger is not None:
+            return
+        self.merge_staged_bars_inline = False
+        stopped = threading.Event()
+
+        def merge_loop():
+            while not stopped.wait(interval_seconds):
+                try:
+                    self.merge_staged_bars()
+                except Exception as e:
+                    logger.error(f"Error merging staged bars: {e}")
+                    log_exception(e)
+
+        thread = threading.Thread(target=merge_loop, name='price_staging_merger', daemon=True)
+        self._staging_merger = (thread, stopped)
+        thread.start()
+
+    def stop_staging_merger(self) -> None:
+        """
+        Stops the background merger, merges whatever is still staged and goes back to merging inline after each fetch.
+        """
+        if self._staging_merger is None:
+            return
+        thread, stopped = self._staging_merger
+        stopped.set()
+        thread.join()
+        self._staging_merger = None
+        self.merge_staged_bars()
+        self.merge_staged_bars_inline = True
+
+    @staticmethod
+    def empty_written_bounds(range_count: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the (first, last) written timestamp per requested range before anything was written, first > last marks a range without bars.
+        """
+        return np.full(range_count, np.iinfo(np.int64).max, dtype=np.int64), np.full(range_count, np.iinfo(np.int64).min, dtype=np.int64)
 
-         # Initialize partition start and end
-        first_timestamp = data[0]['datetime']
-        current_partition_start, current_partition_end = Historical_Price_Data.get_partition_start_end(first_timestamp, partition_type)
+    @staticmethod
+    def update_written_bounds(written_timestamps: np.ndarray, requested_timestamps: np.ndarray, written_first: np.ndarray, written_last: np.ndarray) -> None:
+        """
+        Widens, in place, the first and last written timestamp of each requested range with the written bars that fall inside it.
 
-        # Group data points by partition
-        grouped_data = defaultdict(list)
-        current_parition_end_timestamp = datetime_utc_to_timestamp_utc_ms(current_partition_end)
-        # For each bar of data from TD Ameritrade api
-        for data_point in data:
-            # Determine if the timestamp falls within trading hours
-            is_regular_trading_hours = open_timestamp <= data_point['datetime'] < close_timestamp
+        Args:
+            written_timestamps (np.ndarray): Timestamps (UTC ms) of the bars that were written.
+            requested_timestamps (np.ndarray): (start, end) UTC ms of each requested range, shape (n, 2), inclusive.
+            written_first (np.ndarray), written_last (np.ndarray): Running bounds per requested range, see empty_written_bounds.
+        """
+        written_timestamps = np.sort(np.asarray(written_timestamps, dtype=np.int64))
+        first = np.searchsorted(written_timestamps, requested_timestamps[:, 0], side='left')
+        last = np.searchsorted(written_timestamps, requested_timestamps[:, 1], side='right') - 1
+        has_bars = first <= last
+        written_first[has_bars] = np.minimum(written_first[has_bars], written_timestamps[first[has_bars]])
+        written_last[has_bars] = np.maximum(written_last[has_bars], written_timestamps[last[has_bars]])
+
+    @classmethod
+    def get_written_data_ranges(cls, written_timestamps: np.ndarray, requested_data_ranges: List[Tuple[datetime, datetime]]) -> List[Tuple[datetime, datetime]]:
+        """
+        Narrows each requested range down to the first and last bar that was written inside it, ranges without any written bar are dropped.
 
+        Args:
+            written_timestamps (np.ndarray): Timestamps (UTC ms) of the bars that were written.
+            requested_data_ranges (list[tuple[datetime, datetime]]): The ranges that were requested from the source.
 
-            # Create an instance of Historical_Price_Data for this bar using from_td_ameritrade method
-            instance = Historical_Price_Data.from_td_ameritrade(data_point, entity_id, data_source, last_updated, updated_by, is_regular_trading_hours)
-            
-            timestamp = instance.timestamp
-            # If the current bars timestamp is outside of the current partition date range
-            if timestamp >= current_parition_end_timestamp:
-                # Write instances to the partition table
-                Historical_Price_Data.bulk_write_to_partition(grouped_data[current_partition_start], self.db, partition_type)
+        Returns:
+            list[tuple[datetime, datetime]]: The written ranges as UTC datetimes.
+        """
+        requested_timestamps = cls.data_ranges_to_timestamps(requested_data_ranges)
+        written_first, written_last = cls.empty_written_bounds(len(requested_timestamps))
+        cls.update_written_bounds(written_timestamps, requested_timestamps, written_first, written_last)
+        written = written_first <= written_last
+        return [
+            (timestamp_utc_ms_to_datetime_utc(first), timestamp_utc_ms_to_datetime_utc(last))
+            for first, last in zip(written_first[written].tolist(), written_last[written].tolist())
+        ]
+
+    @staticmethod
+    def data_ranges_to_timestamps(data_ranges: List[Tuple[datetime, datetime]]) -> np.ndarray:
+        """
+        Converts (start, end) datetime ranges into an int64 array of UTC ms, shape (n, 2).
+        """
+        return np.array([
+            (datetime_utc_to_timestamp_utc_ms(start_datetime_utc), datetime_utc_to_timestamp_utc_ms(end_datetime_utc))
+            for start_datetime_utc, end_datetime_utc in data_ranges
+        ], dtype=np.int64).reshape(-1, 2)
 
-                # Clear the data points for the previous partition
-                grouped_data[current_partition_start].clear()
+    @staticmethod
+    def get_covered_data_ranges(calendar: Trading_Calendar, written_timestamps: np.ndarray, requested_timestamps: np.ndarray, frequency: int, frequency_type: str) -> List[Tuple[int, int]]:
+        """
+        Returns the ranges the written bars cover inside each requested range, split wherever an expected bar between them
+        is missing (see Trading_Calendar.find_covered_ranges), for the coverage index (models/price_coverage.py). A hole in
+        the written bars, e.g. a halted day or a truncated response, is therefore never recorded as covered.
 
-                # Update partition start and end
-                current_partition_start, current_partition_end = Historical_Price_Data.get_partition_start_end(timestamp, partition_type)
-            # append instance to grouped_data
-            grouped_data[current_partition_start].append(instance)
+        Args:
+            calendar (Trading_Calendar): The exchange calendar of the symbol.
+            written_timestamps (np.ndarray): Timestamps (UTC ms) of the bars that were written.
+            requested_timestamps (np.ndarray): (start, end) UTC ms of each requested range, shape (n, 2), inclusive.
+            frequency (int), frequency_type (str): The frequency of the written bars, see Historical_Price_Data.partition_frequencies.
 
-        # Write instances for the last partition
-        Historical_Price_Data.bulk_write_to_partition(grouped_data[current_partition_start], self.db, partition_type)
+        Returns:
+            list[tuple[int, int]]: Covered (from, to) ranges in UTC ms, inclusive.
+        """
+        written_timestamps = np.unique(np.asarray(written_timestamps, dtype=np.int64))
+        covered_ranges = []
+        for requested_start, requested_end in requested_timestamps.tolist():
+            first, last = int(np.searchsorted(written_timestamps, requested_start, side='left')), int(np.searchsorted(written_timestamps, requested_end, side='right'))
+            covered_from, covered_to = calendar.find_covered_ranges(written_timestamps[first:last], frequency, frequency_type)
+            covered_ranges.extend(zip(covered_from.tolist(), covered_to.tolist()))
+        return covered_ranges
 
     """ # Deprecated
     def get_data_from_eod_historical_data(self, symbol, start_timestamp, end_timestamp, period_type):
@@ -463,38 +1215,10 @@ class Historical_Price_Data_Mangager:
         Returns:
             bool: True if the symbol is currently trading during its regular trading hours, False otherwise.
         """
-        with self.db.session_scope as session:
-            if datetime_utc is None:
-                datetime_utc = get_current_datetime_utc()
-
-            # Get entity associated with the symbol
-            entity = session.query(Entity).filter(Entity.code == symbol).one_or_none()
-
-            if not entity:
-                raise ValueError(f"Symbol not found: {symbol}")
-
-            # Get associated exchange
-            exchange = entity.exchange_data
-
-            # Check if the current date is a holiday
-            holidays = exchange.holidays
-            current_date = datetime_utc.date()
-            for _, holiday_data in holidays.items():
-                holiday_date = datetime.strptime(holiday_data["Date"], "%Y-%m-%d").date()
-                if holiday_date == current_date:
-                    return False
+        if datetime_utc is None:
+            datetime_utc = get_current_datetime_utc()
 
-            # Check if it's a working day
-            working_days = exchange.trading_hours["WorkingDays"].split(',')
-            if datetime_utc.strftime("%a") not in working_days:
-                return False
-
-            # Check if within trading hours
-            open_time = datetime.strptime(exchange.trading_hours["Open"], "%H:%M:%S").time()
-            close_time = datetime.strptime(exchange.trading_hours["Close"], "%H:%M:%S").time()
-            current_time = datetime_utc.time()
-
-            return open_time <= current_time <= close_time
+        return bool(Trading_Calendar.for_symbol(symbol).is_session(datetime_utc_to_timestamp_utc_ms(datetime_utc))[0])
 
 # Test the function
 #symbol = "TSLA"
@@ -503,45 +1227,22 @@ class Historical_Price_Data_Mangager:
 
     # Not currently being used
     def filter_trading_hours(self, data, symbol):
-        with self.db.session_scope() as session:
-            # Get entity associated with the symbol
-            entity = session.query(Entity).filter(Entity.code == symbol).one_or_none()
-
-            if not entity:
-                raise ValueError(f"Symbol not found: {symbol}")
-
-            # Get associated exchange
-            exchange = entity.exchange_data
-
-            # Get trading hours and working days
-            trading_hours = exchange.trading_hours
-            working_days = trading_hours["WorkingDays"].split(',')
-            open_time = datetime.strptime(trading_hours["Open"], "%H:%M:%S").time()
-            close_time = datetime.strptime(trading_hours["Close"], "%H:%M:%S").time()
-
-            # Get holidays
-            holidays = exchange.holidays
-            holiday_dates = [datetime.strptime(holiday_data["Date"], "%Y-%m-%d").date() for _, holiday_data in holidays.items()]
-
-            # Convert data to a pandas DataFrame if it's not already
-            if not isinstance(data, pd.DataFrame):
-                data = pd.DataFrame(data)
-
-            # Filter data based on trading hours, working days, and holidays
-            data['date'] = pd.to_datetime(data['date'])
-            data['day_of_week'] = data['date'].dt.strftime('%a')
-            data['time'] = data['date'].dt.time
-
-            # Filter out non-working days and holidays
-            filtered_data = data[data['day_of_week'].isin(working_days) & ~data['date'].dt.date.isin(holiday_dates)]
+        """
+        Keeps the rows of data whose 'date' falls inside a regular trading session of the symbol's exchange.
+        Naive dates are taken to be in the exchange's local time, timezone-aware dates are converted.
+        """
+        calendar = Trading_Calendar.for_symbol(symbol)
 
-            # Filter out data outside of trading hours
-            filtered_data = filtered_data[(filtered_data['time'] >= open_time) & (filtered_data['time'] <= close_time)]
+        # Convert data to a pandas DataFrame if it's not already
+        if not isinstance(data, pd.DataFrame):
+            data = pd.DataFrame(data)
 
-            # Drop temporary columns
-            filtered_data = filtered_data.drop(columns=['day_of_week', 'time'])
+        dates = pd.to_datetime(data['date'])
+        if dates.dt.tz is None:
+            dates = dates.dt.tz_localize(calendar.timezone, ambiguous='NaT', nonexistent='NaT')
+        timestamps_ms = dates.dt.tz_convert('UTC').values.astype('datetime64[ms]').astype(np.int64)
 
-            return filtered_data
+        return data[calendar.is_session(timestamps_ms) & dates.notna().values]
 
 # Test the function with a sample dataset
 #sample_data = [
@@ -597,6 +1298,8 @@ class Historical_Price_Data_Mangager:
         partition_table.indexes.add(new_index)
 
         Base.metadata.create_all(self.db.engine, tables=[partition_table])
+        # Drop any cached reflection (or cached "does not exist") of this table now that it has been created
+        Table_Registry.invalidate(partition_name)
 
         
 
@@ -624,60 +1327,27 @@ class Historical_Price_Data_Mangager:
         return formatted_data
 
     def next_open_close_times(self, symbol, datetime_utc=None):
-        with self.db.session_scope() as session:
-            if datetime_utc is None:
-                datetime_utc = get_current_datetime_utc()
-
-            # Get entity associated with the symbol
-            entity = session.query(Entity).filter(Entity.code == symbol).one_or_none()
-
-            if not entity:
-                raise ValueError(f"Symbol not found: {symbol}")
-
-            # Get associated exchange
-            exchange = entity.exchange_data
-
-            # Get trading hours and working days
-            trading_hours = exchange.trading_hours
-            working_days = trading_hours["WorkingDays"].split(',')
-            open_time = datetime.strptime(trading_hours["Open"], "%H:%M:%S").time()
-            close_time = datetime.strptime(trading_hours["Close"], "%H:%M:%S").time()
-
-            # Get holidays
-            holidays = exchange.holidays
-
-            # Find the next open and close times
-            next_open = None
-            next_close = None
-            day_delta = timedelta(days=1)
-
-            while not next_open or not next_close:
-                # Check if it's a holiday
-                is_holiday = False
-                for _, holiday_data in holidays.items():
-                    holiday_date = datetime.strptime(holiday_data["Date"], "%Y-%m-%d").date()
-                    if holiday_date == datetime_utc.date():
-                        is_holiday = True
-                        break
-
-                if not is_holiday and datetime_utc.strftime("%a") in working_days:
-                    if not next_open and datetime_utc.time() < open_time:
-                        next_open = datetime.combine(datetime_utc.date(), open_time)
-
-                    if not next_close and datetime_utc.time() < close_time:
-                        next_close = datetime.combine(datetime_utc.date(), close_time)
+        """
+        Returns the next regular session open and close (UTC) after datetime_utc, defaults to now.
+        """
+        if datetime_utc is None:
+            datetime_utc = get_current_datetime_utc()
 
-                # Check the next day
-                datetime_utc += day_delta
+        calendar = Trading_Calendar.for_symbol(symbol)
+        timestamp = datetime_utc_to_timestamp_utc_ms(datetime_utc)
+        next_open = calendar.next_open(timestamp)
+        next_close = calendar.next_close(timestamp)
 
-            return next_open, next_close
-        
+        return (timestamp_utc_ms_to_datetime_utc(next_open) if next_open is not None else None,
+                timestamp_utc_ms_to_datetime_utc(next_close) if next_close is not None else None)
 
 
     def standardize_frequency_type(self, frequency_type):
         frequency_type = frequency_type.lower()
         if frequency_type in ["minute", "minutes", "min", "mins"]:
             return "minute"
+        elif frequency_type in ["hour", "hours", "hourly", "h"]:
+            return "hour"
         elif frequency_type in ["day", "days", "daily", "d"]:
             return "daily"
         elif frequency_type in ["week", "weeks", "weekly", "w"]:
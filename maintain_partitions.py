@@ -0,0 +1,17 @@
+# maintain_partitions.py
+from support.partition_maintenance import Partition_Maintenance
+
+# Purpose: Pre-create upcoming partitions, add the BRIN timestamp indexes and ANALYZE/VACUUM the historical_price_data
+# partitions written since the last run, see support/partition_maintenance.py.
+#
+# Usage Instructions:
+# Schedule after the updaters, e.g. nightly:
+#     python maintain_partitions.py
+# Partitions that were not written since the last run are skipped, so running it often is cheap.
+
+
+def main():
+    Partition_Maintenance().run()
+
+if __name__ == '__main__':
+    main()
@@ -4,6 +4,11 @@ from .update_tracking import Update_Tracking
 from .area_codes_centroid_point import Area_Codes_Centroid_Point
 from .cities_by_area_code import Cities_By_Area_Code
 from .historical_price_data import Historical_Price_Data
+from .price_coverage import Price_Coverage
+from .price_quarantine import Price_Quarantine
+from .price_rollup import Price_Rollup_1_Hour, Price_Rollup_1_Day, Price_Rollup_Pending, ROLLUP_MODELS, ROLLUP_SOURCE_PARTITION_TYPE
+from .partition_stats import Partition_Stats
+from .price_staging import Price_Staging, Price_Staging_Batch
 from .symbol_eodhistoricaldata import Symbol_EODHistoricalData
 from .exchange_eodhistoricaldata import Exchange_EODHistoricalData
 from .symbol_fundamentals_td_ameritrade import Symbol_Fundamentals_TD_Ameritrade
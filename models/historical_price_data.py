@@ -5,9 +5,14 @@ from sqlalchemy.sql.ddl import DDL
 from sqlalchemy import Table, ForeignKeyConstraint, CheckConstraint, inspect, PrimaryKeyConstraint
 from helpers.time_helper import timestamp_utc_ms_to_datetime_utc
 from helpers.logging_helper import configure_logging, logger
-from typing import Tuple, List, Union, Optional, Dict
+from typing import Tuple, List, Union, Optional, Dict, Iterator
 from datetime import datetime, timedelta
 from support.base import Base
+from support.partition_manager import Partition_Manager
+from models.price_quarantine import Price_Quarantine
+from helpers.bar_validation_helper import find_invalid_bars, describe_reasons, count_reasons, format_reason_counts
+from helpers.price_array_helper import CANDLE_DTYPE
+import numpy as np
 
 
 """
@@ -22,9 +27,10 @@ Also, please note that due to the structure of the codebase, `db` (the database
 to some methods to avoid circular imports. A circular import occurs when two modules depend on each other, either directly 
 or indirectly, which can lead to problems in Python's import system.
 
-In partition_ranges, you specify the duration of each partition for a given frequency_type. Then, in create_partition, you use the
- start time and the frequency_type to calculate the end time of the partition. This effectively partitions the data both by timestamp 
- (i.e., the range of each partition) and frequency_type (i.e., the size of each partition).
+In partition_ranges, you specify the duration of each partition for a given frequency_type. Each frequency_type (partition type)
+ has its own native PostgreSQL partitioned table, historical_price_data_{partition_type}, whose partitions are created by
+ support/partition_manager.py. This effectively partitions the data both by timestamp (i.e., the range of each partition)
+ and frequency_type (i.e., the size of each partition).
 
 """
 
@@ -106,7 +112,7 @@ class Partition_By_Time_Range_Meta(DeclarativeMeta):
         return super().__new__(cls, clsname, bases, attrs)
 
     
-class Historical_Price_Data(Historical_Price_Data_Mixin, Base, metaclass=Partition_By_Time_Range_Meta, partition_by='timestamp'): #The partition_by keyword in the metaclass creation is only telling the metaclass which column in the database should be used to determine the partition boundaries. In this case, it's the 'timestamp' column. However, the frequency_type is also taken into account when determining the size of each partition. This is handled by the partition_ranges dictionary and the create_partition method in the Historical_Price_Data class.
+class Historical_Price_Data(Historical_Price_Data_Mixin, Base, metaclass=Partition_By_Time_Range_Meta, partition_by='timestamp'): #The partition_by keyword in the metaclass creation is only telling the metaclass which column in the database should be used to determine the partition boundaries. In this case, it's the 'timestamp' column. However, the frequency_type is also taken into account when determining the size of each partition. This is handled by the partition_ranges dictionary and Partition_Manager (support/partition_manager.py).
     """
     This class represents the historical_price_data table in the database. It inherits 
     from the Historical_Price_Data_Mixin and uses the Partition_By_Time_Range_Meta 
@@ -115,11 +121,9 @@ class Historical_Price_Data(Historical_Price_Data_Mixin, Base, metaclass=Partiti
 
     __tablename__ = 'historical_price_data'
 
+    # The partition_ranges dictionary plays a crucial role in the creation and management of the partitions. It defines
+    # the duration of each partition based on the partition type, see support/partition_manager.py.
     partition_ranges = {
-        """The partition_ranges dictionary plays a crucial role in the creation and management of the partitions. It defines 
-        the duration of each partition based on the frequency_type. So, it should be used in the create_partition method to 
-        calculate the end date of the partition."""
-        
         "1_min": timedelta(days=1),
         "5_min": timedelta(days=7),
         "15_min": timedelta(days=14),
@@ -130,32 +134,55 @@ class Historical_Price_Data(Historical_Price_Data_Mixin, Base, metaclass=Partiti
         "1_month": timedelta(days=365*10),
     }
 
+    # The (frequency, frequency_type) of the bars stored in each partition type, frequency_type as used by helpers/gap_helper.py
+    partition_frequencies = {
+        "1_min": (1, 'minute'),
+        "5_min": (5, 'minute'),
+        "15_min": (15, 'minute'),
+        "1_hour": (1, 'hour'),
+        "4_hour": (4, 'hour'),
+        "1_day": (1, 'daily'),
+        "1_week": (1, 'weekly'),
+        "1_month": (1, 'monthly'),
+    }
 
-    @classmethod
-    def create_partition_table_class(cls, name):
-        """
-        This method generates a new partition table class that inherits from the parent table. 
-        The partition table is defined by a unique name and a constraint expression.
+    # Grid (UTC ms) the timestamps of each partition type fall on, bars off the grid are rejected by validate_bars. Sessions
+    # open on the hour or half hour, so hourly bars aligned to the open are on a 30 minute grid. Daily and longer bars are
+    # stamped at a local midnight, which is a whole hour in UTC.
+    partition_grids = {
+        "1_min": 60 * 1000,
+        "5_min": 5 * 60 * 1000,
+        "15_min": 15 * 60 * 1000,
+        "1_hour": 30 * 60 * 1000,
+        "4_hour": 30 * 60 * 1000,
+        "1_day": 60 * 60 * 1000,
+        "1_week": 60 * 60 * 1000,
+        "1_month": 60 * 60 * 1000,
+    }
 
-        Args:
-            name (str): The name of the partition.
+    # Finer partition types each partition type can be resampled from (helpers/resample_helper.py), coarsest first so
+    # the fewest rows are read. Weekly and monthly bars are only built from daily bars.
+    resample_sources = {
+        "5_min": ["1_min"],
+        "15_min": ["5_min", "1_min"],
+        "1_hour": ["15_min", "5_min", "1_min"],
+        "4_hour": ["1_hour", "15_min", "5_min", "1_min"],
+        "1_day": ["1_hour", "15_min", "5_min", "1_min"],
+        "1_week": ["1_day"],
+        "1_month": ["1_day"],
+    }
 
-        Returns:
-            Partition_Table: A class representing the partition.
-        """
 
-        class Partition_Table(Historical_Price_Data):
-            __tablename__ = name
-            __table_args__ = {
-                'inherits': (Historical_Price_Data,),
-                'postgresql_partition_by': f'RANGE({cls.partition_by})',
-                'tablespace': 'historical_data', 
-            }
-        return Partition_Table
-         
+    # Older frequency_type names still accepted by determine_partition_type, mapped to the standardized ones of partition_frequencies
+    frequency_type_aliases = {
+        'min': 'minute',
+        'day': 'daily',
+        'week': 'weekly',
+        'month': 'monthly',
+    }
 
-    @staticmethod
-    def determine_partition_type(frequency: Union[str, int], frequency_type: Optional[str]) -> str:
+    @classmethod
+    def determine_partition_type(cls, frequency: Union[str, int], frequency_type: Optional[str]) -> str:
         """
         This method determines the type of partition to be used based on the provided 
         frequency and frequency_type. The partition type is crucial for the partitioning 
@@ -163,73 +190,202 @@ class Historical_Price_Data(Historical_Price_Data_Mixin, Base, metaclass=Partiti
 
         Args:
             frequency (Union[str, int]): The frequency of the data.
-            frequency_type (str): The type of the frequency.
+            frequency_type (str): The type of the frequency, as standardized by Historical_Price_Data_Mangager.standardize_frequency_type
+                ('minute', 'hour', 'daily', 'weekly', 'monthly') or one of frequency_type_aliases ('min', 'day', 'week', 'month').
 
         Returns:
             str: The type of the partition.
         """
-
-        frequency_mapping = {
-            (1, 'min'): '1_min',
-            (5, 'min'): '5_min',
-            (15, 'min'): '15_min',
-            (1, 'hour'): '1_hour',
-            (4, 'hour'): '4_hour',
-            (1, 'day'): '1_day',
-            (1, 'week'): '1_week',
-            (1, 'month'): '1_month',
-        }
-        partition_type = frequency_mapping.get((frequency, frequency_type))
-        if partition_type is None:
+        try:
+            frequency = int(frequency)
+        except (TypeError, ValueError):
             raise ValueError(f"Invalid frequency and frequency_type combination: {frequency}, {frequency_type}")
-        return partition_type
+        frequency_type = cls.frequency_type_aliases.get(frequency_type, frequency_type)
+
+        for partition_type, partition_frequency in cls.partition_frequencies.items():
+            if partition_frequency == (frequency, frequency_type):
+                return partition_type
+        raise ValueError(f"Invalid frequency and frequency_type combination: {frequency}, {frequency_type}")
 
 
+    # Columns written by bulk_write_to_partition, in COPY order
+    copy_columns = ['entity_id', 'timestamp', 'open', 'high', 'low', 'close', 'adjusted_close', 'volume', 'is_regular_trading_hours', 'source', 'last_updated', 'updated_by']
+
+    # Key of a bar and the columns that decide whether a re-written bar changed, see bulk_write_to_partition(mode='upsert')
+    key_columns = ['entity_id', 'timestamp']
+    compare_columns = ['open', 'high', 'low', 'close', 'adjusted_close', 'volume', 'is_regular_trading_hours', 'source']
+
     @classmethod # Must pass db because will have circular import error otherwise
-    def bulk_write_to_partition(cls, instances: List['Historical_Price_Data'], db, start_datetime_utc: datetime, frequency_type: str) -> None:
-        """
-        This method writes a list of instances to a specific partition. The partition is 
-        determined based on the start_datetime_utc and frequency_type parameters. If the 
-        required partition doesn't exist, it is created.
+    def bulk_write_to_partition(cls, instances: List['Historical_Price_Data'], db, start_datetime_utc: datetime, frequency_type: str, mode: str = 'upsert') -> int:
         """
+        This method writes a list of instances to the partitioned table of frequency_type (the partition type). Each bar
+        lands in the partition of its own timestamp, partitions that do not exist yet are created. start_datetime_utc is
+        no longer needed to pick the partition and is kept for existing callers.
+
+        The bars are streamed into the partition with COPY FROM STDIN instead of creating and flushing an ORM object per bar.
 
+        Args:
+            mode (str, optional): 'upsert' (default) merges the bars thru a staging table (see DB.upsert_rows_to_table), bars
+                that already exist are only updated if their values changed, so overlapping and repeated backfills are safe.
+                'copy' copies straight into the partition (see DB.copy_rows_to_table), fastest for ranges known to be new but
+                a bar that already exists aborts the whole write.
+
+        Returns:
+            int: The number of bars written (inserted or changed).
+        """
         if not instances:
-            return
+            return 0
+
+        rows = [[getattr(instance, column) for column in cls.copy_columns] for instance in instances]
+        # Rows without the metadata of the bar can not be written or quarantined
+        metadata_indexes = [cls.copy_columns.index(column) for column in ('entity_id', 'source', 'last_updated', 'updated_by')]
+        complete_rows = [row for row in rows if all(row[index] is not None for index in metadata_indexes)]
+        if len(complete_rows) < len(rows):
+            logger.error(f"Skipped {len(rows) - len(complete_rows)} of {len(rows)} instances missing entity_id, source, last_updated or updated_by")
+
+        # The bar values go thru the same vectorized checks as bulk_write_bars, rejected rows are quarantined
+        reasons = find_invalid_bars(cls.rows_to_bars(complete_rows), grid_ms=cls.partition_grids.get(frequency_type), entity_ids=np.array([row[0] for row in complete_rows], dtype=np.int64))
+        rows = [row for row, reason in zip(complete_rows, reasons.tolist()) if not reason]
+        if len(rows) < len(complete_rows):
+            rejected = reasons != 0
+            cls.quarantine(db, [row for row, reason in zip(complete_rows, reasons.tolist()) if reason], reasons[rejected], frequency_type,
+                           f"entities {sorted({row[0] for row in complete_rows})}", len(complete_rows))
+
+        if not rows:
+            return 0
+        timestamp_index = cls.copy_columns.index('timestamp')
+        timestamps = [row[timestamp_index] for row in rows]
+        return cls.write_rows(rows, db, frequency_type, min(timestamps), max(timestamps), mode=mode)
 
-        PartitionTable = cls.create_partition((start_datetime_utc, frequency_type))
+    @classmethod
+    def write_rows(cls, rows, db, partition_type: str, first_timestamp: int, last_timestamp: int, mode: str = 'upsert') -> int:
+        """
+        Writes rows (values in copy_columns order) to the partitioned table of the partition type. The partitions covering
+        [first_timestamp, last_timestamp] (plus the pre-created ones ahead) are made sure to exist first, from the cached
+        partition map of Partition_Manager, then PostgreSQL routes each row to its partition.
+        See bulk_write_to_partition for the modes.
+        """
+        if mode not in ('upsert', 'copy'):
+            raise ValueError(f"Invalid mode: {mode}. Please use 'upsert' or 'copy'")
 
-        with db.session_scope() as session:
-            if not db.engine.dialect.has_table(db.engine, PartitionTable.__table__.name):
-                PartitionTable.__table__.create(bind=db.engine)
+        Partition_Manager.ensure_partitions(db.engine, partition_type, first_timestamp, last_timestamp)
+        table_name = Partition_Manager.parent_table_name(partition_type)
 
-            for instance in instances:
-                if cls.validate_data(instance.__dict__):
-                    session.add(PartitionTable(**instance.__dict__))
-                else:
-                    logger.error(f"Skipped adding instance due to missing data: {instance.__dict__}")
+        if mode == 'copy':
+            return db.copy_rows_to_table(table_name, cls.copy_columns, rows)
+        return db.upsert_rows_to_table(
+            table_name, cls.copy_columns, rows, key_columns=cls.key_columns,
+            update_columns=[column for column in cls.copy_columns if column not in cls.key_columns], compare_columns=cls.compare_columns)
 
 
     @classmethod
-    def create_partition(cls_, start_datetime_utc: datetime, frequency_type: str):
+    def partition_starts_ms(cls, timestamps_ms: np.ndarray, partition_type: str) -> np.ndarray:
         """
-        This method creates a new partition of the historical price data table, based on the 
-        start_datetime_utc and frequency_type. The partition's duration is determined using 
-        the partition_ranges dictionary.
+        Returns the start (UTC ms) of the partition each timestamp belongs to. Partitions are partition_ranges[partition_type]
+        long and aligned to the unix epoch, so every bar maps to exactly one partition.
         """
+        range_ms = int(cls.partition_ranges[partition_type].total_seconds() * 1000)
+        return (np.asarray(timestamps_ms, dtype=np.int64) // range_ms) * range_ms
 
-        partition_range = cls_.partition_ranges[frequency_type]
-        partition_end = start_datetime_utc + partition_range
-        partition_name = f'{cls_.__tablename__}_{start_datetime_utc.strftime("%Y%m%d%H%M%S")}_{frequency_type}'
+    @classmethod
+    def get_partition_start_end(cls, timestamp_ms: int, partition_type: str) -> Tuple[datetime, datetime]:
+        """
+        Returns the start and end (UTC) of the partition the timestamp belongs to, see partition_starts_ms.
+        """
+        partition_start_ms = int(cls.partition_starts_ms(timestamp_ms, partition_type))
+        partition_start = timestamp_utc_ms_to_datetime_utc(partition_start_ms)
+        return partition_start, partition_start + cls.partition_ranges[partition_type]
+
+    @classmethod # Must pass db because will have circular import error otherwise
+    def bulk_write_bars(cls, bars: np.ndarray, entity_id: int, source: str, last_updated: datetime, updated_by: str, db, partition_type: str, mode: str = 'upsert') -> int:
+        """
+        Writes a CANDLE_DTYPE bar array (helpers/price_array_helper.py) to its partitions without creating an ORM object per bar.
+        Bars are validated with vectorized checks and written in one COPY/upsert to the partitioned table, see write_rows.
+
+        Args:
+            bars (np.ndarray): The bars, see candles_to_bar_array.
+            entity_id (int), source (str), last_updated (datetime), updated_by (str): Written to every bar.
+            partition_type (str): The partition type of the bars, see determine_partition_type.
+            mode (str, optional): 'upsert' (default) or 'copy', see bulk_write_to_partition.
+
+        Returns:
+            int: The number of bars written (inserted or changed).
+        """
+        bars = cls.validate_bars(bars, entity_id, partition_type, db=db, source=source, last_updated=last_updated, updated_by=updated_by)
+        if not len(bars):
+            return 0
+        rows = cls.bars_to_rows(bars, entity_id, source, last_updated, updated_by)
+        return cls.write_rows(rows, db, partition_type, int(bars['timestamp'].min()), int(bars['timestamp'].max()), mode=mode)
+
+    @classmethod
+    def validate_bars(cls, bars: np.ndarray, entity_id: int, partition_type: str, db=None, source: Optional[str] = None, last_updated: Optional[datetime] = None, updated_by: Optional[str] = None) -> np.ndarray:
+        """
+        Checks a batch of bars with the vectorized checks of helpers/bar_validation_helper.py (nulls, high/low against
+        open/close, negative volume, duplicate and off-grid timestamps) and returns the valid ones. Rejected bars are
+        quarantined with their reason codes when db is given, and the batch is summarized in a single log line.
+
+        Args:
+            bars (np.ndarray): CANDLE_DTYPE bars, see candles_to_bar_array.
+            entity_id (int): The entity the bars belong to.
+            partition_type (str): The partition type the bars are written to, picks the timestamp grid (partition_grids).
+            db (DB, optional): Database to quarantine rejected bars in. Defaults to None, rejected bars are only logged.
+            source (str), last_updated (datetime), updated_by (str), optional: Written to every quarantined bar.
 
-        if partition_name not in cls_.partitions:
-            constraint_expr = (
-                f"{cls_.timestamp} >= '{start_datetime_utc.isoformat()}' AND {cls_.timestamp} < '{partition_end.isoformat()}'"
-            )
-            PartitionTable = cls_.create_partition_table_class(partition_name)
-            cls_.partitions[partition_name] = PartitionTable
+        Returns:
+            np.ndarray: The valid bars.
+        """
+        reasons = find_invalid_bars(bars, grid_ms=cls.partition_grids.get(partition_type))
+        rejected = reasons != 0
+        if not rejected.any():
+            return bars
+        rows = list(cls.bars_to_rows(bars[rejected], entity_id, source, last_updated, updated_by)) if db is not None else None
+        cls.quarantine(db, rows, reasons[rejected], partition_type, f"entity {entity_id}", len(bars))
+        return bars[~rejected]
 
-        return cls_.partitions[partition_name]
+    @classmethod
+    def quarantine(cls, db, rejected_rows: Optional[List[list]], rejected_reasons: np.ndarray, partition_type: str, description: str, batch_size: int) -> None:
+        # Writes the rejected rows (copy_columns order) of a batch to the quarantine table and logs one summary line for the batch
+        quarantined = False
+        if db is not None and rejected_rows:
+            try:
+                Price_Quarantine.quarantine_rows(db, cls.copy_columns, rejected_rows, describe_reasons(rejected_reasons), partition_type)
+                quarantined = True
+            except Exception as e:
+                logger.error(f"Error quarantining {len(rejected_rows)} {partition_type} bars for {description}: {e}")
+        logger.warning(
+            f"Rejected {len(rejected_reasons)} of {batch_size} {partition_type} bars for {description} "
+            f"({format_reason_counts(count_reasons(rejected_reasons))}){', quarantined' if quarantined else ''}"
+        )
 
+    @classmethod
+    def rows_to_bars(cls, rows: List[list]) -> np.ndarray:
+        """
+        Builds a CANDLE_DTYPE array from rows in copy_columns order for the vectorized checks, missing values become NaN (0 for the timestamp).
+        """
+        bars = np.empty(len(rows), dtype=CANDLE_DTYPE)
+        for name in ('timestamp', 'open', 'high', 'low', 'close', 'adjusted_close', 'volume'):
+            index = cls.copy_columns.index(name)
+            if name == 'timestamp':
+                bars[name] = [row[index] if row[index] is not None else 0 for row in rows]
+            else:
+                bars[name] = np.array([row[index] for row in rows], dtype=np.float64)
+        bars['is_regular_trading_hours'] = True
+        return bars
+
+    @staticmethod
+    def bars_to_rows(bars: np.ndarray, entity_id: int, source: str, last_updated: datetime, updated_by: str) -> Iterator[list]:
+        """
+        Yields a CANDLE_DTYPE bar array as rows in copy_columns order, NaN close and adjusted_close are written as NULL.
+        """
+        columns = {name: bars[name].tolist() for name in ('timestamp', 'open', 'high', 'low', 'volume', 'is_regular_trading_hours')}
+        # close and adjusted_close are nullable, NaN is written as NULL
+        for name in ('close', 'adjusted_close'):
+            columns[name] = [None if value != value else value for value in bars[name].tolist()]
+        return (
+            [entity_id, timestamp, open_, high, low, close, adjusted_close, volume, is_regular_trading_hours, source, last_updated, updated_by]
+            for timestamp, open_, high, low, close, adjusted_close, volume, is_regular_trading_hours in zip(
+                columns['timestamp'], columns['open'], columns['high'], columns['low'], columns['close'], columns['adjusted_close'], columns['volume'], columns['is_regular_trading_hours'])
+        )
 
     @classmethod
     def from_td_ameritrade(cls, td_ameritrade_data, entity_id, source, last_updated, updated_by, is_regular_trading_hours):
@@ -271,11 +427,11 @@ class Historical_Price_Data(Historical_Price_Data_Mixin, Base, metaclass=Partiti
     
     @staticmethod
     def validate_data(data):
-        required_fields = ['entity_id', 'timestamp', 'open', 'high', 'low', 'volume', 'is_regular_trading_hours', 'source', 'last_updated', 'updated_by']
-        for field in required_fields:
-            if field not in data or data[field] is None:
-                logger.error(f"Missing required field: {field}")
-                return False
+        # Per record check kept for callers validating a single record, batches go thru validate_bars
+        missing_fields = [field for field in ('entity_id', 'timestamp', 'open', 'high', 'low', 'volume', 'is_regular_trading_hours', 'source', 'last_updated', 'updated_by') if data.get(field) is None]
+        if missing_fields:
+            logger.error(f"Missing required fields: {', '.join(missing_fields)}")
+            return False
         return True
 
 
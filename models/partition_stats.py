@@ -0,0 +1,30 @@
+# models/partition_stats.py
+import datetime
+from sqlalchemy import Column, String, BigInteger, Boolean, DateTime
+from support.base import Base
+
+# Purpose:
+# 1. Record, per historical_price_data partition, the numbers of the last maintenance run (support/partition_maintenance.py):
+#    row estimate, size, whether the BRIN index on timestamp exists and when it was last analyzed and vacuumed.
+# 2. Remember the write counters PostgreSQL reported at the last run, so the next run only touches partitions written since.
+
+
+class Partition_Stats(Base):
+    __tablename__ = 'partition_stats'
+
+    partition_name = Column(String(255), primary_key=True)
+    parent_table = Column(String(255), nullable=False)
+    partition_type = Column(String(16), nullable=False)
+    # pg_class.reltuples right after ANALYZE
+    row_count = Column(BigInteger, nullable=False, default=0)
+    # pg_total_relation_size, table plus indexes
+    total_bytes = Column(BigInteger, nullable=False, default=0)
+    # n_tup_ins + n_tup_upd + n_tup_del of pg_stat_user_tables at the last run
+    modification_count = Column(BigInteger, nullable=False, default=0)
+    has_brin_index = Column(Boolean, nullable=False, default=False)
+    last_analyzed = Column(DateTime)
+    last_vacuumed = Column(DateTime)
+    last_maintained = Column(DateTime, default=datetime.datetime.utcnow, nullable=False)
+
+    def __repr__(self):
+        return f"<Partition_Stats(partition_name='{self.partition_name}', row_count={self.row_count}, total_bytes={self.total_bytes}, has_brin_index={self.has_brin_index}, last_maintained='{self.last_maintained}')>"
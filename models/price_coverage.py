@@ -0,0 +1,190 @@
+# models/price_coverage.py
+import datetime
+import numpy as np
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from sqlalchemy import Column, Integer, String, BigInteger, DateTime, ForeignKey, Index, text
+from support.base import Base
+from models.update_tracking import Update_Tracking
+from models.historical_price_data import Historical_Price_Data
+from helpers.gap_helper import bar_length_ms
+from helpers.interval_helper import Interval_Set
+
+# Purpose:
+# 1. Keep, per entity and partition type, the merged [covered_from, covered_to] intervals (UTC ms) of bars we have stored.
+# 2. Let gap checks read a handful of interval rows instead of pulling every bar in the requested window.
+#
+# Workflow:
+# 1. Every write to a Historical_Price_Data partition calls Price_Coverage.add_ranges with the ranges it wrote, right
+#    after the write. A written range is split wherever an expected bar is missing inside it (a halted day, a truncated
+#    response), see Trading_Calendar.find_covered_ranges, so holes are fetched again. Intervals are merged when no
+#    expected bar lies between them: consecutive responses one bar interval apart, and, given the exchange calendar,
+#    intervals apart only by closed time (nights, weekends, holidays). An entity keeps only a few rows.
+# 2. Gap checks call Price_Coverage.get_ranges (or get_ranges_for_entities) and diff the intervals against the exchange
+#    calendar, see Trading_Calendar.find_uncovered_ranges.
+# 3. Historical_Price_Data_Mangager.rebuild_price_coverage (python rebuild_price_coverage.py) recreates the intervals from
+#    the stored bars and marks the partition type as built in Update_Tracking. Gap checks only trust the index once it is built.
+
+
+class Price_Coverage(Base):
+    __tablename__ = 'price_coverage'
+    __table_args__ = (
+        Index('ix_price_coverage_entity_id_partition_type_covered_from', 'entity_id', 'partition_type', 'covered_from'),
+    )
+
+    # First key of the two-key pg_advisory_xact_lock taken per entity by add_ranges, keeps its locks apart from any other
+    # advisory lock in the database ('PCOV' as a 32 bit integer)
+    ADVISORY_LOCK_CLASS_ID = 0x50434F56
+
+    id = Column(Integer, primary_key=True)
+    entity_id = Column(Integer, ForeignKey('entities.id', onupdate="CASCADE", ondelete="CASCADE"), nullable=False)
+    partition_type = Column(String(16), nullable=False)
+    covered_from = Column(BigInteger, nullable=False)
+    covered_to = Column(BigInteger, nullable=False)
+    last_updated = Column(DateTime, default=datetime.datetime.utcnow, nullable=False)
+
+    def __repr__(self):
+        return f"<Price_Coverage(entity_id={self.entity_id}, partition_type='{self.partition_type}', covered_from={self.covered_from}, covered_to={self.covered_to})>"
+
+    @staticmethod
+    def merge_ranges(ranges: Iterable[Tuple[int, int]], partition_type: str, calendar: Optional[Any] = None) -> List[Tuple[int, int]]:
+        """
+        Merges covered (from, to) bar timestamp ranges that have no expected bar between them.
+
+        Args:
+            ranges (Iterable[Tuple[int, int]]): Covered (from, to) ranges in UTC ms, inclusive, in any order.
+            partition_type (str): The partition type of the bars, ranges one bar interval apart are merged.
+            calendar (Trading_Calendar, optional): The exchange calendar, ranges apart only by closed time are merged too.
+                Defaults to None.
+
+        Returns:
+            List[Tuple[int, int]]: The merged ranges, ordered by covered_from.
+        """
+        frequency, frequency_type = Historical_Price_Data.partition_frequencies[partition_type]
+        merged = list(Interval_Set(ranges, step=bar_length_ms(frequency, frequency_type)))
+        if calendar is None:
+            return merged
+
+        bridged = merged[:1]
+        for covered_from, covered_to in merged[1:]:
+            previous_to = bridged[-1][1]
+            # The bucket of the bar at previous_to starts at previous_to, any later bucket starting before covered_from is missing
+            bucket_starts, _ = calendar.expected_buckets(previous_to + 1, covered_from - 1, frequency, frequency_type)
+            if ((bucket_starts > previous_to) & (bucket_starts < covered_from)).any():
+                bridged.append((covered_from, covered_to))
+            else:
+                bridged[-1] = (bridged[-1][0], covered_to)
+        return bridged
+
+    @classmethod
+    def add_ranges(cls, session, entity_id: int, partition_type: str, ranges: Iterable[Tuple[int, int]], calendar: Optional[Any] = None) -> None:
+        """
+        Records newly written ranges for an entity, merging them with the intervals that are already stored, see merge_ranges.
+
+        Args:
+            session (Session): The session to record the coverage in.
+            entity_id (int): The entity the bars belong to.
+            partition_type (str): The partition type of the bars, see Historical_Price_Data.determine_partition_type.
+            ranges (Iterable[Tuple[int, int]]): Written (from, to) ranges in UTC ms, inclusive.
+            calendar (Trading_Calendar, optional): The exchange calendar of the entity, see merge_ranges. Defaults to None.
+        """
+        ranges = np.asarray(list(ranges), dtype=np.int64).reshape(-1, 2)
+        if not len(ranges):
+            return
+        first_from, last_to = int(ranges[:, 0].min()), int(ranges[:, 1].max())
+
+        # Serialize writers of the same entity so two writers can not both merge against the same old intervals
+        session.execute(text('SELECT pg_advisory_xact_lock(:lock_class_id, :entity_id)'), {'lock_class_id': cls.ADVISORY_LOCK_CLASS_ID, 'entity_id': entity_id})
+
+        entity_rows = session.query(cls).filter(cls.entity_id == entity_id, cls.partition_type == partition_type)
+        stored = entity_rows.filter(cls.covered_from <= last_to, cls.covered_to >= first_from).all()
+        # The closest intervals before and after may be apart from the new ranges by closed time only
+        stored += [row for row in (
+            entity_rows.filter(cls.covered_to < first_from).order_by(cls.covered_to.desc()).first(),
+            entity_rows.filter(cls.covered_from > last_to).order_by(cls.covered_from).first(),
+        ) if row is not None]
+
+        merged = cls.merge_ranges(ranges.tolist() + [(row.covered_from, row.covered_to) for row in stored], partition_type, calendar=calendar)
+
+        # Rows that are still an interval of their own are kept, the others are replaced by the merged intervals
+        new_ranges = set(merged)
+        for row in stored:
+            if (row.covered_from, row.covered_to) in new_ranges:
+                new_ranges.discard((row.covered_from, row.covered_to))
+            else:
+                session.delete(row)
+        session.flush()
+        session.add_all([
+            cls(entity_id=entity_id, partition_type=partition_type, covered_from=int(covered_from), covered_to=int(covered_to))
+            for covered_from, covered_to in sorted(new_ranges)
+        ])
+
+    @classmethod
+    def get_ranges(cls, session, entity_id: int, partition_type: str, start_timestamp: int, end_timestamp: int) -> List[Tuple[int, int]]:
+        """
+        Returns the covered (from, to) intervals of an entity that overlap [start_timestamp, end_timestamp], ordered by covered_from.
+        """
+        rows = session.query(cls.covered_from, cls.covered_to).filter(
+            cls.entity_id == entity_id,
+            cls.partition_type == partition_type,
+            cls.covered_from <= end_timestamp,
+            cls.covered_to >= start_timestamp,
+        ).order_by(cls.covered_from).all()
+        return [(row.covered_from, row.covered_to) for row in rows]
+
+    @classmethod
+    def get_ranges_for_entities(cls, session, entity_ids: List[int], partition_type: str, start_timestamp: int, end_timestamp: int) -> Dict[int, List[Tuple[int, int]]]:
+        """
+        Batch version of get_ranges, one query for many entities.
+
+        Returns:
+            dict: Maps each entity_id to its covered intervals, entities without any interval are left out.
+        """
+        rows = session.query(cls.entity_id, cls.covered_from, cls.covered_to).filter(
+            cls.entity_id.in_(entity_ids),
+            cls.partition_type == partition_type,
+            cls.covered_from <= end_timestamp,
+            cls.covered_to >= start_timestamp,
+        ).order_by(cls.entity_id, cls.covered_from).all()
+
+        ranges = {}
+        for row in rows:
+            ranges.setdefault(row.entity_id, []).append((row.covered_from, row.covered_to))
+        return ranges
+
+    @staticmethod
+    def tracking_table_name(partition_type: str) -> str:
+        """
+        Returns the Update_Tracking.table_name that records when the coverage of a partition type was last rebuilt.
+        """
+        return f'price_coverage.{partition_type}'
+
+    @classmethod
+    def is_built(cls, session, partition_type: str) -> bool:
+        """
+        Returns True once the coverage of the partition type has been rebuilt from the stored bars. Until then the intervals
+        only describe what was written since the table was added, so gap checks have to diff the bars instead.
+        """
+        return session.query(Update_Tracking.id).filter(Update_Tracking.table_name == cls.tracking_table_name(partition_type)).first() is not None
+
+    @classmethod
+    def mark_built(cls, session, partition_type: str) -> None:
+        """
+        Records in Update_Tracking that the coverage of the partition type has been rebuilt.
+        """
+        table_name = cls.tracking_table_name(partition_type)
+        update_tracking = session.query(Update_Tracking).filter(Update_Tracking.table_name == table_name).one_or_none()
+        if update_tracking is None:
+            session.add(Update_Tracking(table_name=table_name, last_updated=datetime.datetime.utcnow()))
+        else:
+            update_tracking.last_updated = datetime.datetime.utcnow()
+
+    @classmethod
+    def replace_ranges(cls, session, entity_id: int, partition_type: str, ranges: Iterable[Tuple[int, int]]) -> None:
+        """
+        Replaces every interval of an entity and partition type, used when rebuilding the index from the stored bars.
+        """
+        session.query(cls).filter(cls.entity_id == entity_id, cls.partition_type == partition_type).delete(synchronize_session=False)
+        session.add_all([
+            cls(entity_id=entity_id, partition_type=partition_type, covered_from=int(covered_from), covered_to=int(covered_to))
+            for covered_from, covered_to in ranges
+        ])
@@ -0,0 +1,64 @@
+# models/price_quarantine.py
+import datetime
+from typing import Iterable, List, Sequence
+from sqlalchemy import Column, Integer, String, Float, Boolean, BigInteger, DateTime, Index
+from support.base import Base
+
+# Purpose:
+# 1. Keep the bars rejected by the batch validator (helpers/bar_validation_helper.py) instead of dropping them silently,
+#    with the reason codes they were rejected for, so bad provider data can be inspected and re-loaded once fixed.
+#
+# Workflow:
+# 1. Historical_Price_Data.validate_bars / bulk_write_to_partition call Price_Quarantine.quarantine_rows with the rejected
+#    rows of a batch, which are copied in with COPY FROM STDIN like the partitions.
+# 2. Every column of a bar is nullable here, a missing value is often the reason the bar is quarantined.
+
+
+class Price_Quarantine(Base):
+    __tablename__ = 'price_quarantine'
+    __table_args__ = (
+        Index('ix_price_quarantine_entity_id_partition_type_timestamp', 'entity_id', 'partition_type', 'timestamp'),
+    )
+
+    id = Column(BigInteger, primary_key=True)
+    partition_type = Column(String(16), nullable=False)
+    # Comma separated REASON_CODES of helpers/bar_validation_helper.py
+    reason_codes = Column(String(255), nullable=False)
+    entity_id = Column(Integer)
+    timestamp = Column(BigInteger)
+    open = Column(Float)
+    high = Column(Float)
+    low = Column(Float)
+    close = Column(Float)
+    adjusted_close = Column(Float)
+    volume = Column(Float)
+    is_regular_trading_hours = Column(Boolean)
+    source = Column(String)
+    last_updated = Column(DateTime)
+    updated_by = Column(String)
+    quarantined_at = Column(DateTime, default=datetime.datetime.utcnow, nullable=False)
+
+    def __repr__(self):
+        return f"<Price_Quarantine(entity_id={self.entity_id}, partition_type='{self.partition_type}', timestamp={self.timestamp}, reason_codes='{self.reason_codes}')>"
+
+    @classmethod # Must pass db because will have circular import error otherwise
+    def quarantine_rows(cls, db, columns: List[str], rows: Iterable[Sequence], reason_codes: Iterable[str], partition_type: str) -> int:
+        """
+        Copies rejected rows into the quarantine table.
+
+        Args:
+            db (DB): The database.
+            columns (list[str]): The columns of each row, e.g. Historical_Price_Data.copy_columns.
+            rows (Iterable[Sequence]): The rejected rows, NaN values are written as NULL.
+            reason_codes (Iterable[str]): The comma separated reason codes of each row, see describe_reasons.
+            partition_type (str): The partition type the rows were going to be written to.
+
+        Returns:
+            int: The number of rows quarantined.
+        """
+        quarantined_at = datetime.datetime.utcnow()
+        quarantined_rows = (
+            [None if value != value else value for value in row] + [reasons, partition_type, quarantined_at]
+            for row, reasons in zip(rows, reason_codes)
+        )
+        return db.copy_rows_to_table(cls.__tablename__, list(columns) + ['reason_codes', 'partition_type', 'quarantined_at'], quarantined_rows)
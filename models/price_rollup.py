@@ -0,0 +1,95 @@
+# models/price_rollup.py
+import datetime
+from sqlalchemy import Column, Integer, Float, Boolean, BigInteger, DateTime, ForeignKey, PrimaryKeyConstraint, Sequence
+from sqlalchemy.orm import declared_attr
+from support.base import Base
+
+# Purpose:
+# 1. Hold 1 hour and daily bars rolled up from the stored 1 minute bars, the frequencies backtests read the most.
+# 2. Queue the 1 minute ranges written since the last refresh (Price_Rollup_Pending), so a refresh only re-aggregates the
+#    buckets they touched.
+#
+# Workflow:
+# 1. Price_Staging.merge_pending queues the range of every merged 1 minute batch in the transaction that merges it, so a
+#    range becomes visible exactly when its bars do, whatever order concurrent merges commit in.
+# 2. Historical_Price_Data_Mangager.refresh_rollups claims the queued ranges of an entity (FOR UPDATE SKIP LOCKED), upserts
+#    the buckets they touch and deletes them, all in one transaction.
+# 3. get_historical_price_data_from_database reads a rollup bucket only when it holds every 1 minute bar the calendar expects
+#    (bar_count == expected_bar_count), and the partition table for every other bucket, so callers do not need to know the
+#    rollups exist.
+
+
+class Price_Rollup_Mixin:
+    __table_args__ = (
+        PrimaryKeyConstraint('entity_id', 'timestamp'),
+    )
+    @declared_attr
+    def entity_id(cls):
+        return Column(Integer, ForeignKey('entities.id', onupdate="CASCADE", ondelete="CASCADE"), nullable=False)
+    @declared_attr
+    def timestamp(cls):
+        return Column(BigInteger, nullable=False)
+    @declared_attr
+    def open(cls):
+        return Column(Float, nullable=False)
+    @declared_attr
+    def high(cls):
+        return Column(Float, nullable=False)
+    @declared_attr
+    def low(cls):
+        return Column(Float, nullable=False)
+    @declared_attr
+    def close(cls):
+        return Column(Float, nullable=True)
+    @declared_attr
+    def adjusted_close(cls):
+        return Column(Float, nullable=True)
+    @declared_attr
+    def volume(cls):
+        return Column(Float, nullable=False)
+    @declared_attr
+    def is_regular_trading_hours(cls):
+        # Rollups are built from regular session bars only, kept so readers can filter them like the partition tables
+        return Column(Boolean, nullable=False, default=True)
+    @declared_attr
+    def bar_count(cls):
+        return Column(Integer, nullable=False)
+    @declared_attr
+    def expected_bar_count(cls):
+        # Regular session 1 minute bars the calendar expects in the bucket, the bucket is complete when bar_count reaches it
+        return Column(Integer, nullable=False)
+    @declared_attr
+    def last_updated(cls):
+        return Column(DateTime, default=datetime.datetime.utcnow, nullable=False)
+
+
+class Price_Rollup_1_Hour(Price_Rollup_Mixin, Base):
+    __tablename__ = 'price_rollup_1_hour'
+
+
+class Price_Rollup_1_Day(Price_Rollup_Mixin, Base):
+    __tablename__ = 'price_rollup_1_day'
+
+
+class Price_Rollup_Pending(Base):
+    __tablename__ = 'price_rollup_pending'
+
+    id = Column(BigInteger, Sequence('price_rollup_pending_id_seq'), primary_key=True)
+    entity_id = Column(Integer, ForeignKey('entities.id', onupdate="CASCADE", ondelete="CASCADE"), nullable=False, index=True)
+    # UTC ms, inclusive, the 1 minute bars written in [first_timestamp, last_timestamp] are not rolled up yet
+    first_timestamp = Column(BigInteger, nullable=False)
+    last_timestamp = Column(BigInteger, nullable=False)
+    queued_at = Column(DateTime, default=datetime.datetime.utcnow, nullable=False)
+
+    def __repr__(self):
+        return f"<Price_Rollup_Pending(id={self.id}, entity_id={self.entity_id}, first_timestamp={self.first_timestamp}, last_timestamp={self.last_timestamp})>"
+
+
+# The partition types that have a rollup and the model that holds it
+ROLLUP_MODELS = {
+    '1_hour': Price_Rollup_1_Hour,
+    '1_day': Price_Rollup_1_Day,
+}
+
+# The partition type the rollups are built from
+ROLLUP_SOURCE_PARTITION_TYPE = '1_min'
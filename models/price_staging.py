@@ -0,0 +1,165 @@
+# models/price_staging.py
+import datetime
+import json
+import numpy as np
+from typing import Any, Callable, List, Optional, Tuple
+from sqlalchemy import Column, Integer, String, Float, Boolean, BigInteger, DateTime, ForeignKey, Index, JSON, Sequence, text
+from support.base import Base
+from support.partition_manager import Partition_Manager
+from models.historical_price_data import Historical_Price_Data
+from models.price_coverage import Price_Coverage
+from models.price_rollup import Price_Rollup_Pending, ROLLUP_SOURCE_PARTITION_TYPE
+
+# Purpose:
+# 1. Land fetched bars first in an UNLOGGED staging table, an append without WAL or primary key/BRIN index maintenance, so
+#    a slow partition write no longer stalls the api fetch loop and a crash of the updater keeps what was already downloaded.
+# 2. Merge the staged bars into the historical_price_data partitions in large batches: sorted, deduplicated and upserted
+#    in one INSERT ... SELECT DISTINCT ON ... ON CONFLICT per batch of staged responses.
+#
+# Workflow:
+# 1. Price_Staging.stage_bars copies the validated bars of one api response with a new batch id and records the batch (entity,
+#    partition type, the ranges the response covers) in price_staging_batches, both in the same transaction.
+# 2. Price_Staging.merge_pending claims the oldest batches (FOR UPDATE SKIP LOCKED, so several mergers never claim the same
+#    batch), creates the partitions they need, merges their bars, records their coverage (Price_Coverage) and deletes
+#    them, all in one transaction. A failed merge leaves the batches staged for the next run. Merged 1 minute batches are
+#    queued for the rollups (models/price_rollup.py) in the same transaction.
+# 3. Historical_Price_Data_Mangager.merge_staged_bars drives the merge, inline after a fetch or from its background merger.
+#
+# UNLOGGED tables are emptied by PostgreSQL after a crash of the database server itself, staged bars that were not merged
+# yet are then simply fetched again (their coverage is only recorded when they are merged).
+
+
+class Price_Staging_Batch(Base):
+    __tablename__ = 'price_staging_batches'
+
+    id = Column(BigInteger, Sequence('price_staging_batches_id_seq'), primary_key=True)
+    entity_id = Column(Integer, ForeignKey('entities.id', onupdate="CASCADE", ondelete="CASCADE"), nullable=False)
+    partition_type = Column(String(16), nullable=False)
+    # [[from, to], ...] UTC ms, inclusive, recorded in Price_Coverage once the batch is merged
+    covered_ranges = Column(JSON, nullable=False)
+    row_count = Column(Integer, nullable=False)
+    staged_at = Column(DateTime, default=datetime.datetime.utcnow, nullable=False)
+
+    def __repr__(self):
+        return f"<Price_Staging_Batch(id={self.id}, entity_id={self.entity_id}, partition_type='{self.partition_type}', row_count={self.row_count}, staged_at='{self.staged_at}')>"
+
+
+class Price_Staging(Base):
+    __tablename__ = 'price_staging'
+    __table_args__ = (
+        # Batch ids only grow, a BRIN index finds a batch's rows for a few pages of index
+        Index('ix_price_staging_batch_id', 'batch_id', postgresql_using='brin'),
+        {'prefixes': ['UNLOGGED']},
+    )
+    batch_id = Column(BigInteger, nullable=False)
+    entity_id = Column(Integer, nullable=False)
+    timestamp = Column(BigInteger, nullable=False)
+    open = Column(Float, nullable=False)
+    high = Column(Float, nullable=False)
+    low = Column(Float, nullable=False)
+    close = Column(Float, nullable=True)
+    adjusted_close = Column(Float, nullable=True)
+    volume = Column(Float, nullable=False)
+    is_regular_trading_hours = Column(Boolean, nullable=False)
+    source = Column(String, nullable=False)
+    last_updated = Column(DateTime, nullable=False)
+    updated_by = Column(String, nullable=False)
+
+    # No primary key constraint in the database, appends stay as cheap as possible. The mapper still needs one.
+    __mapper_args__ = {'primary_key': [batch_id, timestamp]}
+
+    # Columns written by stage_bars, in COPY order
+    copy_columns = ['batch_id'] + Historical_Price_Data.copy_columns
+
+    @classmethod # Must pass db because will have circular import error otherwise
+    def stage_bars(cls, db, bars: np.ndarray, entity_id: int, partition_type: str, source: str, last_updated: datetime.datetime, updated_by: str, covered_ranges: List[Tuple[int, int]]) -> int:
+        """
+        Appends a CANDLE_DTYPE bar array (one api response) to the staging table as a new batch.
+
+        Args:
+            db (DB): The database to stage in.
+            bars (np.ndarray): The bars, see candles_to_bar_array, already checked by Historical_Price_Data.validate_bars so
+                covered_ranges can be computed from the bars that are actually staged.
+            entity_id (int), partition_type (str), source (str), last_updated (datetime), updated_by (str): Written to every bar.
+            covered_ranges (list[tuple[int, int]]): The (from, to) UTC ms ranges the response covers, inclusive.
+
+        Returns:
+            int: The number of bars staged.
+        """
+        if not len(bars):
+            return 0
+
+        with db.session_scope() as session:
+            batch_id = session.execute(text("SELECT nextval('price_staging_batches_id_seq')")).scalar()
+        rows = ([batch_id] + row for row in Historical_Price_Data.bars_to_rows(bars, entity_id, source, last_updated, updated_by))
+        record_batch = (
+            f"INSERT INTO {Price_Staging_Batch.__tablename__} (id, entity_id, partition_type, covered_ranges, row_count, staged_at) VALUES (%s, %s, %s, %s, %s, %s)",
+            (batch_id, entity_id, partition_type, json.dumps([[int(covered_from), int(covered_to)] for covered_from, covered_to in covered_ranges]), len(bars), datetime.datetime.utcnow()),
+        )
+        return db.copy_rows_to_table(cls.__tablename__, cls.copy_columns, rows, extra_statements=[record_batch])
+
+    @classmethod # Must pass db because will have circular import error otherwise
+    def merge_pending(cls, db, partition_type: str, entity_ids: Optional[List[int]] = None, max_batches: int = 500, calendar_for_entity: Optional[Callable[[int], Any]] = None) -> Tuple[int, List[int]]:
+        """
+        Merges up to max_batches of the oldest staged batches of a partition type into its partitions. When a bar was staged
+        more than once the most recently staged one wins, bars that are already stored with the same values are skipped.
+
+        Args:
+            db (DB): The database.
+            partition_type (str): The partition type to merge.
+            entity_ids (list[int], optional): Only merge the batches of these entities. Defaults to all entities.
+            max_batches (int, optional): Number of batches merged in one transaction. Defaults to 500.
+            calendar_for_entity (Callable, optional): Returns the Trading_Calendar of an entity id, so its coverage is merged
+                across closed time, see Price_Coverage.add_ranges. Defaults to None.
+
+        Returns:
+            tuple[int, list[int]]: The number of batches merged (0 when nothing was pending) and the entities they belong to.
+        """
+        with db.session_scope() as session:
+            query = session.query(Price_Staging_Batch).filter(Price_Staging_Batch.partition_type == partition_type)
+            if entity_ids is not None:
+                query = query.filter(Price_Staging_Batch.entity_id.in_(entity_ids))
+            batches = query.order_by(Price_Staging_Batch.id).limit(max_batches).with_for_update(skip_locked=True).all()
+            if not batches:
+                return 0, []
+            batch_ids = [batch.id for batch in batches]
+
+            first_timestamp, last_timestamp = session.execute(
+                text(f"SELECT min(timestamp), max(timestamp) FROM {cls.__tablename__} WHERE batch_id = ANY(:batch_ids)"), {'batch_ids': batch_ids}
+            ).one()
+            if first_timestamp is not None:
+                Partition_Manager.ensure_partitions(db.engine, partition_type, first_timestamp, last_timestamp)
+                session.execute(text(cls.merge_statement(partition_type)), {'batch_ids': batch_ids})
+                if partition_type == ROLLUP_SOURCE_PARTITION_TYPE:
+                    session.execute(text(
+                        f"INSERT INTO {Price_Rollup_Pending.__tablename__} (id, entity_id, first_timestamp, last_timestamp, queued_at) "
+                        f"SELECT nextval('price_rollup_pending_id_seq'), entity_id, min(timestamp), max(timestamp), :queued_at "
+                        f"FROM {cls.__tablename__} WHERE batch_id = ANY(:batch_ids) GROUP BY batch_id, entity_id"
+                    ), {'batch_ids': batch_ids, 'queued_at': datetime.datetime.utcnow()})
+
+            for batch in batches:
+                calendar = calendar_for_entity(batch.entity_id) if calendar_for_entity is not None else None
+                Price_Coverage.add_ranges(session, batch.entity_id, partition_type, [tuple(covered_range) for covered_range in batch.covered_ranges], calendar=calendar)
+
+            session.execute(text(f"DELETE FROM {cls.__tablename__} WHERE batch_id = ANY(:batch_ids)"), {'batch_ids': batch_ids})
+            session.query(Price_Staging_Batch).filter(Price_Staging_Batch.id.in_(batch_ids)).delete(synchronize_session=False)
+            return len(batches), sorted({batch.entity_id for batch in batches})
+
+    @staticmethod
+    def merge_statement(partition_type: str) -> str:
+        """
+        Returns the INSERT ... SELECT DISTINCT ON ... ON CONFLICT statement merging the staged bars of :batch_ids into the
+        partitioned table of the partition type, see DB.upsert_rows_to_table for the same merge from a temporary table.
+        """
+        target = Partition_Manager.parent_table_name(partition_type)
+        columns = ', '.join(f'"{column}"' for column in Historical_Price_Data.copy_columns)
+        keys = ', '.join(f'"{column}"' for column in Historical_Price_Data.key_columns)
+        updates = ', '.join(f'"{column}" = EXCLUDED."{column}"' for column in Historical_Price_Data.copy_columns if column not in Historical_Price_Data.key_columns)
+        target_compare = ', '.join(f'"{target}"."{column}"' for column in Historical_Price_Data.compare_columns)
+        excluded_compare = ', '.join(f'EXCLUDED."{column}"' for column in Historical_Price_Data.compare_columns)
+        # DISTINCT ON keeps the most recently staged bar per key, ON CONFLICT can not update the same row twice in one statement
+        return (
+            f'INSERT INTO "{target}" ({columns}) '
+            f'SELECT DISTINCT ON ({keys}) {columns} FROM {Price_Staging.__tablename__} WHERE batch_id = ANY(:batch_ids) ORDER BY {keys}, batch_id DESC '
+            f'ON CONFLICT ({keys}) DO UPDATE SET {updates} WHERE ({target_compare}) IS DISTINCT FROM ({excluded_compare})'
+        )
@@ -0,0 +1,17 @@
+# rebuild_price_coverage.py
+from historical_price_data_manager import Historical_Price_Data_Mangager
+
+# Purpose: Rebuild the price_coverage table (models/price_coverage.py) from the bars already stored in the Historical_Price_Data partitions.
+#
+# Usage Instructions:
+# Run once after adding the price_coverage table, and again whenever bars were loaded without going thru Historical_Price_Data_Mangager:
+#     python rebuild_price_coverage.py
+# Until a partition type has been rebuilt, gap checks keep diffing the stored bars for it.
+
+
+def main():
+    manager = Historical_Price_Data_Mangager(user='Price Coverage Rebuild')
+    manager.rebuild_price_coverage()
+
+if __name__ == '__main__':
+    main()
@@ -2,12 +2,15 @@
 
 import subprocess
 import os
+import csv
+import io
 
 import pandas as pd
 
 from datetime import datetime, timedelta
 from sqlalchemy import create_engine, inspect, text
 from sqlalchemy.orm import sessionmaker
+from psycopg2 import sql
 from contextlib import contextmanager
 
 from gitignore.config import POSTGRES_HOST, POSTGRES_PORT, POSTGRES_USER, POSTGRES_PASSWORD, POSTGRES_DB, DATABASE_URL, BACKUP_DIR
@@ -48,6 +51,19 @@ from models import *
 BACKUP_FOLDER2 = f'D:\\Database Backups\\'
 
 
+class Upsert_Batch_Error(Exception):
+    """
+    Raised by DB.upsert_rows_to_table once every batch was attempted and at least one of them failed. The batches that
+    succeeded are committed, row_count counts their rows.
+    """
+    def __init__(self, table_name, failed_batches, batch_count, row_count):
+        self.table_name = table_name
+        self.failed_batches = failed_batches
+        self.batch_count = batch_count
+        self.row_count = row_count
+        super().__init__(f"{len(failed_batches)} of {batch_count} batches failed to upsert into {table_name} (batches {failed_batches}), {row_count} rows were written")
+
+
 class DB:
     """
     A class for working with a PostgreSQL database using SQLAlchemy.
@@ -59,6 +75,8 @@ class DB:
         backup_table: Backup a table in the database to a timestamped .sql file in the specified backup directory.
         setup_postgis_db: Set up the PostGIS database and enable necessary extensions.
         csv_to_db_table: Write the content of a CSV file to a SQL table.
+        copy_rows_to_table: Stream rows into a table with COPY FROM STDIN.
+        upsert_rows_to_table: Merge rows into a table thru a staging table with INSERT ... ON CONFLICT DO UPDATE.
     """
     # Creating a singleton class
     _instance= None
@@ -340,6 +358,127 @@ class DB:
             logger.error(f'Error encountered while trying to write datafile to sql table: {e}')
             return False
 
+    def copy_rows_to_table(self, table_name, columns, rows, chunk_size=100000, extra_statements=None):
+        """
+        Streams rows into a table with PostgreSQL COPY FROM STDIN (CSV format) thru psycopg2's copy_expert, bypassing the ORM.
+        Rows are written in chunks of chunk_size so only one chunk is held as CSV text at a time, every chunk runs in the
+        same transaction so either all rows are loaded or none.
+
+        Args:
+            table_name (str): The name of the table to load, quoted so mixed case partition names work.
+            columns (list[str]): The columns the values of each row are written to, in order.
+            rows (Iterable[Sequence]): The rows, None is written as NULL.
+            chunk_size (int, optional): Number of rows sent per COPY. Defaults to 100000.
+            extra_statements (list[tuple[str, Sequence]], optional): (statement, parameters) run after the copy in the same
+                transaction, e.g. to record what was loaded. Defaults to None.
+
+        Returns:
+            int: The number of rows copied.
+        """
+        connection = self.engine.raw_connection()
+        try:
+            cursor = connection.cursor()
+            row_count = 0
+            for chunk in self._chunk_rows(rows, chunk_size):
+                row_count += self._copy_chunk(cursor, table_name, columns, chunk)
+            for statement, parameters in extra_statements or []:
+                cursor.execute(statement, parameters)
+            connection.commit()
+        except Exception:
+            connection.rollback()
+            raise
+        finally:
+            connection.close()
+
+        return row_count
+
+    def upsert_rows_to_table(self, table_name, columns, rows, key_columns, update_columns, compare_columns=None, chunk_size=50000):
+        """
+        Idempotent bulk write. Each batch of rows is copied into a temporary staging table and merged into the target with
+        INSERT ... ON CONFLICT (key_columns) DO UPDATE ... WHERE the compared values changed. Rows that already exist with the
+        same values are skipped, so re-running an overlapping backfill costs almost nothing and a conflict no longer aborts
+        the write. Every batch commits on its own, a failing batch is logged and rolled back and the remaining batches are
+        still written, then Upsert_Batch_Error is raised so the caller never mistakes a partial write for a complete one.
+
+        Args:
+            table_name (str): The name of the target table.
+            columns (list[str]): The columns the values of each row are written to, in order.
+            rows (Iterable[Sequence]): The rows, None is written as NULL.
+            key_columns (list[str]): The columns of the primary key / unique constraint to merge on.
+            update_columns (list[str]): The columns overwritten when an existing row changed.
+            compare_columns (list[str], optional): The columns compared to decide whether an existing row changed. Defaults to update_columns.
+            chunk_size (int, optional): Number of rows per batch. Defaults to 50000.
+
+        Returns:
+            int: The number of rows inserted or updated.
+
+        Raises:
+            Upsert_Batch_Error: One or more batches failed, after every batch was attempted.
+        """
+        compare_columns = compare_columns or update_columns
+        staging_table = f'staging_{table_name}'.lower()[:63]
+        create_staging = sql.SQL("CREATE TEMP TABLE IF NOT EXISTS {} (LIKE {} INCLUDING DEFAULTS) ON COMMIT DELETE ROWS").format(
+            sql.Identifier(staging_table), sql.Identifier(table_name))
+        # DISTINCT ON keeps one row per key, ON CONFLICT can not update the same row twice in one statement
+        merge_statement = sql.SQL(
+            "INSERT INTO {target} ({columns}) SELECT DISTINCT ON ({keys}) {columns} FROM {staging} ORDER BY {keys} "
+            "ON CONFLICT ({keys}) DO UPDATE SET {updates} WHERE ({target_compare}) IS DISTINCT FROM ({excluded_compare})"
+        ).format(
+            target=sql.Identifier(table_name),
+            staging=sql.Identifier(staging_table),
+            columns=sql.SQL(', ').join(sql.Identifier(column) for column in columns),
+            keys=sql.SQL(', ').join(sql.Identifier(column) for column in key_columns),
+            updates=sql.SQL(', ').join(sql.SQL("{} = EXCLUDED.{}").format(sql.Identifier(column), sql.Identifier(column)) for column in update_columns),
+            target_compare=sql.SQL(', ').join(sql.SQL("{}.{}").format(sql.Identifier(table_name), sql.Identifier(column)) for column in compare_columns),
+            excluded_compare=sql.SQL(', ').join(sql.SQL("EXCLUDED.{}").format(sql.Identifier(column)) for column in compare_columns),
+        )
+
+        row_count = 0
+        batch_count = 0
+        failed_batches = []
+        connection = self.engine.raw_connection()
+        try:
+            cursor = connection.cursor()
+            for batch_number, chunk in enumerate(self._chunk_rows(rows, chunk_size)):
+                batch_count += 1
+                try:
+                    cursor.execute(create_staging)
+                    self._copy_chunk(cursor, staging_table, columns, chunk)
+                    cursor.execute(merge_statement)
+                    row_count += cursor.rowcount
+                    connection.commit()
+                except Exception as e:
+                    connection.rollback()
+                    logger.error(f"Error upserting batch {batch_number} ({len(chunk)} rows) into {table_name}: {e}")
+                    failed_batches.append(batch_number)
+        finally:
+            connection.close()
+
+        if failed_batches:
+            raise Upsert_Batch_Error(table_name, failed_batches, batch_count, row_count)
+        return row_count
+
+    @staticmethod
+    def _chunk_rows(rows, chunk_size):
+        chunk = []
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) == chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    @staticmethod
+    def _copy_chunk(cursor, table_name, columns, chunk):
+        copy_statement = sql.SQL("COPY {} ({}) FROM STDIN WITH (FORMAT csv)").format(
+            sql.Identifier(table_name), sql.SQL(', ').join(sql.Identifier(column) for column in columns))
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(chunk)
+        buffer.seek(0)
+        cursor.copy_expert(copy_statement, buffer)
+        return len(chunk)
+
 
 def main():
     db = DB()
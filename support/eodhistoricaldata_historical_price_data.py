@@ -9,12 +9,14 @@ from helpers.db_query_helper import get_exchange_for_symbol
 from helpers.time_helper import get_current_utc_datetime
 from helpers.logging_helper import configure_logging, logger
 from helpers.symbol_eodhistoricaldata_helper import extract_symbol
+from helpers.response_cache_helper import Response_Cache
 from helpers.data_helper import add_source_and_updated_info
 from models import Category_For_Metric, Metric, Metric_Value, Symbol_EODHistoricalData, Symbol_TD_Ameritrade
 from models.historical_price_data import Historical_Price_Data
 from models import Entity
 from datetime import datetime, timedelta
 import time
+import pytz
 from support.db import DB
 from retry import retry
 import requests
@@ -30,6 +32,8 @@ class EODHistoricalData_Historical_Price_Data:
         self.db = DB()
         self.exchanges = ['NASDAQ', 'NYSE', 'BATS', 'AMEX']
         self.output_dir = './data/eodhistorical_historical_price_data'
+        # Responses of closed windows are kept on disk, see helpers/response_cache_helper.py
+        self.response_cache = Response_Cache.get_instance()
     
     def get_bulk_data(self, exchange, date=None, data_type=None, symbols=None, fmt='json', filter=None):
         """
@@ -92,7 +96,9 @@ class EODHistoricalData_Historical_Price_Data:
             logger.info(f'File already exists for {period} period data for symbol: {symbol} from {_from} to {to}. Skipping download.')
             return [], None
 
-        response = requests.get(url)
+        # The api token is part of the url, it is not part of the cache parameters
+        cache_params = {'symbol': symbol, 'period': period, 'order': order, 'from': _from, 'to': to}
+        response = self.response_cache.fetch('eodhistoricaldata/eod', cache_params, lambda: requests.get(url), window_end=self.response_cache.window_end_of_day(to) if _from and to else None)
 
         if response.status_code == 404:
             logger.error(f"Resource not found for symbol '{symbol}'. Skipping to the next symbol.")
@@ -179,7 +185,10 @@ class EODHistoricalData_Historical_Price_Data:
             logger.info(f"File already exists for {interval} interval data for symbol: {symbol} from {start_datetime_utc} to {end_datetime_utc}. Skipping download.")
             return
 
-        response = requests.get(url)
+        # from and to are unix seconds (UTC)
+        cache_params = {'symbol': symbol, 'interval': interval, 'from': start_datetime_utc, 'to': end_datetime_utc}
+        window_end = datetime.fromtimestamp(end_datetime_utc, tz=pytz.UTC) if isinstance(end_datetime_utc, (int, float)) else None
+        response = self.response_cache.fetch('eodhistoricaldata/intraday', cache_params, lambda: requests.get(url), window_end=window_end)
 
         if response.status_code == 404:
             logger.error(f"Resource not found for symbol '{symbol}'. Skipping to the next symbol.")
@@ -0,0 +1,161 @@
+# support/partition_maintenance.py
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+from sqlalchemy import text
+from models import Historical_Price_Data, Partition_Stats
+from support.db import DB
+from support.partition_manager import Partition_Manager
+from helpers.logging_helper import configure_logging, log_exception, logger
+
+# Purpose:
+# 1. Add a BRIN index on timestamp to every historical_price_data partition. Bars are appended in timestamp order, so a
+#    BRIN index is a few pages per partition and lets timestamp-only scans skip most blocks, the PK B-tree leads with entity_id.
+# 2. Run ANALYZE (and VACUUM) only on the partitions written since the last run, autovacuum may take a long time to get to
+#    a partition after a bulk load and never analyzes the partitioned parents themselves.
+# 3. Record per partition stats in partition_stats (models/partition_stats.py) for the planner and our own tooling.
+#
+# Workflow:
+# 1. Pre-create the upcoming partitions (Partition_Manager.precreate_partitions).
+# 2. List the partitions from the catalog with their pg_stat_user_tables write counters and compare the counters with the
+#    ones stored at the last run. Partitions whose counters moved (or that were never maintained) are due.
+# 3. For every due partition: create the BRIN index if it is missing, then VACUUM (ANALYZE) or ANALYZE it.
+# 4. ANALYZE the parents that had a due partition and store the fresh numbers in partition_stats, with the write counters
+#    read in step 2 so writes made during the run are picked up by the next one.
+#
+# Usage:
+#     python maintain_partitions.py
+# VACUUM and CREATE INDEX CONCURRENTLY can not run inside a transaction, they run on an AUTOCOMMIT connection.
+
+configure_logging()
+
+
+class Partition_Maintenance:
+    """
+    Maintenance job for the historical_price_data_{partition_type} partitioned tables, see support/partition_manager.py.
+    """
+
+    def __init__(self, db: Optional[DB] = None):
+        self.db = db or DB()
+
+    def run(self, partition_types: Optional[Iterable[str]] = None, vacuum: bool = True, force: bool = False) -> List[str]:
+        """
+        Runs the maintenance on the partitions written since the last run.
+
+        Args:
+            partition_types (Iterable[str], optional): The partition types to maintain. Defaults to all of them.
+            vacuum (bool, optional): VACUUM (ANALYZE) the due partitions instead of only analyzing them. Defaults to True.
+            force (bool, optional): Treat every partition as due. Defaults to False.
+
+        Returns:
+            List[str]: The names of the partitions that were maintained.
+        """
+        partition_types = list(partition_types or Historical_Price_Data.partition_ranges)
+        Partition_Manager.precreate_partitions(self.db.engine, partition_types)
+
+        partitions = self.get_partitions(partition_types)
+        with self.db.session_scope() as session:
+            stored_counts = dict(session.query(Partition_Stats.partition_name, Partition_Stats.modification_count).filter(
+                Partition_Stats.partition_name.in_([partition['partition_name'] for partition in partitions])
+            ).all())
+
+        due_partitions = [
+            partition for partition in partitions
+            if force or stored_counts.get(partition['partition_name']) != partition['modification_count']
+        ]
+        if not due_partitions:
+            logger.info(f"No partition of {', '.join(partition_types)} was written since the last maintenance run")
+            return []
+
+        maintained = []
+        for partition in due_partitions:
+            try:
+                self.maintain_partition(partition['partition_name'], create_brin_index=not partition['has_brin_index'], vacuum=vacuum)
+                maintained.append(partition)
+            except Exception as e:
+                log_exception(e)
+
+        # Partitioned parents are never analyzed by autovacuum, their stats drive estimates for queries spanning partitions
+        for parent_table in sorted({partition['parent_table'] for partition in maintained}):
+            with self.autocommit_connection() as connection:
+                connection.execute(text(f'ANALYZE "{parent_table}"'))
+
+        self.record_stats(maintained, vacuumed=vacuum)
+        logger.info(f"Maintained {len(maintained)} of {len(partitions)} partitions ({len(due_partitions) - len(maintained)} failed)")
+        return [partition['partition_name'] for partition in maintained]
+
+    def get_partitions(self, partition_types: Iterable[str]) -> List[Dict]:
+        """
+        Lists the partitions of the partition types with their row estimate, size, write counters and whether they have a
+        valid BRIN index.
+        """
+        parent_tables = [Partition_Manager.parent_table_name(partition_type) for partition_type in partition_types]
+        return self._query_partitions('parent.relname = ANY(:names)', parent_tables)
+
+    def maintain_partition(self, partition_name: str, create_brin_index: bool = True, vacuum: bool = True) -> None:
+        """
+        Creates the BRIN index on timestamp of a partition if asked to, then VACUUM (ANALYZE) or ANALYZE it.
+        """
+        with self.autocommit_connection() as connection:
+            if create_brin_index:
+                index_name = f'{partition_name}_timestamp_brin'
+                # A failed concurrent build leaves an invalid index behind, drop it so it is rebuilt
+                connection.execute(text(f'DROP INDEX CONCURRENTLY IF EXISTS "{index_name}"'))
+                connection.execute(text(f'CREATE INDEX CONCURRENTLY "{index_name}" ON "{partition_name}" USING brin (timestamp)'))
+            connection.execute(text(f'VACUUM (ANALYZE) "{partition_name}"' if vacuum else f'ANALYZE "{partition_name}"'))
+
+    def record_stats(self, partitions: List[Dict], vacuumed: bool) -> None:
+        """
+        Stores the current row estimate, size and BRIN index state of the maintained partitions in partition_stats, with the
+        write counters read before the maintenance (see get_partitions). The counters are reported to pg_stat_user_tables
+        asynchronously, reading them again right after VACUUM/ANALYZE may return values that miss writes made meanwhile, which
+        the next run would then skip.
+        """
+        if not partitions:
+            return
+        modification_counts = {partition['partition_name']: partition['modification_count'] for partition in partitions}
+        rows = self._query_partitions('child.relname = ANY(:names)', list(modification_counts))
+
+        now = datetime.utcnow()
+        prefix = Partition_Manager.parent_table_name('')
+        with self.db.session_scope() as session:
+            for row in rows:
+                partition_stats = session.get(Partition_Stats, row['partition_name'])
+                if partition_stats is None:
+                    partition_stats = Partition_Stats(partition_name=row['partition_name'])
+                    session.add(partition_stats)
+                partition_stats.parent_table = row['parent_table']
+                partition_stats.partition_type = row['parent_table'][len(prefix):]
+                partition_stats.row_count = row['row_count']
+                partition_stats.total_bytes = row['total_bytes']
+                partition_stats.modification_count = modification_counts[row['partition_name']]
+                partition_stats.has_brin_index = row['has_brin_index']
+                partition_stats.last_analyzed = now
+                if vacuumed:
+                    partition_stats.last_vacuumed = now
+                partition_stats.last_maintained = now
+
+    def autocommit_connection(self):
+        """
+        Returns a connection outside of a transaction, for VACUUM and CREATE/DROP INDEX CONCURRENTLY.
+        """
+        return self.db.engine.connect().execution_options(isolation_level='AUTOCOMMIT')
+
+    def _query_partitions(self, condition: str, names: List[str]) -> List[Dict]:
+        with self.db.engine.connect() as connection:
+            rows = connection.execute(text(
+                "SELECT child.relname AS partition_name, parent.relname AS parent_table, "
+                "GREATEST(child.reltuples, 0)::bigint AS row_count, pg_total_relation_size(child.oid) AS total_bytes, "
+                "COALESCE(stats.n_tup_ins + stats.n_tup_upd + stats.n_tup_del, 0) AS modification_count, "
+                "EXISTS ("
+                "    SELECT 1 FROM pg_index JOIN pg_class index_class ON pg_index.indexrelid = index_class.oid "
+                "    JOIN pg_am ON index_class.relam = pg_am.oid "
+                "    WHERE pg_index.indrelid = child.oid AND pg_index.indisvalid AND pg_am.amname = 'brin'"
+                ") AS has_brin_index "
+                "FROM pg_inherits "
+                "JOIN pg_class parent ON pg_inherits.inhparent = parent.oid "
+                "JOIN pg_class child ON pg_inherits.inhrelid = child.oid "
+                "LEFT JOIN pg_stat_user_tables stats ON stats.relid = child.oid "
+                f"WHERE {condition} "
+                "ORDER BY child.relname"
+            ), {'names': names}).mappings().all()
+        return [dict(row) for row in rows]
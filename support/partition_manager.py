@@ -0,0 +1,151 @@
+# support/partition_manager.py
+import re
+import threading
+from datetime import datetime
+from typing import Dict, Iterable, Optional, Set
+from sqlalchemy import text
+from support.table_registry import Table_Registry
+from helpers.logging_helper import configure_logging, logger
+
+# Purpose:
+# 1. Store the bars of each partition type in a native PostgreSQL range partitioned table, historical_price_data_{partition_type},
+#    partitioned on the BigInteger ms timestamp: CREATE TABLE ... PARTITION OF ... FOR VALUES FROM (ms) TO (ms).
+# 2. Keep a cached map of the partitions that exist, so writes never pay catalog lookups (no has_table per write).
+# 3. Pre-create partitions ahead of the write frontier so writers rarely have to create one inline.
+#
+# Workflow:
+# 1. Writers call Partition_Manager.ensure_partitions(engine, partition_type, first_timestamp, last_timestamp) and then write
+#    to the parent table, PostgreSQL routes every bar to its partition.
+# 2. Readers query the parent table with timestamp bounds in ms, which PostgreSQL uses to prune partitions.
+# 3. precreate_partitions(engine) can be scheduled (e.g. by the updater) to create the next partitions of every partition type.
+#
+# Partitions are Historical_Price_Data.partition_ranges long and aligned to the unix epoch, so a timestamp always maps to
+# the same partition. Each parent has its own partition type so the (entity_id, timestamp) key does not collide across frequencies.
+# The parents copy their columns from the historical_price_data table (models/historical_price_data.py).
+
+configure_logging()
+
+
+class Partition_Manager:
+    """
+    Process-wide, thread-safe manager of the historical_price_data_{partition_type} partitioned tables.
+
+    Attributes:
+        _partitions (dict): Maps each parent table name to the set of partition starts (UTC ms) known to exist.
+        _lock (threading.Lock): Lock guarding catalog loads and partition creation.
+    """
+    TEMPLATE_TABLE = 'historical_price_data'
+    # Number of partitions created past the newest written bar
+    PRECREATE_AHEAD = 2
+
+    _partitions: Dict[str, Set[int]] = {}
+    _lock = threading.Lock()
+
+    @staticmethod
+    def parent_table_name(partition_type: str) -> str:
+        """
+        Returns the name of the partitioned table holding the bars of a partition type, e.g. historical_price_data_1_min.
+        """
+        return f'historical_price_data_{partition_type}'
+
+    @staticmethod
+    def partition_range_ms(partition_type: str) -> int:
+        # Imported here, models import this module thru Historical_Price_Data
+        from models.historical_price_data import Historical_Price_Data
+        return int(Historical_Price_Data.partition_ranges[partition_type].total_seconds() * 1000)
+
+    @classmethod
+    def partition_name(cls, partition_type: str, partition_start_ms: int) -> str:
+        """
+        Returns the name of the partition starting at partition_start_ms, e.g. historical_price_data_1_min_20230501.
+        """
+        return f'{cls.parent_table_name(partition_type)}_{datetime.utcfromtimestamp(partition_start_ms / 1000).strftime("%Y%m%d")}'
+
+    @classmethod
+    def ensure_partitions(cls, engine, partition_type: str, first_timestamp: int, last_timestamp: int, ahead: Optional[int] = None) -> None:
+        """
+        Makes sure the parent table and every partition covering [first_timestamp, last_timestamp] exist, plus `ahead`
+        partitions past last_timestamp. Only partitions missing from the cached map cost a round-trip.
+
+        Args:
+            engine (sqlalchemy.engine.Engine): Engine used to create the tables.
+            partition_type (str): The partition type, see Historical_Price_Data.determine_partition_type.
+            first_timestamp (int): The oldest bar to be written (UTC ms).
+            last_timestamp (int): The newest bar to be written (UTC ms).
+            ahead (int, optional): Number of partitions to pre-create past last_timestamp. Defaults to PRECREATE_AHEAD.
+        """
+        range_ms = cls.partition_range_ms(partition_type)
+        ahead = cls.PRECREATE_AHEAD if ahead is None else ahead
+        first_start = (int(first_timestamp) // range_ms) * range_ms
+        last_start = (int(last_timestamp) // range_ms + ahead) * range_ms
+        wanted_starts = range(first_start, last_start + 1, range_ms)
+
+        parent = cls.parent_table_name(partition_type)
+        existing = cls._partitions.get(parent)
+        if existing is not None and all(start in existing for start in wanted_starts):
+            return
+
+        with cls._lock:
+            existing = cls._load_partitions(engine, partition_type)
+            missing_starts = [start for start in wanted_starts if start not in existing]
+            if not missing_starts:
+                return
+            with engine.begin() as connection:
+                for start in missing_starts:
+                    connection.execute(text(
+                        f'CREATE TABLE IF NOT EXISTS "{cls.partition_name(partition_type, start)}" PARTITION OF "{parent}" '
+                        f'FOR VALUES FROM ({start}) TO ({start + range_ms})'
+                    ))
+            existing.update(missing_starts)
+            logger.info(f"Created {len(missing_starts)} partitions of {parent}")
+
+    @classmethod
+    def precreate_partitions(cls, engine, partition_types: Optional[Iterable[str]] = None, now: Optional[datetime] = None) -> None:
+        """
+        Creates the partition holding `now` (defaults to the current time) and the PRECREATE_AHEAD partitions after it for every partition type.
+        """
+        from models.historical_price_data import Historical_Price_Data
+        now_ms = int(((now or datetime.utcnow()) - datetime(1970, 1, 1)).total_seconds() * 1000)
+        for partition_type in partition_types or Historical_Price_Data.partition_ranges:
+            cls.ensure_partitions(engine, partition_type, now_ms, now_ms)
+
+    @classmethod
+    def invalidate(cls, partition_type: Optional[str] = None) -> None:
+        """
+        Forgets the cached partition map (of one partition type, or all), e.g. after partitions were dropped outside this process.
+        """
+        with cls._lock:
+            if partition_type is None:
+                cls._partitions.clear()
+            else:
+                cls._partitions.pop(cls.parent_table_name(partition_type), None)
+
+    @classmethod
+    def _load_partitions(cls, engine, partition_type: str) -> Set[int]:
+        # Called with cls._lock held, creates the parent on first use and reads its partitions from the catalog once
+        parent = cls.parent_table_name(partition_type)
+        if parent in cls._partitions:
+            return cls._partitions[parent]
+
+        range_ms = cls.partition_range_ms(partition_type)
+        with engine.begin() as connection:
+            connection.execute(text(
+                f'CREATE TABLE IF NOT EXISTS "{parent}" (LIKE "{cls.TEMPLATE_TABLE}" INCLUDING DEFAULTS, PRIMARY KEY (entity_id, timestamp)) '
+                f'PARTITION BY RANGE (timestamp)'
+            ))
+            bounds = connection.execute(text(
+                "SELECT pg_get_expr(child.relpartbound, child.oid) FROM pg_inherits "
+                "JOIN pg_class parent ON pg_inherits.inhparent = parent.oid "
+                "JOIN pg_class child ON pg_inherits.inhrelid = child.oid "
+                "WHERE parent.relname = :parent"
+            ), {'parent': parent}).scalars().all()
+        Table_Registry.invalidate(parent)
+
+        # Bounds read "FOR VALUES FROM ('1682899200000') TO ('1682985600000')", keep the starts that are on our grid
+        starts = set()
+        for bound in bounds:
+            lower_bound = re.findall(r'-?\d+', bound.split(' TO ')[0])
+            if lower_bound and int(lower_bound[-1]) % range_ms == 0:
+                starts.add(int(lower_bound[-1]))
+        cls._partitions[parent] = starts
+        return starts
@@ -0,0 +1,88 @@
+# support/table_registry.py
+import threading
+import time
+from typing import Dict, Optional
+from sqlalchemy import MetaData, Table, inspect
+
+# Purpose:
+# 1. Reflect each historical_price_data_* table from the database once per process instead of on every read.
+# 2. Remember for a short while that a table does not exist yet so the read path does not run has_table for every request either.
+#
+# Workflow:
+# 1. Readers call Table_Registry.get_table(table_name, engine) and receive the reflected Table, or None if the table does not exist.
+# 2. Anything that adds a table (Partition_Manager, Historical_Price_Data_Mangager.create_partition_table)
+#    calls Table_Registry.invalidate(table_name) so the next read reflects it right away. Tables created anywhere else
+#    (another process, a migration) are picked up once the cached miss expires, after MISSING_TABLE_TTL_SECONDS.
+#
+# The registry is shared by all threads in the process, reflection happens under a lock so a table is only reflected once.
+
+
+class Table_Registry:
+    """
+    Process-wide, thread-safe cache of reflected tables.
+
+    Attributes:
+        MISSING_TABLE_TTL_SECONDS (float): How long a table that does not exist is remembered as missing.
+        _tables (dict): Maps table names to their reflected Table.
+        _missing (dict): Maps the names of tables that did not exist to when (time.monotonic) to look for them again.
+        _metadata (MetaData): MetaData the tables are reflected into, kept separate from Base.metadata.
+        _lock (threading.Lock): Lock guarding reflection and invalidation.
+    """
+    MISSING_TABLE_TTL_SECONDS = 30.0
+
+    _tables: Dict[str, Table] = {}
+    _missing: Dict[str, float] = {}
+    _metadata = MetaData()
+    _lock = threading.Lock()
+
+    @classmethod
+    def get_table(cls, table_name: str, engine) -> Optional[Table]:
+        """
+        Returns the reflected table, reflecting it on first use.
+
+        Args:
+            table_name (str): The name of the table.
+            engine (sqlalchemy.engine.Engine): Engine used to reflect the table the first time.
+
+        Returns:
+            Table: The reflected table, or None if it does not exist in the database.
+        """
+        # Fast path, single dict reads are atomic so no lock is needed once the table (or its miss) is cached
+        table = cls._tables.get(table_name)
+        if table is not None:
+            return table
+        if cls._missing.get(table_name, 0.0) > time.monotonic():
+            return None
+
+        with cls._lock:
+            table = cls._tables.get(table_name)
+            if table is not None:
+                return table
+            if cls._missing.get(table_name, 0.0) > time.monotonic():
+                return None
+            if not inspect(engine).has_table(table_name):
+                cls._missing[table_name] = time.monotonic() + cls.MISSING_TABLE_TTL_SECONDS
+                return None
+            table = Table(table_name, cls._metadata, autoload_with=engine)
+            cls._tables[table_name] = table
+            cls._missing.pop(table_name, None)
+            return table
+
+    @classmethod
+    def invalidate(cls, table_name: Optional[str] = None) -> None:
+        """
+        Forgets a cached table (or every cached table if no name is given) so it is reflected again on next use.
+
+        Args:
+            table_name (str, optional): The name of the table that was added or changed.
+        """
+        with cls._lock:
+            if table_name is None:
+                cls._tables.clear()
+                cls._missing.clear()
+                cls._metadata.clear()
+                return
+            cls._missing.pop(table_name, None)
+            table = cls._tables.pop(table_name, None)
+            if table is not None:
+                cls._metadata.remove(table)
@@ -1,10 +1,15 @@
 # support/td_ameritrade_historical.py
-import pandas as pd
 import json
+import asyncio
 from datetime import datetime, timedelta
-from typing import List, Dict, Union, Optional,Tuple, Any
+from typing import List, Dict, Union, Optional,Tuple, Any, Iterator
 from support.db import DB
 from support.td_client_wrapper import TD_Client_Wrapper
+from helpers.candle_merge_helper import Candle_Merge_Stats, merge_candle_chunks
+from helpers.single_flight_helper import Single_Flight
+from helpers.response_cache_helper import Response_Cache
+from helpers.interval_helper import Interval_Set
+from helpers.time_helper import datetime_utc_to_timestamp_utc_ms
 from helpers.logging_helper import configure_logging, log_exception, logger
 
 
@@ -16,12 +21,23 @@ td_client = TD_Client_Wrapper.get_instance()
 
 
 class TD_Ameritrade_Historical:
+    # Requests the async fetch engine keeps in flight at once, across all symbols
+    ASYNC_MAX_IN_FLIGHT = 8
+    # Identical price history requests in flight at the same time share one response, across all instances
+    single_flight = Single_Flight()
+    # Fields of get_request_key, the parameters of a response in the response cache
+    REQUEST_KEY_FIELDS = ('endpoint', 'symbol', 'start_datetime_utc', 'end_datetime_utc', 'frequency', 'frequency_type', 'period', 'period_type', 'need_extended_hours_data')
+
     def __init__(self, user='TD_Ameritrade_Historical'):
         self.td_client = TD_Client_Wrapper.get_instance().get_client()
         self.source = "TD Ameritrade"  # Hardcoded source
         self.updater_name = user
         # Create database session
         self.db = DB()
+        # Responses of closed windows are kept on disk, see helpers/response_cache_helper.py
+        self.response_cache = Response_Cache.get_instance()
+        # Overlap statistics of the last get_historical_data_from_td_ameritrade, to tune the chunk planner
+        self.last_merge_stats = None
 
 
    
@@ -29,6 +45,7 @@ class TD_Ameritrade_Historical:
     def get_historical_data_from_td_ameritrade(self, symbol: str, frequency: Union[str, int], frequency_type: str, start_timestamp: Optional[int] = None, end_timestamp: Optional[int] = None, start_datetime_utc: Optional[datetime] = None, end_datetime_utc: Optional[datetime] = None, need_extended_hours_data: bool = False, missing_data_ranges: Optional[List[Tuple[datetime, datetime]]] = None) -> List[dict]:
         """
         Fetches historical data for a given symbol from the TD Ameritrade API based on the specified granularity.
+        Holds every candle of the range in memory, writers should stream iter_historical_data_from_td_ameritrade instead.
 
         Args:
             symbol (str): The stock or ETF symbol.
@@ -40,92 +57,188 @@ class TD_Ameritrade_Historical:
             missing_data_ranges (list[tuple[datetime, datetime]], optional): List of tuples representing the missing date ranges to fetch the historical data for.
 
         Returns:
-            list[dict]: A list of historical data points for the specified symbol and parameters.
+            list[dict]: A list of historical data points for the specified symbol and parameters, ordered by datetime
+                without duplicates. The overlap statistics of the requests are kept in self.last_merge_stats.
+        """
+        chunks = (candles for candles, _ in self.iter_historical_data_from_td_ameritrade(symbol, frequency, frequency_type, start_datetime_utc=start_datetime_utc, end_datetime_utc=end_datetime_utc, need_extended_hours_data=need_extended_hours_data, missing_data_ranges=missing_data_ranges))
+
+        # Overlapping requests return some candles twice, merge the chunks by time and keep the first candle of each time
+        self.last_merge_stats = Candle_Merge_Stats()
+        result = list(merge_candle_chunks(chunks, key='datetime', stats=self.last_merge_stats))
+        if self.last_merge_stats.duplicate_count:
+            logger.info(f"Merged {symbol} {frequency} {frequency_type} candles: {self.last_merge_stats.summary()}")
+
+        return result
+
+
+    def iter_historical_data_from_td_ameritrade(self, symbol: str, frequency: Union[str, int], frequency_type: str, start_datetime_utc: Optional[datetime] = None, end_datetime_utc: Optional[datetime] = None, need_extended_hours_data: bool = False, missing_data_ranges: Optional[List[Tuple[datetime, datetime]]] = None) -> Iterator[Tuple[List[dict], Tuple[datetime, datetime]]]:
+        """
+        Fetches the missing data ranges from the TD Ameritrade API one request at a time and yields the candles of each
+        response as soon as it arrives, so only one response is held in memory. Ranges the special endpoints could not
+        serve are requested from get_historical_data afterwards. Candles of overlapping requests may repeat across chunks.
+
+        Args:
+            See get_historical_data_from_td_ameritrade.
+
+        Yields:
+            tuple[list[dict], tuple[datetime, datetime]]: The candles of one response and the range that was requested.
         """
 
         # If missing_data_ranges is not provided but start_date and end_date are, create a single range list
         if missing_data_ranges is None and start_datetime_utc is not None and end_datetime_utc is not None:
             missing_data_ranges = [(start_datetime_utc, end_datetime_utc)]
+        if not missing_data_ranges:
+            return
 
-        result = []
         used_data_ranges = []
         timedelta_historical_data_special = self.get_timedelta_limit_for_self_get_historical_data_special_endpoint(frequency=frequency, frequency_type=frequency_type)
         timedelta_historical_data = self.get_timedelta_limit_for_self_get_historical_data(frequency_type=frequency_type)
-        if missing_data_ranges:
-            # Get optimized date_ranges
-            grouped_missing_data_ranges = self.process_date_ranges_for_td_ameritrade_historical_data(missing_data_ranges, timedelta_historical_data_special)
-            # For each date range in list of date ranges
-            for missing_data_start_datetime_utc, missing_data_end_datetime_utc in grouped_missing_data_ranges:
-                try:
-                    # Try to get the data for the date range from the endpoint get_historical_data_special
-                    chunk = self.get_historical_data_special(symbol, start_datetime_utc=missing_data_start_datetime_utc, end_datetime_utc=missing_data_end_datetime_utc, frequency=frequency, frequency_type=frequency_type, need_extended_hours_data=need_extended_hours_data)
-                    # If we received data back
-                    if chunk is not None:
-                        data = chunk.json()  # extract data from response
-                        if isinstance(data, list):
-                            result.extend(data)
-                            # add date range to list of data ranges we have used
-                            used_data_ranges.append((missing_data_start_datetime_utc, missing_data_end_datetime_utc))
-                        elif isinstance(data, dict) and 'candles' in data:
-                            result.extend(data['candles'])
-                            used_data_ranges.append((missing_data_start_datetime_utc, missing_data_end_datetime_utc))
-                        else:
-                            logger.error(f"Unexpected data format from get_historical_data_special: {type(data)}")
-                # if the frequency is not valid for the endpoint
-                except UnsupportedFrequencyError:
-                    # Break out of this loop and go to the next endpoints loop
-                    break
-                # Catch any other exceptions and log them so the process can continue
-                except Exception as e:
-                    logger.error(f"Error fetching historical data using specialized endpoints for {symbol}: {e}")
-                    log_exception(e)
-            
-            remaining_missing_data_ranges = []
-            freq = self.td_frequency_to_pandas_frequency(frequency_type=frequency_type, frequency=frequency)
-            # for each date range in missing_data_ranges
-            for original_range_start_datetime_utc, original_range_end_datetime_utc in missing_data_ranges:
-                # Get range of original variable provided as arg to method
-                original_range = pd.date_range(start=original_range_start_datetime_utc, end=original_range_end_datetime_utc, freq=freq or "D")
-                # for each used date range
-                for used_range_start_datetime_utc, used_range_end_datetime_utc in used_data_ranges:
-                    # Get range of dates that data had been provided to first endpoing because we dont need to request this data from the second endpoint
-                    used_range = pd.date_range(start=used_range_start_datetime_utc, end=used_range_end_datetime_utc, freq=freq or "D")
-                    # set original_range to be anything that was included in the original range that was not included in the used_range
-                    original_range = original_range.difference(used_range)
-                    # If there is a range of dates
-                    if not original_range.empty:
-                        # append it to remaining_missing_data_ranges which we rest just prior to beginning this loop
-                        remaining_missing_data_ranges.append((min(original_range), max(original_range)))
-
-            # We now finished looping thru the original missing_data_ranges
-            # group the missing data into optimized date ranges as per the timedelta for the second endpoint
-            grouped_remaining_missing_data_ranges = self.process_date_ranges_for_td_ameritrade_historical_data(remaining_missing_data_ranges, timedelta_historical_data)
-
-            # for each remaining date window in grouped_remaining_missing_data_ranges
-            for remaining_start_datetime_utc, remaining_end_datetime_utc in grouped_remaining_missing_data_ranges:
+        bar_timedelta = self.td_frequency_to_timedelta(frequency_type=frequency_type, frequency=frequency)
+        # Get optimized date_ranges
+        grouped_missing_data_ranges = self.process_date_ranges_for_td_ameritrade_historical_data(missing_data_ranges, timedelta_historical_data_special, step=bar_timedelta)
+        # For each date range in list of date ranges
+        for missing_data_start_datetime_utc, missing_data_end_datetime_utc in grouped_missing_data_ranges:
+            candles = None
+            try:
+                # Try to get the data for the date range from the endpoint get_historical_data_special
+                chunk = self.get_historical_data_special(symbol, start_datetime_utc=missing_data_start_datetime_utc, end_datetime_utc=missing_data_end_datetime_utc, frequency=frequency, frequency_type=frequency_type, need_extended_hours_data=need_extended_hours_data)
+                # If we received data back
+                if chunk is not None:
+                    candles = self.candles_from_special_response(chunk)
+            # if the frequency is not valid for the endpoint
+            except UnsupportedFrequencyError:
+                # Break out of this loop and go to the next endpoints loop
+                break
+            # Catch any other exceptions and log them so the process can continue
+            except Exception as e:
+                logger.error(f"Error fetching historical data using specialized endpoints for {symbol}: {e}")
+                log_exception(e)
+            if candles is not None:
+                # add date range to list of data ranges we have used
+                used_data_ranges.append((missing_data_start_datetime_utc, missing_data_end_datetime_utc))
+                yield candles, (missing_data_start_datetime_utc, missing_data_end_datetime_utc)
+
+        remaining_missing_data_ranges = self.get_remaining_data_ranges(missing_data_ranges, used_data_ranges, frequency=frequency, frequency_type=frequency_type)
+
+        # We now finished looping thru the original missing_data_ranges
+        # group the missing data into optimized date ranges as per the timedelta for the second endpoint
+        grouped_remaining_missing_data_ranges = self.process_date_ranges_for_td_ameritrade_historical_data(remaining_missing_data_ranges, timedelta_historical_data, step=bar_timedelta)
+
+        # for each remaining date window in grouped_remaining_missing_data_ranges
+        for remaining_start_datetime_utc, remaining_end_datetime_utc in grouped_remaining_missing_data_ranges:
+            chunk = None
+            try:
+                # request the data from the second endpoint
+                chunk = self.get_historical_data(symbol, start_datetime_utc=remaining_start_datetime_utc, end_datetime_utc=remaining_end_datetime_utc, frequency=frequency, frequency_type=frequency_type, need_extended_hours_data=need_extended_hours_data)
+            # Catch any exceptions and log them so the process can continue
+            except Exception as e:
+                logger.error(f"Error fetching historical data using specialized endpoints for {symbol}: {e}")
+                log_exception(e)
+            # If we received data back
+            if chunk is not None:
+                yield chunk, (remaining_start_datetime_utc, remaining_end_datetime_utc)
+    
+    
+    def get_historical_data_for_symbols_concurrently(self, missing_data_ranges_by_symbol: Dict[str, List[Tuple[datetime, datetime]]], frequency: Union[str, int], frequency_type: str, need_extended_hours_data: bool = False, max_in_flight: Optional[int] = None) -> Dict[str, List[Tuple[List[dict], Tuple[datetime, datetime]]]]:
+        """
+        Fetches the missing data ranges of many symbols with the asyncio fetch engine, see async_get_historical_data_for_symbols.
+        Must be called from synchronous code, a running event loop should await async_get_historical_data_for_symbols instead.
+        """
+        return asyncio.run(self.async_get_historical_data_for_symbols(missing_data_ranges_by_symbol, frequency, frequency_type, need_extended_hours_data=need_extended_hours_data, max_in_flight=max_in_flight))
+
+
+    async def async_get_historical_data_for_symbols(self, missing_data_ranges_by_symbol: Dict[str, List[Tuple[datetime, datetime]]], frequency: Union[str, int], frequency_type: str, need_extended_hours_data: bool = False, max_in_flight: Optional[int] = None) -> Dict[str, List[Tuple[List[dict], Tuple[datetime, datetime]]]]:
+        """
+        Fetches the missing data ranges of many symbols on the asynchronous tda client (httpx AsyncClient), all request
+        windows of all symbols in flight concurrently up to max_in_flight, instead of one request after another.
+
+        The windows are planned like iter_historical_data_from_td_ameritrade: the specialized endpoints are requested first
+        for every symbol, then the ranges they did not serve are requested from get_price_history.
+
+        Args:
+            missing_data_ranges_by_symbol (dict[str, list[tuple[datetime, datetime]]]): The UTC ranges to fetch per symbol.
+            frequency (Union[str, int]), frequency_type (str), need_extended_hours_data (bool): See get_historical_data_from_td_ameritrade.
+            max_in_flight (int, optional): Requests in flight at once. Defaults to ASYNC_MAX_IN_FLIGHT.
+
+        Returns:
+            dict[str, list[tuple[list[dict], tuple[datetime, datetime]]]]: Per symbol, the same (candles, requested range)
+                batches iter_historical_data_from_td_ameritrade yields, in the same order.
+        """
+        semaphore = asyncio.Semaphore(max_in_flight or self.ASYNC_MAX_IN_FLIGHT)
+        missing_data_ranges_by_symbol = {symbol: ranges for symbol, ranges in missing_data_ranges_by_symbol.items() if ranges}
+        results = {symbol: [] for symbol in missing_data_ranges_by_symbol}
+        if not missing_data_ranges_by_symbol:
+            return results
+
+        timedelta_historical_data_special = self.get_timedelta_limit_for_self_get_historical_data_special_endpoint(frequency=frequency, frequency_type=frequency_type)
+        timedelta_historical_data = self.get_timedelta_limit_for_self_get_historical_data(frequency_type=frequency_type)
+        bar_timedelta = self.td_frequency_to_timedelta(frequency_type=frequency_type, frequency=frequency)
+        try:
+            self.get_special_endpoint_name(frequency=frequency, frequency_type=frequency_type)
+            use_special_endpoint = True
+        except UnsupportedFrequencyError:
+            use_special_endpoint = False
+
+        async def fetch(symbol: str, data_range: Tuple[datetime, datetime], special: bool) -> Optional[List[dict]]:
+            async with semaphore:
                 try:
-                    # request the data from the second endpoint
-                    chunk = self.get_historical_data(symbol, start_datetime_utc=remaining_start_datetime_utc, end_datetime_utc=remaining_end_datetime_utc, frequency=frequency, frequency_type=frequency_type, need_extended_hours_data=need_extended_hours_data)
-                    # If we received data back
-                    if chunk is not None:
-                        # add data to the variable 'result'
-                        result.extend(chunk)
-                # Catch any exceptions and log them so the process can continue
+                    if special:
+                        response = await self.async_get_historical_data_special(client, symbol, start_datetime_utc=data_range[0], end_datetime_utc=data_range[1], frequency=frequency, frequency_type=frequency_type, need_extended_hours_data=need_extended_hours_data)
+                        return self.candles_from_special_response(response) if response is not None else None
+                    params = self.get_price_history_params(start_datetime_utc=data_range[0], end_datetime_utc=data_range[1], frequency=frequency, frequency_type=frequency_type, need_extended_hours_data=need_extended_hours_data)
+                    key = self.get_request_key('get_price_history', symbol, start_datetime_utc=data_range[0], end_datetime_utc=data_range[1], frequency=frequency, frequency_type=frequency_type, need_extended_hours_data=need_extended_hours_data)
+                    response = await self.response_cache.async_fetch('td_ameritrade/get_price_history', self.get_cache_params(key), lambda: client.get_price_history(symbol=symbol, **params), window_end=data_range[1])
+                    return self.candles_from_price_history_response(symbol, response)
                 except Exception as e:
-                    logger.error(f"Error fetching historical data using specialized endpoints for {symbol}: {e}")
+                    logger.error(f"Error fetching historical data for {symbol} between {data_range[0]} and {data_range[1]}: {e}")
                     log_exception(e)
+                    return None
+
+        async def fetch_all(requests: List[Tuple[str, Tuple[datetime, datetime]]], special: bool) -> None:
+            batches = await asyncio.gather(*(fetch(symbol, data_range, special) for symbol, data_range in requests))
+            for (symbol, data_range), candles in zip(requests, batches):
+                if candles is not None:
+                    results[symbol].append((candles, data_range))
+
+        client = TD_Client_Wrapper.get_instance().create_async_client()
+        try:
+            if use_special_endpoint:
+                await fetch_all([
+                    (symbol, data_range)
+                    for symbol, missing_data_ranges in missing_data_ranges_by_symbol.items()
+                    for data_range in self.process_date_ranges_for_td_ameritrade_historical_data(missing_data_ranges, timedelta_historical_data_special, step=bar_timedelta)
+                ], special=True)
+
+            # The ranges the specialized endpoints did not serve, for every symbol at once
+            await fetch_all([
+                (symbol, data_range)
+                for symbol, missing_data_ranges in missing_data_ranges_by_symbol.items()
+                for data_range in self.process_date_ranges_for_td_ameritrade_historical_data(
+                    self.get_remaining_data_ranges(missing_data_ranges, [used_range for _, used_range in results[symbol]], frequency=frequency, frequency_type=frequency_type),
+                    timedelta_historical_data,
+                    step=bar_timedelta,
+                )
+            ], special=False)
+        finally:
+            await client.close_async_session()
+        return results
+
+
+    async def async_get_historical_data_special(self, client, symbol: str, start_datetime_utc: datetime = None, end_datetime_utc: datetime = None, frequency: int = None, frequency_type: str = None, need_extended_hours_data: bool = True):
+        """
+        get_historical_data_special on an asynchronous tda client, see TD_Client_Wrapper.create_async_client.
+        """
+        method_name = self.get_special_endpoint_name(frequency=frequency, frequency_type=frequency_type)
+        method = getattr(client, method_name)
+        key = self.get_request_key(method_name, symbol, start_datetime_utc=start_datetime_utc, end_datetime_utc=end_datetime_utc, frequency=frequency, frequency_type=frequency_type, need_extended_hours_data=need_extended_hours_data)
+        return await self.response_cache.async_fetch(f'td_ameritrade/{method_name}', self.get_cache_params(key), lambda: method(symbol, start_datetime=start_datetime_utc, end_datetime=end_datetime_utc, need_extended_hours_data=need_extended_hours_data), window_end=end_datetime_utc)
 
-        # Remove duplicates by converting the result into a DataFrame, dropping duplicates, and then converting it back into a list
-        df = pd.DataFrame(result)
-        df = df.drop_duplicates()
-        result = df.to_dict('records')
 
-        return result
-    
-    
     def get_historical_data_special(self, symbol: str, start_datetime_utc: datetime = None, end_datetime_utc: datetime = None, frequency: int = None, frequency_type: str = None, need_extended_hours_data: bool = True) -> List:
         """
         Fetches historical data for a given symbol from the TD Ameritrade API using specialized endpoints based on the specified granularity.
+        Concurrent identical requests share one response, see single_flight, and responses are served from the
+        response cache when cached.
 
         Parameters:
             symbol (str): The stock or ETF symbol.
@@ -139,23 +252,75 @@ class TD_Ameritrade_Historical:
             list: A list of historical data points for the specified symbol and parameters.
         """
 
+        method_name = self.get_special_endpoint_name(frequency=frequency, frequency_type=frequency_type)
+        method = getattr(self.td_client, method_name)
+        key = self.get_request_key(method_name, symbol, start_datetime_utc=start_datetime_utc, end_datetime_utc=end_datetime_utc, frequency=frequency, frequency_type=frequency_type, need_extended_hours_data=need_extended_hours_data)
+        return self.single_flight.do(key, self.response_cache.fetch, f'td_ameritrade/{method_name}', self.get_cache_params(key), lambda: method(symbol, start_datetime=start_datetime_utc, end_datetime=end_datetime_utc, need_extended_hours_data=need_extended_hours_data), window_end=end_datetime_utc)
+
+
+    @staticmethod
+    def get_request_key(endpoint: str, symbol: str, start_datetime_utc: Optional[datetime] = None, end_datetime_utc: Optional[datetime] = None, frequency: Optional[Union[str, int]] = None, frequency_type: Optional[str] = None, period: Optional[int] = None, period_type: Optional[str] = None, need_extended_hours_data: Optional[bool] = True) -> Tuple:
+        """
+        Returns the normalized parameters of a price history request, equal for requests that return the same data
+        (symbol case, '1' and 1, datetimes in different timezones), see single_flight.
+        """
+        def normalize(value):
+            if isinstance(value, datetime):
+                return datetime_utc_to_timestamp_utc_ms(value)
+            if isinstance(value, str):
+                value = value.strip().lower()
+                return int(value) if value.isdigit() else value
+            return value
+
+        return (endpoint, symbol.strip().upper()) + tuple(normalize(value) for value in (start_datetime_utc, end_datetime_utc, frequency, frequency_type, period, period_type, bool(need_extended_hours_data)))
+
+
+    @classmethod
+    def get_cache_params(cls, request_key: Tuple) -> Dict[str, Any]:
+        """
+        Returns the parameters a response is stored under in the response cache, from get_request_key.
+        """
+        return dict(zip(cls.REQUEST_KEY_FIELDS, request_key))
+
+
+    @staticmethod
+    def get_special_endpoint_name(frequency: Union[str, int], frequency_type: str) -> str:
+        """
+        Returns the name of the tda client method of the specialized endpoint serving the frequency, the same name on the
+        synchronous and the asynchronous client.
+
+        Raises:
+            UnsupportedFrequencyError: If no specialized endpoint serves the frequency.
+        """
         if frequency_type == 'minute':
             if frequency in [1, 5, 10, 15, 30, 60, 240]:
-                method = self.td_client.get_price_history_every_minute
-            else:
-                raise UnsupportedFrequencyError(f"Frequency and frequency_type combination not supported by special endpoint: frequency_type={frequency_type}, frequency={frequency}")
+                return 'get_price_history_every_minute'
         elif frequency_type == 'daily':
-            method = self.td_client.get_price_history_every_day
+            return 'get_price_history_every_day'
         elif frequency_type in ['weekly', 'monthly'] and frequency == 1:
-            method = self.td_client.get_price_history_every_week
-        else:
-            raise UnsupportedFrequencyError(f"Frequency and frequency_type combination not supported by special endpoint: frequency_type={frequency_type}, frequency={frequency}")
-        return method(symbol, start_datetime=start_datetime_utc, end_datetime=end_datetime_utc, need_extended_hours_data=need_extended_hours_data)
+            return 'get_price_history_every_week'
+        raise UnsupportedFrequencyError(f"Frequency and frequency_type combination not supported by special endpoint: frequency_type={frequency_type}, frequency={frequency}")
+
+
+    @staticmethod
+    def candles_from_special_response(response) -> Optional[List[dict]]:
+        """
+        Extracts the candles of a get_historical_data_special response, None when the response has an unexpected format.
+        """
+        data = response.json()  # extract data from response
+        if isinstance(data, list):
+            return data
+        elif isinstance(data, dict) and 'candles' in data:
+            return data['candles']
+        logger.error(f"Unexpected data format from get_historical_data_special: {type(data)}")
+        return None
 
 
     def get_historical_data(self, symbol: str, start_datetime_utc: Optional[datetime] = None, end_datetime_utc: Optional[datetime] = None, frequency: Optional[Union[str, int]] = None, frequency_type: Optional[str] = None, period: Optional[int] = None, period_type: Optional[str] = None, need_extended_hours_data: Optional[bool] = True) -> Optional[List[dict]]:
         """
         Fetches historical data for a given symbol from the TD Ameritrade API.
+        Concurrent identical requests share one response, see single_flight, and responses are served from the
+        response cache when cached.
 
         Parameters:
             symbol (str): The stock or ETF symbol.
@@ -178,37 +343,48 @@ class TD_Ameritrade_Historical:
             list: A list of historical data points for the specified symbol and parameters.
         """
         try:
-            period_type = self.run_tda_enum('PeriodType', period_type) if period_type is not None else None
-            period = self.run_tda_enum('Period', period) if period is not None else None
-            frequency_type = self.run_tda_enum('FrequencyType', frequency_type) if frequency_type is not None else None
-            frequency = self.run_tda_enum('Frequency', frequency) if frequency is not None else None
-
-            response = self.td_client.get_price_history(
-                symbol=symbol,
-                period_type=period_type,
-                period=period,
-                frequency_type=frequency_type,
-                frequency=frequency,
-                start_datetime=start_datetime_utc,
-                end_datetime=end_datetime_utc,
-                need_extended_hours_data=need_extended_hours_data
-            )
-
-            if response.status_code == 200:
-                historical_data = response.json()
-                if historical_data.get('error'):
-                    logger.error(f"Error fetching historical data for {symbol}: {historical_data['error']}")
-                    return None
-                return historical_data.get('candles', [])
-            else:
-                logger.error(f"Error fetching historical data for {symbol}: {response.status_code}")
-                return None
+            params = self.get_price_history_params(start_datetime_utc=start_datetime_utc, end_datetime_utc=end_datetime_utc, frequency=frequency, frequency_type=frequency_type, period=period, period_type=period_type, need_extended_hours_data=need_extended_hours_data)
+            key = self.get_request_key('get_price_history', symbol, start_datetime_utc=start_datetime_utc, end_datetime_utc=end_datetime_utc, frequency=frequency, frequency_type=frequency_type, period=period, period_type=period_type, need_extended_hours_data=need_extended_hours_data)
+            return self.single_flight.do(key, lambda: self.candles_from_price_history_response(symbol, self.response_cache.fetch(
+                'td_ameritrade/get_price_history', self.get_cache_params(key), lambda: self.td_client.get_price_history(symbol=symbol, **params), window_end=end_datetime_utc
+            )))
         except Exception as e:
             logger.error(f"Error fetching historical data for {symbol}: {e}")
             log_exception(e)
             return None
 
 
+    def get_price_history_params(self, start_datetime_utc: Optional[datetime] = None, end_datetime_utc: Optional[datetime] = None, frequency: Optional[Union[str, int]] = None, frequency_type: Optional[str] = None, period: Optional[int] = None, period_type: Optional[str] = None, need_extended_hours_data: Optional[bool] = True) -> Dict[str, Any]:
+        """
+        Returns the keyword arguments of get_price_history for get_historical_data, the values run through the tda enums.
+        """
+        return {
+            'period_type': self.run_tda_enum('PeriodType', period_type) if period_type is not None else None,
+            'period': self.run_tda_enum('Period', period) if period is not None else None,
+            'frequency_type': self.run_tda_enum('FrequencyType', frequency_type) if frequency_type is not None else None,
+            'frequency': self.run_tda_enum('Frequency', frequency) if frequency is not None else None,
+            'start_datetime': start_datetime_utc,
+            'end_datetime': end_datetime_utc,
+            'need_extended_hours_data': need_extended_hours_data,
+        }
+
+
+    @staticmethod
+    def candles_from_price_history_response(symbol: str, response) -> Optional[List[dict]]:
+        """
+        Extracts the candles of a get_price_history response, None when the request failed.
+        """
+        if response.status_code == 200:
+            historical_data = response.json()
+            if historical_data.get('error'):
+                logger.error(f"Error fetching historical data for {symbol}: {historical_data['error']}")
+                return None
+            return historical_data.get('candles', [])
+        else:
+            logger.error(f"Error fetching historical data for {symbol}: {response.status_code}")
+            return None
+
+
     # Loop thru endpoint to gather data as per date ranges determined by matching get_timedelta_limit_for_{method_name}()
     def get_data_thru_self_get_historical_data_with_loop(self, symbol: str, start_datetime_utc: datetime, end_datetime_utc: datetime, frequency: int, frequency_type: str, need_extended_hours_data: bool) -> List[Dict[str, Union[str, int, float]]]:
         """
@@ -301,18 +477,22 @@ class TD_Ameritrade_Historical:
             raise ValueError(f"Invalid frequency_type: {frequency_type}. Please use one of the following: 'minute', 'daily', 'weekly', or 'monthly'.")
 
     @staticmethod
-    def process_date_ranges_for_td_ameritrade_historical_data(date_ranges: Union[Tuple[datetime, datetime], List[Tuple[datetime, datetime]]], max_timedelta: timedelta) -> List[Tuple[datetime, datetime]]:
+    def process_date_ranges_for_td_ameritrade_historical_data(date_ranges: Union[Tuple[datetime, datetime], List[Tuple[datetime, datetime]]], max_timedelta: timedelta, step: Optional[timedelta] = None) -> List[Tuple[datetime, datetime]]:
         """
         Process date ranges to combine them when possible and split them into smaller chunks when they exceed the
-        maximum timedelta allowed for each API request.
+        maximum timedelta allowed for each API request. With the bar interval as step the returned ranges never overlap,
+        each chunk starts one bar after the previous one ends. Without it consecutive chunks share their boundary bar.
 
         Parameters:
             date_ranges (List[Tuple[datetime, datetime]] or Tuple[datetime, datetime]): 
                 A list of tuples representing the missing date ranges or a single tuple. Each tuple consists of two datetime objects:
-                the start date and the end date. These datetime objects must be timezone-aware and in UTC. The date ranges should ideally 
-                be sorted in ascending order by start date for the function to work correctly.
+                the start date and the end date. These datetime objects must be timezone-aware and in UTC. The date ranges may be
+                in any order.
             max_timedelta (timedelta): 
                 The maximum timedelta allowed for each API request.
+            step (timedelta, optional):
+                The interval between two bars, see td_frequency_to_timedelta. Ranges at most a step apart are combined.
+                Defaults to None.
 
         Returns:
             List[Tuple[datetime, datetime]]: 
@@ -325,8 +505,6 @@ class TD_Ameritrade_Historical:
             2. The function does not handle timezone-naive datetime objects. If timezone-naive datetime objects are passed 
             to this function, it might lead to unexpected results. Ensure the datetime objects are timezone-aware 
             (i.e., they have timezone information associated with them).
-            3. Ensure that the `date_ranges` passed to this function are in ascending order. The function is sorting the ranges 
-            by start date, so if they are not in ascending order, the results may not be what you expect.
         """
         if not date_ranges:
             return []
@@ -334,51 +512,34 @@ class TD_Ameritrade_Historical:
         if isinstance(date_ranges, tuple):
             date_ranges = [date_ranges]
 
-        # Sort date ranges by start_date
-        date_ranges = sorted(date_ranges, key=lambda x: x[0])
-
-        processed_date_ranges = []
-        current_start_datetime_utc, current_end_datetime_utc = date_ranges[0]
+        # Overlapping and touching ranges are merged first, so no part of a range is requested twice, then every merged
+        # range is cut into requests of at most max_timedelta
+        return Interval_Set(date_ranges, step=step).split(max_timedelta)
 
-        for start_datetime_utc, end_datetime_utc in date_ranges[1:]:
-            if end_datetime_utc - current_start_datetime_utc <= max_timedelta and start_datetime_utc <= current_end_datetime_utc:
-                # Combine date ranges if they can fit within max_timedelta
-                current_end_datetime_utc = max(current_end_datetime_utc, end_datetime_utc)
-            else:
-                # Split the current date range into smaller chunks if it exceeds max_timedelta
-                while current_end_datetime_utc - current_start_datetime_utc > max_timedelta:
-                    processed_date_ranges.append((current_start_datetime_utc, current_start_datetime_utc + max_timedelta))
-                    current_start_datetime_utc += max_timedelta
-
-                # Add the current date range to the processed list and start a new date range
-                processed_date_ranges.append((current_start_datetime_utc, current_end_datetime_utc))
-                current_start_datetime_utc, current_end_datetime_utc = start_datetime_utc, end_datetime_utc
-
-        # Split the last date range into smaller chunks if it exceeds max_timedelta
-        while current_end_datetime_utc - current_start_datetime_utc > max_timedelta:
-            processed_date_ranges.append((current_start_datetime_utc, current_start_datetime_utc + max_timedelta))
-            current_start_datetime_utc += max_timedelta
-
-        # Add the last date range
-        processed_date_ranges.append((current_start_datetime_utc, current_end_datetime_utc))
 
-        return processed_date_ranges
+    def get_remaining_data_ranges(self, missing_data_ranges: List[Tuple[datetime, datetime]], used_data_ranges: List[Tuple[datetime, datetime]], frequency: Union[str, int], frequency_type: str) -> List[Tuple[datetime, datetime]]:
+        """
+        Returns the parts of the missing data ranges the used data ranges (served by the special endpoints) do not cover,
+        to be requested from get_historical_data.
+        """
+        # Interval arithmetic on the range endpoints, the bar interval as step so the boundary bars of the used ranges
+        # are not requested again
+        step = self.td_frequency_to_timedelta(frequency_type=frequency_type, frequency=frequency)
+        return (Interval_Set(missing_data_ranges, step=step) - Interval_Set(used_data_ranges, step=step)).to_list()
 
 
-    # For use in get_historical_data_from_td_ameritrade so that pandas can determine which date windows are still needed between each endpoint attempt
-    def td_frequency_to_pandas_frequency(self, frequency_type, frequency):
-        frequency_type_map = {
-            'minute': 'T',
-            'daily': 'D',
-            'weekly': 'W',
-            'monthly': 'M'
-        }
-        
-        pandas_frequency = frequency_type_map.get(frequency_type.lower(), None)
-        if pandas_frequency is None:
-            raise ValueError(f"Unsupported frequency_type: {frequency_type}")
-        
-        return f"{frequency}{pandas_frequency}"
+    # For use in get_remaining_data_ranges, the resolution of the ranges that are still needed between each endpoint attempt
+    def td_frequency_to_timedelta(self, frequency_type, frequency):
+        """
+        Returns the interval between two bars of the frequency. Weekly and monthly bars use one day, the smallest step
+        that can not skip a bar.
+        """
+        frequency_type = frequency_type.lower()
+        if frequency_type == 'minute':
+            return timedelta(minutes=int(frequency))
+        elif frequency_type in ['daily', 'weekly', 'monthly']:
+            return timedelta(days=1)
+        raise ValueError(f"Unsupported frequency_type: {frequency_type}")
 
 
     # Run an input value through the tda library enum logic.
@@ -6,7 +6,8 @@ import os
 import threading
 import time
 from gitignore.config import CLIENT_ID, REDIRECT_URI, TOKEN_PATH
-from helpers.logging_helper import configure_logging
+from helpers.logging_helper import configure_logging, logger
+from helpers.rate_limit_helper import Token_Bucket
 from contextlib import contextmanager
 from httpx import ConnectError
 from concurrent.futures import ThreadPoolExecutor
@@ -16,6 +17,8 @@ from queue import PriorityQueue
 # 1. Authenticate the user and obtain an API client object to interact with the TD Ameritrade API.
 # 2. Manage token updates and maintain the state of the client object.
 # 3. Execute tasks with different priorities using ThreadPoolExecutor and PriorityQueue.
+# 4. Pass every request of every client through one process wide token bucket (rate_limiter), so parallel consumers
+#    (historical, symbols, fundamentals, instrument info, scans) together stay under the TD Ameritrade request cap.
 #
 # Workflow:
 # 1. Call the static `get_instance` method of the TD_Client_Wrapper class to retrieve an instance of the class.
@@ -23,8 +26,13 @@ from queue import PriorityQueue
 # 3. The `_authenticate` method attempts to read the token data from the token file. If no token data is found, the `_perform_authentication` method is called to perform the authentication process and obtain the token data.
 # 4. Whenever the token data is updated, the `_update_token_data` method is called to write the updated token data to the token file.
 # 5. The `get_client` method returns the authenticated client object for interacting with the TD Ameritrade API.
+#    `create_async_client` returns an asyncio client on the same token for concurrent requests from an event loop.
 # 6. The `submit_task` method is used to add tasks with different priorities to the priority queue.
 # 7. The `_execute_tasks` method executes tasks from the priority queue using the ThreadPoolExecutor.
+# 8. Every client gets httpx event hooks (`_install_rate_limiter`): a request first takes its endpoint weight
+#    (ENDPOINT_WEIGHTS) from `rate_limiter`, a 429 response slows the bucket down for its Retry-After time and the
+#    request is sent once more, after the wait.
+#    `get_rate_limit_stats` reports the wait time, tokens and rejections.
 #
 # Criteria:
 # 1. Authenticate the user and create an API client object for interacting with the TD Ameritrade API.
@@ -54,6 +62,7 @@ class TD_Client_Wrapper:
         Attributes:
             _instance (TD_Client_Wrapper): Singleton instance of the TD_Client_Wrapper class.
             _lock (threading.Lock): Lock object used to ensure thread-safety of singleton instance creation.
+            rate_limiter (Token_Bucket): Process wide token bucket every request of every client passes through.
             Instrument (class): Nested class providing access to the `Projection` attribute of the `Client.Instrument` class.
 
         Methods:
@@ -63,6 +72,9 @@ class TD_Client_Wrapper:
             _update_token_data: Update the saved token data with new token data.
             _read_token: Read token data from the saved token file.
             get_client: Return the authenticated TD Ameritrade API client.
+            create_async_client: Create an asynchronous TD Ameritrade API client for an event loop.
+            _install_rate_limiter: Pass every request of a client through the shared rate limiter.
+            get_rate_limit_stats: Return the shared rate limiter statistics.
             submit_task: Submit a task to the task queue with an optional priority.
             _execute_tasks: Execute tasks in the task queue.
             close: Shutdown the thread pool executor.
@@ -76,6 +88,21 @@ class TD_Client_Wrapper:
 
             instrument_projection = TD_Client_Wrapper.Instrument.Projection
         """
+    # TD Ameritrade allows 120 requests per minute per api key. The bucket keeps every window of 60 seconds under it.
+    REQUESTS_PER_MINUTE = 120
+    RATE_LIMIT_BURST = 10
+    # Tokens taken per request by url path fragment, endpoints that are not listed take DEFAULT_ENDPOINT_WEIGHT. TD Ameritrade
+    # counts every request the same today, an endpoint that should count for more is re-weighted here.
+    ENDPOINT_WEIGHTS = {
+        '/pricehistory': 1,
+        '/instruments': 1,
+        '/quotes': 1,
+        '/movers': 1,
+        '/fundamentals': 1,
+    }
+    DEFAULT_ENDPOINT_WEIGHT = 1
+    rate_limiter = Token_Bucket.for_requests_per_minute(REQUESTS_PER_MINUTE, capacity=RATE_LIMIT_BURST)
+
     _instance = None # Singleton class The __init__ method is private, meaning it can only be accessed from within the class. This ensures that no new instances of the class can be created from outside the class.
     _lock = threading.Lock()
 
@@ -153,6 +180,7 @@ class TD_Client_Wrapper:
                 token_read_func=lambda: token_data,
                 token_write_func=self._update_token_data
             )
+        self._install_rate_limiter(self.client)
 
     def _perform_authentication(self):
         """Perform authentication with the TD Ameritrade API and save the resulting token data.
@@ -219,6 +247,98 @@ class TD_Client_Wrapper:
         """
         return self.client
     
+    def create_async_client(self):
+        """Create an asynchronous TD Ameritrade API client sharing the token of the synchronous client.
+
+        The httpx AsyncClient of an asynchronous client is bound to the event loop it is first used in, so every event loop
+        creates its own and closes it with `await client.close_async_session()` when done.
+
+        Returns:
+            tda.client.asynchronous.AsyncClient: An authenticated asynchronous TD Ameritrade API client.
+        """
+        client = tda.auth.client_from_access_functions(
+            api_key=CLIENT_ID,
+            token_read_func=self._read_token,
+            token_write_func=self._update_token_data,
+            asyncio=True
+        )
+        self._install_rate_limiter(client, asynchronous=True)
+        return client
+
+    def _install_rate_limiter(self, client, asynchronous=False):
+        """Pass every request of a tda client through the shared rate limiter.
+
+        Adds httpx event hooks to the client's session: before a request is sent it takes the weight of its endpoint from
+        `rate_limiter` (waiting if needed), after a 429 response the bucket is throttled for the Retry-After time. The
+        session's `send` is wrapped to send a rejected request once more, its request hook then waits out the Retry-After
+        time first.
+
+        Args:
+            client: The tda client, synchronous or asynchronous.
+            asynchronous (bool): Whether the client is asynchronous, its hooks must then be coroutines. Defaults to False.
+        """
+        send = client.session.send
+        if asynchronous:
+            async def on_request(request):
+                await TD_Client_Wrapper.rate_limiter.async_acquire(self.endpoint_weight(request.url.path))
+
+            async def on_response(response):
+                self._on_rate_limited_response(response)
+
+            async def send_with_retry(request, **kwargs):
+                response = await send(request, **kwargs)
+                if response.status_code == 429:
+                    await response.aclose()
+                    response = await send(request, **kwargs)
+                return response
+        else:
+            def on_request(request):
+                TD_Client_Wrapper.rate_limiter.acquire(self.endpoint_weight(request.url.path))
+
+            def on_response(response):
+                self._on_rate_limited_response(response)
+
+            def send_with_retry(request, **kwargs):
+                response = send(request, **kwargs)
+                if response.status_code == 429:
+                    response.close()
+                    response = send(request, **kwargs)
+                return response
+
+        event_hooks = client.session.event_hooks
+        event_hooks['request'].append(on_request)
+        event_hooks['response'].append(on_response)
+        client.session.event_hooks = event_hooks
+        client.session.send = send_with_retry
+
+    @classmethod
+    def endpoint_weight(cls, path):
+        """Return the tokens a request to the url path takes, see ENDPOINT_WEIGHTS."""
+        for fragment, weight in cls.ENDPOINT_WEIGHTS.items():
+            if fragment in path:
+                return weight
+        return cls.DEFAULT_ENDPOINT_WEIGHT
+
+    def _on_rate_limited_response(self, response):
+        """Throttle the rate limiter when TD Ameritrade rejected a request for exceeding the request cap."""
+        if response.status_code != 429:
+            return
+        try:
+            retry_after = float(response.headers.get('Retry-After', 0))
+        except ValueError:
+            retry_after = 0.0
+        TD_Client_Wrapper.rate_limiter.throttle(retry_after)
+        stats = TD_Client_Wrapper.rate_limiter.stats()
+        logger.warning(f"TD Ameritrade rate limit hit on {response.request.url.path}, retry after {retry_after}s, slowing down to {stats['rate_per_second'] * 60:.0f} requests per minute ({stats['throttles']} throttles so far)")
+
+    def get_rate_limit_stats(self):
+        """Return the shared rate limiter statistics: requests and tokens taken, wait time, rejections (429) and the current rate.
+
+        Returns:
+            dict: See Token_Bucket.stats.
+        """
+        return TD_Client_Wrapper.rate_limiter.stats()
+
     def submit_task(self, task, priority=1):
         """Submit a task to the task queue with an optional priority.
 
@@ -0,0 +1,328 @@
+# support/trading_calendar.py
+import json
+import threading
+import numpy as np
+from datetime import date, datetime
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+from models import Entity
+from support.db import DB
+from helpers.gap_helper import (
+    DEFAULT_TIMEZONE, DEFAULT_OPEN_TIME, DEFAULT_CLOSE_TIME, DEFAULT_WORKING_DAYS, DEFAULT_EARLY_CLOSE_TIME, us_equity_early_close_days, us_equity_holiday_days,
+    build_session_days, build_expected_buckets, build_intraday_buckets, bar_length_ms, find_missing_bucket_ranges, find_uncovered_bucket_ranges,
+    local_times_to_utc_ms, time_str_to_seconds,
+)
+from helpers.time_helper import timestamp_utc_ms_to_datetime_utc
+
+# Purpose:
+# 1. Compile each exchange's trading sessions and holidays once into sorted NumPy arrays of UTC millisecond timestamps.
+# 2. Answer calendar questions (is this bar in a session, which sessions are between two times, when is the next
+#    open/close) with binary searches over those arrays instead of re-querying the exchange and re-parsing its JSON.
+#
+# Workflow:
+# 1. Call Trading_Calendar.for_symbol(symbol) or Trading_Calendar.for_entity(entity_id) (or Trading_Calendar.default() for
+#    regular US equity hours).
+# 2. The first call for an exchange loads Exchange_EODHistoricalData.trading_hours/holidays, compiles the sessions from
+#    COMPILE_START_DATE to COMPILE_YEARS_AHEAD years from now and caches the calendar for the rest of the process.
+# 3. Use is_session, sessions_between, next_open, next_close, find_missing_ranges or find_uncovered_ranges, all lookups are O(log n).
+#
+# Every session day has its own open and close converted from local time, so DST changes and half-days (early closes, from
+# the exchange holidays or the recurring US equity rules) are exact per day. is_session flags a whole bar batch at once.
+
+
+class Trading_Calendar:
+    """
+    Compiled session calendar of one exchange.
+
+    Attributes:
+        timezone (str): IANA timezone of the exchange.
+        session_days (np.ndarray): datetime64[D] trading days, sorted.
+        session_opens (np.ndarray): UTC ms open of each session day.
+        session_closes (np.ndarray): UTC ms close of each session day, early on half-days.
+        day_starts (np.ndarray): UTC ms of local midnight at the start of each session day.
+        day_ends (np.ndarray): UTC ms of local midnight at the end of each session day.
+    """
+    COMPILE_START_DATE = date(1970, 1, 1)
+    COMPILE_YEARS_AHEAD = 2
+
+    _calendars: Dict[Tuple, 'Trading_Calendar'] = {}
+    _symbol_calendar_keys: Dict[str, Tuple] = {}
+    _entity_symbols: Dict[int, Optional[str]] = {}
+    _lock = threading.Lock()
+
+    def __init__(self, timezone: str = DEFAULT_TIMEZONE, open_time: str = DEFAULT_OPEN_TIME, close_time: str = DEFAULT_CLOSE_TIME, working_days: Union[str, Iterable[str]] = DEFAULT_WORKING_DAYS, holiday_dates: Optional[Iterable[Union[str, date]]] = None, early_closes: Optional[Dict[Union[str, date], str]] = None, us_equity_early_closes: bool = False, us_equity_holidays: bool = False):
+        """
+        Args:
+            early_closes (dict, optional): Half-days, maps a date ('YYYY-MM-DD' string or date) to its local close time.
+            us_equity_early_closes (bool, optional): Add the recurring US equity half-days, see us_equity_early_close_days.
+            us_equity_holidays (bool, optional): Add the recurring US equity full holidays to holiday_dates, see us_equity_holiday_days.
+        """
+        self.timezone = timezone
+        self.open_time = open_time
+        self.close_time = close_time
+
+        end_date = date(datetime.utcnow().year + self.COMPILE_YEARS_AHEAD, 12, 31)
+        holiday_dates = [str(holiday)[:10] for holiday in (holiday_dates or [])]
+        if us_equity_holidays:
+            holiday_dates += [str(holiday) for holiday in us_equity_holiday_days(self.COMPILE_START_DATE, end_date)]
+        self.session_days = build_session_days(self.COMPILE_START_DATE, end_date, working_days, holiday_dates)
+        self.session_opens = local_times_to_utc_ms(self.session_days, time_str_to_seconds(open_time), timezone)
+        close_seconds = np.full(len(self.session_days), time_str_to_seconds(close_time), dtype=np.int64)
+        if us_equity_early_closes:
+            self._set_early_closes(close_seconds, us_equity_early_close_days(self.COMPILE_START_DATE, end_date), time_str_to_seconds(DEFAULT_EARLY_CLOSE_TIME))
+        for early_close_day, early_close_time in (early_closes or {}).items():
+            self._set_early_closes(close_seconds, np.array([str(early_close_day)[:10]], dtype='datetime64[D]'), time_str_to_seconds(early_close_time))
+        self.session_closes = local_times_to_utc_ms(self.session_days, close_seconds, timezone)
+        self.day_starts = local_times_to_utc_ms(self.session_days, 0, timezone)
+        self.day_ends = local_times_to_utc_ms(self.session_days + np.timedelta64(1, 'D'), 0, timezone)
+
+    def _set_early_closes(self, close_seconds: np.ndarray, early_close_days: np.ndarray, early_close_seconds: int) -> None:
+        # Shortens the close of the early_close_days that are session days, in place. A half-day never extends a session.
+        index = np.searchsorted(self.session_days, early_close_days)
+        found = index < len(self.session_days)
+        found[found] = self.session_days[index[found]] == early_close_days[found]
+        close_seconds[index[found]] = np.minimum(close_seconds[index[found]], early_close_seconds)
+
+    @classmethod
+    def default(cls) -> 'Trading_Calendar':
+        """
+        Returns the calendar for regular US equity hours (09:30-16:00 America/New_York, Mon-Fri, closed on the recurring US
+        equity holidays, 13:00 close on the recurring half-days). Used when we do not know the exchange of a symbol.
+        """
+        return cls._get_or_compile(*cls._default_details())
+
+    @classmethod
+    def for_symbol(cls, symbol: Optional[str]) -> 'Trading_Calendar':
+        """
+        Returns the compiled calendar of the exchange the symbol trades on, compiling it on first use.
+
+        Args:
+            symbol (str): The symbol (Entity.code).
+
+        Returns:
+            Trading_Calendar: The exchange calendar, or the default calendar if the symbol or its exchange details are unknown.
+        """
+        if not symbol:
+            return cls.default()
+
+        calendar_key = cls._symbol_calendar_keys.get(symbol)
+        if calendar_key is not None:
+            return cls._calendars[calendar_key]
+
+        calendar_key, calendar_kwargs = cls._load_exchange_details(symbol)
+        calendar = cls._get_or_compile(calendar_key, calendar_kwargs)
+        cls._symbol_calendar_keys[symbol] = calendar_key
+        return calendar
+
+    @classmethod
+    def for_entity(cls, entity_id: int) -> 'Trading_Calendar':
+        """
+        Returns the compiled calendar of the exchange an entity trades on, see for_symbol.
+
+        Args:
+            entity_id (int): The entity id (Entity.id).
+
+        Returns:
+            Trading_Calendar: The exchange calendar, or the default calendar if the entity or its exchange details are unknown.
+        """
+        if entity_id not in cls._entity_symbols:
+            with DB().session_scope() as session:
+                cls._entity_symbols[entity_id] = session.query(Entity.code).filter(Entity.id == entity_id).scalar()
+        return cls.for_symbol(cls._entity_symbols[entity_id])
+
+    @classmethod
+    def invalidate(cls) -> None:
+        """
+        Forgets every compiled calendar, e.g. after the exchange trading hours or holidays were updated.
+        """
+        with cls._lock:
+            cls._calendars.clear()
+            cls._symbol_calendar_keys.clear()
+            cls._entity_symbols.clear()
+
+    @classmethod
+    def _get_or_compile(cls, calendar_key: Tuple, calendar_kwargs: dict) -> 'Trading_Calendar':
+        if calendar_key in cls._calendars:
+            return cls._calendars[calendar_key]
+        with cls._lock:
+            if calendar_key not in cls._calendars:
+                cls._calendars[calendar_key] = cls(**calendar_kwargs)
+            return cls._calendars[calendar_key]
+
+    @staticmethod
+    def _default_details() -> Tuple[Tuple, dict]:
+        # Cache key and keyword arguments of the default calendar
+        return ('default',), {'us_equity_early_closes': True, 'us_equity_holidays': True}
+
+    @staticmethod
+    def _is_early_close(holiday_data: dict) -> bool:
+        # Half-days are listed with the holidays, with a 'Close' time or a type like 'Early Close' / 'Half Day'
+        holiday_type = str(holiday_data.get('Type') or '').lower()
+        return bool(holiday_data.get('Close')) or 'early' in holiday_type or 'half' in holiday_type
+
+    @classmethod
+    def _load_exchange_details(cls, symbol: str) -> Tuple[Tuple, dict]:
+        """
+        Loads the trading hours and holidays of the symbol's exchange.
+
+        Returns:
+            Tuple[tuple, dict]: The cache key of the exchange and the keyword arguments to compile its calendar.
+        """
+        with DB().session_scope() as session:
+            entity = session.query(Entity).filter(Entity.code == symbol).one_or_none()
+            if entity is None or entity.exchange_data is None:
+                return cls._default_details()
+            exchange = entity.exchange_data
+
+            # trading_hours/holidays have been stored both as JSON strings and as JSON objects
+            trading_hours = json.loads(exchange.trading_hours) if isinstance(exchange.trading_hours, str) else exchange.trading_hours
+            holidays = json.loads(exchange.holidays) if isinstance(exchange.holidays, str) else exchange.holidays
+            if not trading_hours:
+                return cls._default_details()
+
+            # 'bank' holidays (e.g. Columbus Day) are days the exchange is still open, half-days are open with an early close
+            holidays = list((holidays or {}).values())
+            early_closes = {
+                holiday_data['Date']: holiday_data.get('Close') or DEFAULT_EARLY_CLOSE_TIME
+                for holiday_data in holidays if cls._is_early_close(holiday_data)
+            }
+            is_us_exchange = exchange.Country in ('USA', 'US', 'United States')
+            calendar_kwargs = {
+                'timezone': trading_hours.get('Timezone') or exchange.Timezone or DEFAULT_TIMEZONE,
+                'open_time': trading_hours.get('Open', DEFAULT_OPEN_TIME),
+                'close_time': trading_hours.get('Close', DEFAULT_CLOSE_TIME),
+                'working_days': trading_hours.get('WorkingDays', DEFAULT_WORKING_DAYS),
+                'holiday_dates': [holiday_data['Date'] for holiday_data in holidays if holiday_data.get('Type') != 'bank' and not cls._is_early_close(holiday_data)],
+                'early_closes': early_closes,
+                'us_equity_early_closes': is_us_exchange,
+                'us_equity_holidays': is_us_exchange,
+            }
+            return ('exchange', exchange.id), calendar_kwargs
+
+    def is_session(self, timestamps_ms: Union[int, Iterable[int], np.ndarray]) -> np.ndarray:
+        """
+        Flags which timestamps fall inside a regular trading session [open, close).
+
+        Args:
+            timestamps_ms (array-like): UTC millisecond timestamps.
+
+        Returns:
+            np.ndarray: Boolean array, one flag per timestamp.
+        """
+        timestamps_ms = np.atleast_1d(np.asarray(timestamps_ms, dtype=np.int64))
+        session_index = np.searchsorted(self.session_opens, timestamps_ms, side='right') - 1
+        in_session = session_index >= 0
+        in_session[in_session] = timestamps_ms[in_session] < self.session_closes[session_index[in_session]]
+        return in_session
+
+    def sessions_between(self, start_ms: int, end_ms: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the sessions that overlap [start_ms, end_ms].
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: UTC ms opens and closes of the sessions.
+        """
+        first, last = self._session_slice(start_ms, end_ms)
+        return self.session_opens[first:last], self.session_closes[first:last]
+
+    def next_open(self, timestamp_ms: int) -> Optional[int]:
+        """
+        Returns the first session open strictly after timestamp_ms (UTC ms), or None past the compiled range.
+        """
+        index = np.searchsorted(self.session_opens, timestamp_ms, side='right')
+        return int(self.session_opens[index]) if index < len(self.session_opens) else None
+
+    def next_close(self, timestamp_ms: int) -> Optional[int]:
+        """
+        Returns the first session close strictly after timestamp_ms (UTC ms), or None past the compiled range.
+        """
+        index = np.searchsorted(self.session_closes, timestamp_ms, side='right')
+        return int(self.session_closes[index]) if index < len(self.session_closes) else None
+
+    def session_on_or_after(self, day: date) -> Tuple[int, int]:
+        """
+        Returns the UTC ms open and close of the session on the given day, or of the next session if the exchange is closed that day.
+        """
+        index = min(np.searchsorted(self.session_days, np.datetime64(day, 'D'), side='left'), len(self.session_days) - 1)
+        return int(self.session_opens[index]), int(self.session_closes[index])
+
+    def expected_buckets(self, start_ms: int, end_ms: int, frequency: int, frequency_type: str) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the grid of bars the exchange should have produced between start_ms and end_ms,
+        see helpers.gap_helper.build_expected_buckets.
+        """
+        first, last = self._session_slice(start_ms, end_ms)
+        bar_ms = bar_length_ms(frequency, frequency_type)
+        if bar_ms is not None:
+            bucket_starts, bucket_ends = build_intraday_buckets(self.session_opens[first:last], self.session_closes[first:last], bar_ms)
+        elif frequency_type == 'daily':
+            bucket_starts, bucket_ends = self.day_starts[first:last], self.day_ends[first:last]
+        else:
+            bucket_starts, bucket_ends = build_expected_buckets(self.session_days[first:last], self.open_time, self.close_time, self.timezone, frequency, frequency_type)
+
+        in_window = (bucket_ends > start_ms) & (bucket_starts <= end_ms)
+        return bucket_starts[in_window], bucket_ends[in_window]
+
+    def find_missing_ranges(self, timestamps_ms: np.ndarray, start_ms: int, end_ms: int, frequency: int, frequency_type: str) -> List[Tuple[datetime, datetime]]:
+        """
+        Finds the ranges of expected bars between start_ms and end_ms that have no stored timestamp.
+
+        Returns:
+            List[Tuple[datetime, datetime]]: Merged missing ranges as timezone-aware UTC datetimes.
+        """
+        bucket_starts, bucket_ends = self.expected_buckets(start_ms, end_ms, frequency, frequency_type)
+        range_starts, range_ends = find_missing_bucket_ranges(timestamps_ms, bucket_starts, bucket_ends)
+        return [
+            (timestamp_utc_ms_to_datetime_utc(max(int(range_start), start_ms)), timestamp_utc_ms_to_datetime_utc(min(int(range_end), end_ms)))
+            for range_start, range_end in zip(range_starts, range_ends)
+        ]
+
+    def find_uncovered_ranges(self, covered_ranges: List[Tuple[int, int]], start_ms: int, end_ms: int, frequency: int, frequency_type: str) -> List[Tuple[datetime, datetime]]:
+        """
+        Finds the ranges of expected bars between start_ms and end_ms that fall outside every covered range,
+        see models/price_coverage.py.
+
+        Args:
+            covered_ranges (list[tuple[int, int]]): Covered (from, to) ranges in UTC ms.
+
+        Returns:
+            List[Tuple[datetime, datetime]]: Merged uncovered ranges as timezone-aware UTC datetimes.
+        """
+        bucket_starts, bucket_ends = self.expected_buckets(start_ms, end_ms, frequency, frequency_type)
+        covered = np.asarray(covered_ranges, dtype=np.int64).reshape(-1, 2)
+        range_starts, range_ends = find_uncovered_bucket_ranges(covered[:, 0], covered[:, 1], bucket_starts, bucket_ends)
+        return [
+            (timestamp_utc_ms_to_datetime_utc(max(int(range_start), start_ms)), timestamp_utc_ms_to_datetime_utc(min(int(range_end), end_ms)))
+            for range_start, range_end in zip(range_starts, range_ends)
+        ]
+
+    def find_covered_ranges(self, timestamps_ms: np.ndarray, frequency: int, frequency_type: str) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Splits stored bars into the ranges that have no missing expected bar, i.e. the inverse of find_missing_ranges
+        between the first and last timestamp. Used to rebuild the coverage index (models/price_coverage.py).
+
+        Args:
+            timestamps_ms (np.ndarray): Stored bar timestamps (UTC ms), sorted.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: Start and end (UTC ms, inclusive) of each covered range.
+        """
+        timestamps_ms = np.asarray(timestamps_ms, dtype=np.int64)
+        if not len(timestamps_ms):
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+
+        first_timestamp, last_timestamp = int(timestamps_ms[0]), int(timestamps_ms[-1])
+        bucket_starts, bucket_ends = self.expected_buckets(first_timestamp, last_timestamp, frequency, frequency_type)
+        missing_starts, missing_ends = find_missing_bucket_ranges(timestamps_ms, bucket_starts, bucket_ends)
+
+        # Covered ranges are the stretches between the missing runs
+        covered_from = np.maximum(np.concatenate(([first_timestamp], missing_ends)), first_timestamp)
+        covered_to = np.minimum(np.concatenate((missing_starts - 1, [last_timestamp])), last_timestamp)
+        keep = covered_from <= covered_to
+        return covered_from[keep], covered_to[keep]
+
+    def _session_slice(self, start_ms: int, end_ms: int) -> Tuple[int, int]:
+        # Sessions (days) whose local day overlaps the window, weekly/monthly buckets are widened and clipped by the caller
+        first = np.searchsorted(self.day_ends, start_ms, side='right')
+        last = np.searchsorted(self.day_starts, end_ms, side='right')
+        return int(first), int(last)
+
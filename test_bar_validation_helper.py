@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+from helpers.bar_validation_helper import REASON_BITS, find_invalid_bars, describe_reasons, count_reasons, format_reason_counts
+from helpers.price_array_helper import BAR_DTYPE
+
+
+class Test_Bar_Validation_Helper:
+
+    @pytest.fixture
+    def bars_from_rows(self):
+        """
+        Returns a builder of a bar array from (timestamp, open, high, low, close, volume) rows, for bars whose values are
+        chosen one by one to fail a specific check.
+        """
+        def make(rows):
+            bars = np.zeros(len(rows), dtype=BAR_DTYPE)
+            for name, values in zip(('timestamp', 'open', 'high', 'low', 'close', 'volume'), zip(*rows)):
+                bars[name] = values
+            return bars
+        return make
+
+    def test_valid_bars_pass(self, bars_from_rows):
+        bars = bars_from_rows([(60_000, 10, 11, 9, 10.5, 100), (120_000, 10.5, 10.5, 10, 10, 0)])
+        assert list(find_invalid_bars(bars, grid_ms=60_000)) == [0, 0]
+
+    def test_each_check(self, bars_from_rows):
+        bars = bars_from_rows([
+            (60_000, np.nan, 11, 9, 10, 100),    # null open
+            (120_000, 10, 10.5, 9, 11, 100),     # high below close
+            (180_000, 10, 11, 10.5, 10.8, 100),  # low above open
+            (240_000, 10, 11, 9, 10, -1),        # negative volume
+            (240_000, 10, 11, 9, 10, 1),         # duplicate of the previous timestamp
+            (270_000, 10, 11, 9, 10, 1),         # off the 1 minute grid
+            (300_000, 10, 11, 9, np.nan, 1),     # missing close is allowed
+        ])
+        reasons = find_invalid_bars(bars, grid_ms=60_000)
+        assert describe_reasons(reasons) == [
+            'null_value', 'high_below_open_close', 'low_above_open_close', 'negative_volume', 'duplicate_timestamp', 'off_grid_timestamp', '',
+        ]
+
+    def test_bar_can_fail_several_checks_and_batch_is_summarized(self, bars_from_rows):
+        bars = bars_from_rows([(60_000, 10, 9, 11, 10, -5), (90_000, 10, 11, 9, 10, 1)])
+        reasons = find_invalid_bars(bars, grid_ms=60_000)
+        assert reasons[0] == REASON_BITS['high_below_open_close'] | REASON_BITS['low_above_open_close'] | REASON_BITS['negative_volume']
+        assert format_reason_counts(count_reasons(reasons)) == 'high_below_open_close=1, low_above_open_close=1, negative_volume=1, off_grid_timestamp=1'
+
+    def test_duplicates_are_per_entity(self, bars_from_rows):
+        bars = bars_from_rows([(60_000, 10, 11, 9, 10, 1), (60_000, 10, 11, 9, 10, 1), (60_000, 10, 11, 9, 10, 1)])
+        reasons = find_invalid_bars(bars, entity_ids=np.array([1, 2, 1]))
+        assert describe_reasons(reasons) == ['', '', 'duplicate_timestamp']
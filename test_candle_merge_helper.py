@@ -0,0 +1,31 @@
+from helpers.candle_merge_helper import Candle_Merge_Stats, merge_candle_chunks
+
+
+class Test_Candle_Merge_Helper:
+
+    def test_merges_sorted_chunks_without_duplicates(self, make_candles):
+        stats = Candle_Merge_Stats()
+        chunks = [make_candles([1, 2, 3, 4]), make_candles([3, 4, 5]), make_candles([7, 8])]
+        merged = list(merge_candle_chunks(chunks, stats=stats))
+        assert [candle['datetime'] for candle in merged] == [1, 2, 3, 4, 5, 7, 8]
+        assert (stats.chunk_count, stats.candle_count, stats.unique_count, stats.duplicate_count, stats.conflict_count) == (3, 9, 7, 2, 0)
+        assert stats.duplicates_by_chunk == {1: 2}
+        assert (stats.overlapping_chunk_count, stats.overlap_ms) == (1, 1)
+
+    def test_first_chunk_wins_and_conflicts_are_counted(self, make_candles):
+        stats = Candle_Merge_Stats()
+        merged = list(merge_candle_chunks([make_candles([1, 2], close=10.0), make_candles([2, 3], close=12.0)], stats=stats))
+        assert [candle['close'] for candle in merged] == [10.0, 10.0, 12.0]
+        assert (stats.duplicate_count, stats.conflict_count) == (1, 1)
+
+    def test_unsorted_and_empty_chunks(self, make_candles):
+        stats = Candle_Merge_Stats()
+        merged = list(merge_candle_chunks([make_candles([5, 1, 3, 1]), [], make_candles([2])], stats=stats))
+        assert [candle['datetime'] for candle in merged] == [1, 2, 3, 5]
+        assert (stats.chunk_count, stats.duplicate_count, stats.overlapping_chunk_count) == (3, 1, 1)
+
+    def test_record_chunk_overlap_of_nested_spans(self):
+        stats = Candle_Merge_Stats()
+        for first, last in [(0, 100), (10, 20), (90, 150), (200, 300)]:
+            stats.record_chunk(first, last, 1)
+        assert (stats.overlapping_chunk_count, stats.overlap_ms) == (2, 20)
@@ -0,0 +1,54 @@
+import numpy as np
+from datetime import datetime, timezone
+from helpers.gap_helper import build_session_days, build_expected_buckets, us_equity_early_close_days, us_equity_holiday_days, find_missing_bucket_ranges, find_uncovered_bucket_ranges
+
+
+def to_ms(*args):
+    return int(datetime(*args, tzinfo=timezone.utc).timestamp() * 1000)
+
+
+class Test_Gap_Helper:
+
+    def test_build_session_days_skips_weekends_and_holidays(self):
+        days = build_session_days(datetime(2023, 7, 1), datetime(2023, 7, 9), 'Mon,Tue,Wed,Thu,Fri', ['2023-07-04'])
+        assert [str(day) for day in days] == ['2023-07-03', '2023-07-05', '2023-07-06', '2023-07-07']
+
+    def test_intraday_buckets_follow_dst(self):
+        # 2023-03-10 is EST (UTC-5), 2023-03-13 is EDT (UTC-4)
+        days = build_session_days(datetime(2023, 3, 10), datetime(2023, 3, 13))
+        starts, ends = build_expected_buckets(days, '09:30:00', '16:00:00', 'America/New_York', 1, 'minute')
+        assert len(starts) == 2 * 390
+        assert starts[0] == to_ms(2023, 3, 10, 14, 30)
+        assert starts[390] == to_ms(2023, 3, 13, 13, 30)
+        assert ends[-1] == to_ms(2023, 3, 13, 20, 0)
+
+    def test_find_missing_bucket_ranges_merges_runs(self):
+        starts = np.arange(10, dtype=np.int64) * 60_000
+        ends = starts + 60_000
+        stored = starts[[0, 1, 5, 9]]
+        range_starts, range_ends = find_missing_bucket_ranges(stored, starts, ends)
+        assert list(range_starts) == [starts[2], starts[6]]
+        assert list(range_ends) == [ends[4], ends[8]]
+
+    def test_find_uncovered_bucket_ranges(self):
+        starts = np.arange(10, dtype=np.int64) * 60_000
+        ends = starts + 60_000
+        # Buckets 0-2 and 6-9 covered, the second interval is given before the first
+        range_starts, range_ends = find_uncovered_bucket_ranges(np.array([starts[6], 0]), np.array([ends[9], starts[2]]), starts, ends)
+        assert list(range_starts) == [starts[3]]
+        assert list(range_ends) == [ends[5]]
+
+    def test_us_equity_early_close_days(self):
+        # 2019: Jul 3 (Wed), Nov 29, Dec 24 (Tue). 2020: Jul 3 is the observed holiday (Jul 4 is a Saturday), Nov 27, Dec 24 (Thu).
+        # 2021: Jul 4 is a Sunday and Dec 24 the observed Christmas holiday, only Nov 26.
+        days = us_equity_early_close_days(datetime(2019, 1, 1), datetime(2021, 12, 31))
+        assert [str(day) for day in days] == ['2019-07-03', '2019-11-29', '2019-12-24', '2020-11-27', '2020-12-24', '2021-11-26']
+
+    def test_us_equity_holiday_days(self):
+        # 2021: Jan 1 (Fri), Dec 24 observed for Christmas on a Saturday. 2022: Jan 1 is a Saturday and is not observed,
+        # Juneteenth (Sunday) observed Monday Jun 20, Christmas (Sunday) observed Monday Dec 26
+        days = [str(day) for day in us_equity_holiday_days(datetime(2021, 1, 1), datetime(2022, 12, 31))]
+        assert days == [
+            '2021-01-01', '2021-01-18', '2021-02-15', '2021-04-02', '2021-05-31', '2021-07-05', '2021-09-06', '2021-11-25', '2021-12-24',
+            '2022-01-17', '2022-02-21', '2022-04-15', '2022-05-30', '2022-06-20', '2022-07-04', '2022-09-05', '2022-11-24', '2022-12-26',
+        ]
@@ -1,14 +1,22 @@
 import pytest
-from datetime import datetime, timedelta
+from datetime import datetime
 from models.historical_price_data import Historical_Price_Data
-from sqlalchemy import create_engine
+from models.price_coverage import Price_Coverage
+from models.price_quarantine import Price_Quarantine
+from models.price_staging import Price_Staging_Batch
+from sqlalchemy import create_engine, select
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.exc import IntegrityError
 from support.db import DB
-from helpers.time_helper import datetime_utc_to_timestamp_utc_ms
+from support.partition_manager import Partition_Manager
+from support.table_registry import Table_Registry
+from helpers.time_helper import datetime_utc_to_timestamp_utc_ms, timestamp_utc_ms_to_datetime_utc
 from helpers.logging_helper import configure_logging, logger
 from support.base import Base
-from tests.factories import Historical_Price_Data_Factory, Entity_Factory
+from support.trading_calendar import Trading_Calendar
+from historical_price_data_manager import Historical_Price_Data_Mangager
+import helpers.db_query_helper as db_query_helper
+from tests.factories import FIRST_BAR_TIMESTAMP, Historical_Price_Data_Factory, Entity_Factory
 
 from gitignore.config import TEST_DATABASE_URL as url
 
@@ -30,12 +38,13 @@ class Test_Historical_Price_Data:
         session.rollback()
         session.close()
 
-    # Test the create_partition method
-    def test_create_partition(self, db_session):
-        start_datetime_utc = datetime.utcnow()
-        frequency_type = "1_min"
-        partition = Historical_Price_Data.create_partition(start_datetime_utc, frequency_type)
-        assert partition in Historical_Price_Data.partitions.values()
+    # Test the Partition_Manager.ensure_partitions method
+    def test_ensure_partitions(self, db_session):
+        timestamp = datetime_utc_to_timestamp_utc_ms(datetime.utcnow())
+        partition_type = "1_min"
+        Partition_Manager.ensure_partitions(self.db.engine, partition_type, timestamp, timestamp)
+        partition_start = int(Historical_Price_Data.partition_starts_ms(timestamp, partition_type))
+        assert partition_start in Partition_Manager._partitions[Partition_Manager.parent_table_name(partition_type)]
 
     # Test the bulk_write_to_partition method
     def test_bulk_write_to_partition(self, db_session):
@@ -44,24 +53,115 @@ class Test_Historical_Price_Data:
         db_session.add(entity)
         db_session.commit()
 
-        start_datetime_utc = datetime.utcnow()
+        start_datetime_utc = timestamp_utc_ms_to_datetime_utc(FIRST_BAR_TIMESTAMP)
         frequency_type = "1_min"
         instances = [
-            Historical_Price_Data_Factory.build(
-                entity_id=entity.id,
-                timestamp=datetime_utc_to_timestamp_utc_ms(start_datetime_utc + timedelta(minutes=i))
-            ) for i in range(10)
+            Historical_Price_Data_Factory.build(entity_id=entity.id, timestamp=FIRST_BAR_TIMESTAMP + i * 60_000) for i in range(10)
         ]
 
         # Write data to partition
         Historical_Price_Data.bulk_write_to_partition(instances, self.db, start_datetime_utc, frequency_type)
 
-        # Query data from partition
-        partition = Historical_Price_Data.create_partition(start_datetime_utc, frequency_type)
-        data = db_session.query(partition).all()
+        # Query data from the partitioned table
+        table = Table_Registry.get_table(Partition_Manager.parent_table_name(frequency_type), self.db.engine)
+        data = db_session.execute(select([table]).where(table.c.entity_id == entity.id).order_by(table.c.timestamp)).fetchall()
 
         # Assert that data was correctly written to partition
         assert len(data) == 10
 
         for i, record in enumerate(data):
-            assert record.timestamp == datetime_utc_to_timestamp_utc_ms(start_datetime_utc + timedelta(minutes=i))
+            assert record.timestamp == FIRST_BAR_TIMESTAMP + i * 60_000
+            assert record.low <= min(record.open, record.close) <= max(record.open, record.close) <= record.high
+
+    # Test that bulk_write_to_partition quarantines the bars it rejects instead of writing them
+    def test_bulk_write_to_partition_quarantines_rejected_bars(self, db_session):
+        entity = Entity_Factory.create()
+        db_session.add(entity)
+        db_session.commit()
+
+        frequency_type = "1_min"
+        instances = [
+            Historical_Price_Data_Factory.build(entity_id=entity.id, timestamp=FIRST_BAR_TIMESTAMP + i * 60_000) for i in range(3)
+        ]
+        # High below low
+        instances[1].high = instances[1].low - 1
+
+        Historical_Price_Data.bulk_write_to_partition(instances, self.db, timestamp_utc_ms_to_datetime_utc(FIRST_BAR_TIMESTAMP), frequency_type)
+
+        table = Table_Registry.get_table(Partition_Manager.parent_table_name(frequency_type), self.db.engine)
+        written = db_session.execute(select([table.c.timestamp]).where(table.c.entity_id == entity.id).order_by(table.c.timestamp)).scalars().all()
+        assert written == [FIRST_BAR_TIMESTAMP, FIRST_BAR_TIMESTAMP + 120_000]
+
+        quarantined = db_session.query(Price_Quarantine).filter_by(entity_id=entity.id).all()
+        assert [(row.timestamp, row.partition_type) for row in quarantined] == [(FIRST_BAR_TIMESTAMP + 60_000, frequency_type)]
+        assert 'high_below_open_close' in quarantined[0].reason_codes
+
+    # Test that the bars of a response are staged under the entity id of the symbol, looked up in the database
+    def test_stage_td_ameritrade_responses_looks_up_the_entity_id(self, db_session, monkeypatch):
+        entity = Entity_Factory.create()
+        db_session.add(entity)
+        db_session.commit()
+        monkeypatch.setattr(db_query_helper, 'db', self.db)
+        monkeypatch.setattr(Trading_Calendar, 'for_symbol', classmethod(lambda cls, symbol: cls.default()))
+
+        manager = Historical_Price_Data_Mangager.__new__(Historical_Price_Data_Mangager)
+        manager.db = self.db
+        manager.updater_name = 'test'
+        manager.merge_staged_bars_inline = False
+        requested = (timestamp_utc_ms_to_datetime_utc(FIRST_BAR_TIMESTAMP), timestamp_utc_ms_to_datetime_utc(FIRST_BAR_TIMESTAMP + 4 * 60_000))
+        candles = [{'datetime': FIRST_BAR_TIMESTAMP + i * 60_000, 'open': 10.0, 'high': 11.0, 'low': 9.0, 'close': 10.5, 'volume': 100} for i in range(5)]
+
+        written = manager._stage_td_ameritrade_responses(entity.code, iter([(candles, requested)]), 1, 'minute', [requested])
+        assert [tuple(datetime_utc_to_timestamp_utc_ms(bound) for bound in written_range) for written_range in written] == [(FIRST_BAR_TIMESTAMP, FIRST_BAR_TIMESTAMP + 4 * 60_000)]
+        batch = db_session.query(Price_Staging_Batch).filter_by(entity_id=entity.id).one()
+        assert batch.row_count == 5
+
+        # An unknown symbol is rejected before anything is staged
+        with pytest.raises(ValueError):
+            manager._stage_td_ameritrade_responses('NOT A SYMBOL', iter([(candles, requested)]), 1, 'minute', [requested])
+
+    # Test that resampling reads the finer bars and writes the coarser ones under the entity id looked up in the database
+    def test_resample_from_database_looks_up_the_entity_id(self, db_session, monkeypatch):
+        entity = Entity_Factory.create()
+        db_session.add(entity)
+        db_session.commit()
+        monkeypatch.setattr(db_query_helper, 'db', self.db)
+        monkeypatch.setattr(Trading_Calendar, 'for_symbol', classmethod(lambda cls, symbol: cls.default()))
+        instances = [
+            Historical_Price_Data_Factory.build(entity_id=entity.id, timestamp=FIRST_BAR_TIMESTAMP + i * 60_000) for i in range(10)
+        ]
+        Historical_Price_Data.bulk_write_to_partition(instances, self.db, timestamp_utc_ms_to_datetime_utc(FIRST_BAR_TIMESTAMP), "1_min")
+
+        manager = Historical_Price_Data_Mangager.__new__(Historical_Price_Data_Mangager)
+        manager.db = self.db
+        manager.updater_name = 'test'
+        start_datetime_utc = timestamp_utc_ms_to_datetime_utc(FIRST_BAR_TIMESTAMP)
+        end_datetime_utc = timestamp_utc_ms_to_datetime_utc(FIRST_BAR_TIMESTAMP + 9 * 60_000)
+        written = manager.resample_from_database_and_write_to_database(entity.code, start_datetime_utc, end_datetime_utc, frequency=5, frequency_type='minute')
+
+        assert [tuple(datetime_utc_to_timestamp_utc_ms(bound) for bound in written_range) for written_range in written] == [(FIRST_BAR_TIMESTAMP, FIRST_BAR_TIMESTAMP + 5 * 60_000)]
+        table = Table_Registry.get_table(Partition_Manager.parent_table_name("5_min"), self.db.engine)
+        resampled = db_session.execute(select([table.c.timestamp, table.c.volume]).where(table.c.entity_id == entity.id).order_by(table.c.timestamp)).fetchall()
+        assert [row.timestamp for row in resampled] == [FIRST_BAR_TIMESTAMP, FIRST_BAR_TIMESTAMP + 5 * 60_000]
+        assert sum(row.volume for row in resampled) == pytest.approx(sum(instance.volume for instance in instances))
+
+    # Test that the coverage of consecutive responses, one bar apart or apart only by closed time, is kept as one interval
+    def test_add_ranges_merges_adjacent_responses(self, db_session):
+        entity = Entity_Factory.create()
+        db_session.add(entity)
+        db_session.commit()
+        calendar = Trading_Calendar.default()
+        # 2023-05-01 13:30-19:59 UTC is a whole regular session, the next one opens 2023-05-02 13:30 UTC
+        session_close = FIRST_BAR_TIMESTAMP + 389 * 60_000
+        next_session_open = FIRST_BAR_TIMESTAMP + 86_400_000
+
+        Price_Coverage.add_ranges(db_session, entity.id, "1_min", [(FIRST_BAR_TIMESTAMP, FIRST_BAR_TIMESTAMP + 9 * 60_000)], calendar=calendar)
+        Price_Coverage.add_ranges(db_session, entity.id, "1_min", [(FIRST_BAR_TIMESTAMP + 10 * 60_000, session_close)], calendar=calendar)
+        Price_Coverage.add_ranges(db_session, entity.id, "1_min", [(next_session_open, next_session_open + 9 * 60_000)], calendar=calendar)
+        db_session.flush()
+        assert Price_Coverage.get_ranges(db_session, entity.id, "1_min", FIRST_BAR_TIMESTAMP, next_session_open + 9 * 60_000) == [(FIRST_BAR_TIMESTAMP, next_session_open + 9 * 60_000)]
+
+        # A missing bar keeps the intervals apart
+        Price_Coverage.add_ranges(db_session, entity.id, "1_min", [(next_session_open + 11 * 60_000, next_session_open + 20 * 60_000)], calendar=calendar)
+        db_session.flush()
+        assert len(Price_Coverage.get_ranges(db_session, entity.id, "1_min", FIRST_BAR_TIMESTAMP, next_session_open + 20 * 60_000)) == 2
@@ -0,0 +1,266 @@
+import threading
+import numpy as np
+import pytest
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from unittest import mock
+import historical_price_data_manager
+from historical_price_data_manager import Historical_Price_Data_Mangager
+from sqlalchemy import BigInteger, Boolean, Column, DateTime, Float, Integer, MetaData, String, Table
+from sqlalchemy.dialects import postgresql
+from helpers.price_array_helper import RESAMPLE_SOURCE_DTYPE
+import support.td_ameritrade_historical
+from support.td_ameritrade_historical import TD_Ameritrade_Historical
+from models import Historical_Price_Data, Price_Coverage, Price_Quarantine, Price_Rollup_1_Hour, Price_Staging
+from support.table_registry import Table_Registry
+from support.trading_calendar import Trading_Calendar
+
+
+def to_ms(*args):
+    return int(datetime(*args, tzinfo=timezone.utc).timestamp() * 1000)
+
+
+def datetime_to_ms(value):
+    return int(value.timestamp() * 1000)
+
+
+class Fake_DB:
+
+    @contextmanager
+    def session_scope(self):
+        yield mock.MagicMock()
+
+
+class Fake_Response:
+
+    def __init__(self, body):
+        self.body = body
+        self.status_code = 200
+
+    def json(self):
+        return self.body
+
+
+class Fake_Async_Client:
+    """
+    Asynchronous tda client serving 1 minute candles for every requested window, see TD_Client_Wrapper.create_async_client.
+    """
+
+    def __init__(self, make_candles):
+        self.make_candles = make_candles
+        self.requests = []
+        self.closed = False
+
+    async def get_price_history_every_minute(self, symbol, start_datetime, end_datetime, need_extended_hours_data):
+        self.requests.append((symbol, start_datetime, end_datetime))
+        # Windows are inclusive of their end
+        return Fake_Response({'symbol': symbol, 'candles': self.make_candles(range(datetime_to_ms(start_datetime), datetime_to_ms(end_datetime) + 1, 60 * 1000))})
+
+    async def close_async_session(self):
+        self.closed = True
+
+
+class Uncached_Responses:
+
+    async def async_fetch(self, namespace, params, request, window_end=None):
+        return await request()
+
+
+@pytest.fixture
+def manager(monkeypatch):
+    # A manager without a database connection, the symbol lookups, coverage index and calendar are served without queries
+    manager = Historical_Price_Data_Mangager.__new__(Historical_Price_Data_Mangager)
+    manager.db = Fake_DB()
+    manager.api_call_semaphore = threading.BoundedSemaphore(1)
+    monkeypatch.setattr(historical_price_data_manager, 'get_entity_id_from_symbol', lambda symbol: 1)
+    monkeypatch.setattr(historical_price_data_manager, 'get_entity_ids_from_symbols', lambda symbols: {symbol: 1 for symbol in symbols})
+    monkeypatch.setattr(Price_Coverage, 'is_built', classmethod(lambda cls, session, partition_type: False))
+    monkeypatch.setattr(Trading_Calendar, 'for_symbol', classmethod(lambda cls, symbol: cls.default()))
+    return manager
+
+
+class Test_Historical_Price_Data_Mangager:
+
+    def test_determine_partition_type_accepts_standardized_and_older_names(self):
+        assert Historical_Price_Data.determine_partition_type(1, 'minute') == '1_min'
+        assert Historical_Price_Data.determine_partition_type('5', 'min') == '5_min'
+        assert Historical_Price_Data.determine_partition_type(4, 'hour') == '4_hour'
+        assert Historical_Price_Data.determine_partition_type(1, 'daily') == Historical_Price_Data.determine_partition_type(1, 'day') == '1_day'
+        with pytest.raises(ValueError):
+            Historical_Price_Data.determine_partition_type(2, 'daily')
+
+    def test_get_data_reaches_the_fill_planner(self, manager, monkeypatch):
+        read_partition_types, source_calls = [], []
+        monkeypatch.setattr(manager, 'get_read_table', lambda partition_type: read_partition_types.append(partition_type))
+
+        def source(**kwargs):
+            source_calls.append(kwargs)
+            return []
+
+        monkeypatch.setattr(manager, 'resample_from_database_and_write_to_database', source)
+        monkeypatch.setattr(manager, 'get_historical_data_from_td_ameritrade_and_write_to_database', source)
+
+        data, missing_data_ranges = manager.get_data(symbol='AAPL', start_date_str='2023-05-01', end_date_str='2023-05-05', frequency=1, frequency_type='day')
+
+        assert data == []
+        assert read_partition_types == ['1_day']
+        # Nothing is stored and no source wrote anything, the whole window is still missing after both sources were tried
+        assert [call['frequency_type'] for call in source_calls] == ['daily', 'daily']
+        assert missing_data_ranges == source_calls[-1]['missing_data_ranges'] and len(missing_data_ranges) == 1
+
+    def test_get_data_returns_dicts_with_the_symbol(self, manager, monkeypatch, make_bars):
+        monkeypatch.setattr(manager, 'gather_data', lambda **kwargs: (make_bars([1_682_913_600_000]), []))
+        data, _ = manager.get_data(symbol='AAPL', start_date_str='2023-05-01', end_date_str='2023-05-01', frequency=1, frequency_type='daily')
+        assert data == [{'timestamp': 1_682_913_600_000, 'symbol': 'AAPL', 'open': 10.0, 'high': 11.0, 'low': 9.0, 'close': 10.5, 'volume': 1.0}]
+        assert list(data[0]) == ['timestamp', 'symbol', 'open', 'high', 'low', 'close', 'volume']
+
+    def test_merge_bar_arrays_orders_and_keeps_one_bar_per_timestamp(self, make_bars):
+        stored = make_bars([60_000, 180_000], opens=[1, 3])
+        written = make_bars([120_000, 180_000, 240_000], opens=[2, 30, 4])
+        merged = Historical_Price_Data_Mangager.merge_bar_arrays([stored, written, make_bars([])])
+        assert list(merged['timestamp']) == [60_000, 120_000, 180_000, 240_000]
+        # The first array given wins for a repeated timestamp
+        assert list(merged['open']) == [1, 2, 3, 4]
+        assert len(Historical_Price_Data_Mangager.merge_bar_arrays([make_bars([])])) == 0
+
+    def test_update_written_bounds_widens_per_requested_range(self):
+        requested = np.array([(0, 100), (200, 300), (400, 500)], dtype=np.int64)
+        first, last = Historical_Price_Data_Mangager.empty_written_bounds(len(requested))
+        Historical_Price_Data_Mangager.update_written_bounds(np.array([250, 50, 20]), requested, first, last)
+        Historical_Price_Data_Mangager.update_written_bounds(np.array([10, 290, 350]), requested, first, last)
+        written = first <= last
+        assert list(written) == [True, True, False]
+        assert list(first[written]) == [10, 250]
+        assert list(last[written]) == [50, 290]
+
+    def test_get_written_data_ranges_narrows_and_drops_requested_ranges(self):
+        requested = [
+            (datetime(2023, 5, 1, 13, 30, tzinfo=timezone.utc), datetime(2023, 5, 1, 20, tzinfo=timezone.utc)),
+            (datetime(2023, 5, 2, 13, 30, tzinfo=timezone.utc), datetime(2023, 5, 2, 20, tzinfo=timezone.utc)),
+        ]
+        written = np.array([to_ms(2023, 5, 1, 15), to_ms(2023, 5, 1, 14), to_ms(2023, 5, 3, 14)], dtype=np.int64)
+        assert Historical_Price_Data_Mangager.get_written_data_ranges(written, requested) == [
+            (datetime(2023, 5, 1, 14, tzinfo=timezone.utc), datetime(2023, 5, 1, 15, tzinfo=timezone.utc)),
+        ]
+
+    def test_get_covered_data_ranges_splits_at_holes(self):
+        calendar = Trading_Calendar.default()
+        bucket_starts, _ = calendar.expected_buckets(to_ms(2023, 5, 1), to_ms(2023, 5, 2, 23), 1, 'minute')
+        # A truncated response: the first session, then nothing after 2023-05-02 15:00 UTC
+        written = bucket_starts[bucket_starts < to_ms(2023, 5, 2, 15)]
+        # Bars missing in the middle of the first session
+        written = written[(written < to_ms(2023, 5, 1, 16)) | (written >= to_ms(2023, 5, 1, 16, 30))]
+        requested = np.array([(to_ms(2023, 5, 1), to_ms(2023, 5, 2, 23)), (to_ms(2023, 5, 3), to_ms(2023, 5, 3, 23))], dtype=np.int64)
+        covered = Historical_Price_Data_Mangager.get_covered_data_ranges(calendar, written, requested, 1, 'minute')
+        assert covered == [
+            (to_ms(2023, 5, 1, 13, 30), to_ms(2023, 5, 1, 16) - 1),
+            (to_ms(2023, 5, 1, 16, 30), to_ms(2023, 5, 2, 14, 59)),
+        ]
+
+    def test_select_rollup_buckets_only_touched_buckets_in_runs(self):
+        calendar = Trading_Calendar.default()
+        pending_ranges = [(to_ms(2023, 5, 1, 14, 5), to_ms(2023, 5, 1, 14, 10)), (to_ms(2023, 5, 1, 16, 45), to_ms(2023, 5, 1, 17, 40))]
+        runs = Historical_Price_Data_Mangager.select_rollup_buckets(calendar, pending_ranges, 1, 'hour')
+        assert [run_starts.tolist() for run_starts, _ in runs] == [[to_ms(2023, 5, 1, 13, 30)], [to_ms(2023, 5, 1, 16, 30), to_ms(2023, 5, 1, 17, 30)]]
+        assert runs[1][1].tolist() == [to_ms(2023, 5, 1, 17, 30), to_ms(2023, 5, 1, 18, 30)]
+
+        # Ranges on two days that are not next to each other, the daily buckets are midnight to midnight New York time
+        pending_ranges = [(to_ms(2023, 5, 1, 14), to_ms(2023, 5, 1, 15)), (to_ms(2023, 5, 3, 14), to_ms(2023, 5, 3, 15))]
+        runs = Historical_Price_Data_Mangager.select_rollup_buckets(calendar, pending_ranges, 1, 'daily')
+        assert [run_starts.tolist() for run_starts, _ in runs] == [[to_ms(2023, 5, 1, 4)], [to_ms(2023, 5, 3, 4)]]
+        assert Historical_Price_Data_Mangager.select_rollup_buckets(calendar, [], 1, 'daily') == []
+
+    def test_rollup_source_bars_counts_partial_buckets(self, make_bars):
+        calendar = Trading_Calendar.default()
+        minute = 60 * 1000
+        # A full first hour, half of the second one and an extended hours bar that is not rolled up
+        timestamps = [to_ms(2023, 5, 1, 13)] + list(range(to_ms(2023, 5, 1, 13, 30), to_ms(2023, 5, 1, 15), minute))
+        source_bars = make_bars(timestamps, dtype=RESAMPLE_SOURCE_DTYPE)
+        bucket_starts = np.array([to_ms(2023, 5, 1, 13, 30), to_ms(2023, 5, 1, 14, 30)], dtype=np.int64)
+        bucket_ends = bucket_starts + 60 * minute
+
+        bars, bar_counts, expected_bar_counts = Historical_Price_Data_Mangager.rollup_source_bars(calendar, source_bars, bucket_starts, bucket_ends)
+
+        assert bars['timestamp'].tolist() == bucket_starts.tolist()
+        assert bars['volume'].tolist() == [60.0, 30.0]
+        assert bar_counts.tolist() == [60, 30]
+        assert expected_bar_counts.tolist() == [60, 60]
+
+    def test_get_read_table_serves_only_complete_rollup_buckets(self, manager, monkeypatch):
+        partition_table = Table(
+            'historical_price_data_1_hour', MetaData(),
+            Column('entity_id', Integer), Column('timestamp', BigInteger), Column('open', Float), Column('high', Float), Column('low', Float),
+            Column('close', Float), Column('adjusted_close', Float), Column('volume', Float), Column('is_regular_trading_hours', Boolean),
+            Column('source', String), Column('last_updated', DateTime),
+        )
+        tables = {partition_table.name: partition_table, Price_Rollup_1_Hour.__tablename__: Price_Rollup_1_Hour.__table__}
+        monkeypatch.setattr(Table_Registry, 'get_table', classmethod(lambda cls, table_name, engine: tables.get(table_name)))
+        manager.db.engine = None
+
+        sql = str(manager.get_read_table('1_hour').element.compile(dialect=postgresql.dialect()))
+
+        rollup_sql = sql.split('UNION ALL')[1]
+        assert 'price_rollup_1_hour.bar_count >= price_rollup_1_hour.expected_bar_count' in rollup_sql
+        partition_sql = sql.split('UNION ALL')[0]
+        assert 'NOT (EXISTS (SELECT' in partition_sql
+        assert 'price_rollup_1_hour.entity_id = historical_price_data_1_hour.entity_id' in partition_sql
+        assert 'price_rollup_1_hour.timestamp = historical_price_data_1_hour.timestamp' in partition_sql
+        assert 'price_rollup_1_hour.bar_count >= price_rollup_1_hour.expected_bar_count' in partition_sql
+        # Partition types without a rollup read the partition table itself
+        tables['historical_price_data_1_min'] = partition_table
+        assert manager.get_read_table('1_min') is partition_table
+
+    def test_fetch_computes_bounds_and_coverage_from_validated_bars(self, manager, monkeypatch, make_candles):
+        candles = make_candles(range(to_ms(2023, 5, 1, 13, 30), to_ms(2023, 5, 1, 13, 40), 60 * 1000))
+        # Rejected, high below low, in the middle and at the end of the response
+        candles[5]['high'] = candles[9]['high'] = 8.0
+        manager.td_hist_data = mock.Mock()
+        manager.td_hist_data.iter_historical_data_from_td_ameritrade.return_value = iter([(candles, None)])
+        manager.updater_name = 'test'
+        manager.merge_staged_bars_inline = False
+        staged, quarantined = [], []
+        monkeypatch.setattr(Price_Staging, 'stage_bars', classmethod(lambda cls, db, bars, *args: staged.append((bars, args[-1])) or len(bars)))
+        monkeypatch.setattr(Price_Quarantine, 'quarantine_rows', classmethod(lambda cls, db, columns, rows, reasons, partition_type: quarantined.extend(rows)))
+
+        requested = (datetime(2023, 5, 1, 13, 30, tzinfo=timezone.utc), datetime(2023, 5, 1, 13, 40, tzinfo=timezone.utc))
+        written_data_ranges = manager._fetch_from_td_ameritrade_and_write_to_database('AAPL', *requested, frequency=1, frequency_type='minute', missing_data_ranges=[requested])
+
+        assert [row[1] for row in quarantined] == [to_ms(2023, 5, 1, 13, 35), to_ms(2023, 5, 1, 13, 39)]
+        bars, covered_ranges = staged[0]
+        assert len(bars) == 8
+        assert covered_ranges == [(to_ms(2023, 5, 1, 13, 30), to_ms(2023, 5, 1, 13, 35) - 1), (to_ms(2023, 5, 1, 13, 36), to_ms(2023, 5, 1, 13, 38))]
+        assert written_data_ranges == [(requested[0], datetime(2023, 5, 1, 13, 38, tzinfo=timezone.utc))]
+
+    def test_gather_data_for_symbols_fetches_concurrently(self, manager, monkeypatch, make_bars, make_candles):
+        client = Fake_Async_Client(make_candles)
+        monkeypatch.setattr(support.td_ameritrade_historical, 'TD_Client_Wrapper', mock.Mock(**{'get_instance.return_value.create_async_client.return_value': client}))
+        manager.td_hist_data = TD_Ameritrade_Historical.__new__(TD_Ameritrade_Historical)
+        manager.td_hist_data.response_cache = Uncached_Responses()
+        manager.updater_name = 'test'
+        manager.merge_staged_bars_inline = False
+        symbols = ['AAPL', 'MSFT']
+        monkeypatch.setattr(historical_price_data_manager, 'get_entity_id_from_symbol', lambda symbol: symbols.index(symbol) + 1)
+
+        # Nothing is stored and nothing can be resampled, what is staged is what a later read returns
+        staged = {}
+        monkeypatch.setattr(Price_Staging, 'stage_bars', classmethod(lambda cls, db, bars, entity_id, *args: staged.setdefault(entity_id, []).append(bars) or len(bars)))
+        monkeypatch.setattr(manager, 'get_historical_price_data_from_database_for_symbols', lambda symbols, **kwargs: {symbol: make_bars([]) for symbol in symbols})
+        monkeypatch.setattr(manager, 'find_uncovered_data_ranges_for_symbols', lambda *args, **kwargs: None)
+        monkeypatch.setattr(manager, 'resample_from_database_and_write_to_database', lambda **kwargs: [])
+        monkeypatch.setattr(manager, 'get_historical_data_from_td_ameritrade_and_write_to_database', mock.Mock(side_effect=AssertionError('fetched one symbol at a time')))
+
+        def read(start_datetime_utc, end_datetime_utc, symbol, **kwargs):
+            timestamps = np.concatenate([bars['timestamp'] for bars in staged.get(symbols.index(symbol) + 1, [])] or [np.empty(0, dtype=np.int64)])
+            in_range = (timestamps >= datetime_to_ms(start_datetime_utc)) & (timestamps <= datetime_to_ms(end_datetime_utc))
+            return make_bars(timestamps[in_range])
+
+        monkeypatch.setattr(manager, 'get_historical_price_data_from_database', read)
+
+        start, end = datetime(2023, 5, 1, 13, 30, tzinfo=timezone.utc), datetime(2023, 5, 1, 13, 40, tzinfo=timezone.utc)
+        data, missing_data_ranges = manager.gather_data_for_symbols(symbols, start, end, 1, 'minute', need_extended_hours_data=False, fetch_concurrently=True)
+
+        assert sorted(symbol for symbol, _, _ in client.requests) == symbols
+        assert client.closed
+        assert missing_data_ranges == {'AAPL': [], 'MSFT': []}
+        for symbol in symbols:
+            assert data[symbol]['timestamp'].tolist() == list(range(to_ms(2023, 5, 1, 13, 30), to_ms(2023, 5, 1, 13, 41), 60 * 1000))
@@ -0,0 +1,37 @@
+from datetime import datetime, timedelta
+from helpers.interval_helper import Interval_Set
+
+
+class Test_Interval_Set:
+
+    def test_normalizes_and_unions(self):
+        intervals = Interval_Set([(50, 60), (0, 10), (10, 20), (5, 8), (30, 40), (9, 1)])
+        assert intervals.to_list() == [(0, 20), (30, 40), (50, 60)]
+        assert (intervals | [(21, 29)]).to_list() == [(0, 20), (21, 29), (30, 40), (50, 60)]
+        assert (Interval_Set(intervals, step=1) | [(21, 29)]).to_list() == [(0, 40), (50, 60)]
+
+    def test_intersection(self):
+        intervals = Interval_Set([(0, 10), (20, 30), (40, 50)])
+        assert (intervals & [(5, 25), (28, 45)]).to_list() == [(5, 10), (20, 25), (28, 30), (40, 45)]
+        assert intervals.clip(8, 42).to_list() == [(8, 10), (20, 30), (40, 42)]
+        assert not intervals & [(11, 19)]
+
+    def test_difference_with_and_without_step(self):
+        assert (Interval_Set([(0, 10)], step=1) - [(4, 6)]).to_list() == [(0, 3), (7, 10)]
+        assert (Interval_Set([(0, 10)]) - [(4, 6)]).to_list() == [(0, 4), (6, 10)]
+        assert (Interval_Set([(0, 10)]) - [(4, 10)]).to_list() == [(0, 4)]
+        assert (Interval_Set([(0, 10), (20, 30)], step=1) - [(-5, 2), (8, 22), (25, 25)]).to_list() == [(3, 7), (23, 24), (26, 30)]
+        assert not Interval_Set([(0, 10)], step=1) - [(0, 10)]
+        assert (Interval_Set([(0, 10)], step=1) - []).to_list() == [(0, 10)]
+
+    def test_datetimes_and_split(self):
+        day = datetime(2023, 1, 2)
+        missing = Interval_Set([(day, day + timedelta(days=30))], step=timedelta(minutes=1))
+        remaining = missing - [(day + timedelta(days=10), day + timedelta(days=20))]
+        assert remaining.to_list() == [
+            (day, day + timedelta(days=10, minutes=-1)),
+            (day + timedelta(days=20, minutes=1), day + timedelta(days=30)),
+        ]
+        assert Interval_Set([(0, 25)]).split(10) == [(0, 10), (10, 20), (20, 25)]
+        assert Interval_Set([(0, 25)], step=1).split(10) == [(0, 10), (11, 21), (22, 25)]
+        assert Interval_Set([(0, 21)], step=1).split(10) == [(0, 10), (11, 21)]
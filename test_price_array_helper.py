@@ -0,0 +1,48 @@
+import numpy as np
+import pandas as pd
+from helpers.price_array_helper import BAR_DTYPE, CANDLE_DTYPE, ENTITY_BAR_DTYPE, rows_to_bar_array, bar_array_to_output, candles_to_bar_array
+
+
+class Test_Price_Array_Helper:
+
+    def test_rows_to_bar_array_fills_and_grows(self):
+        # Chunks larger than the initial capacity force the array to grow, an empty chunk is skipped
+        chunks = [[(index, 1.0, 2.0, 0.5, 1.5, 100.0) for index in range(3)], [], [(index, 1.0, 2.0, 0.5, 1.5, 100.0) for index in range(3, 8)]]
+        bars = rows_to_bar_array(chunks, initial_capacity=2)
+        assert bars.dtype == BAR_DTYPE
+        assert list(bars['timestamp']) == list(range(8))
+        assert list(bars['close']) == [1.5] * 8
+
+    def test_rows_to_bar_array_trims_to_row_count(self):
+        bars = rows_to_bar_array([[(7, 60_000, 1.0, 2.0, 0.5, 1.5, 10.0)]], dtype=ENTITY_BAR_DTYPE)
+        assert len(bars) == 1
+        assert bars['entity_id'][0] == 7 and bars['timestamp'][0] == 60_000
+        assert len(rows_to_bar_array([])) == 0
+
+    def test_bar_array_to_pandas(self):
+        bars = rows_to_bar_array([[(60_000, 1.0, 2.0, 0.5, 1.5, 10.0), (120_000, 1.5, 2.5, 1.0, 2.0, 20.0)]])
+        frame = bar_array_to_output(bars, 'pandas')
+        assert isinstance(frame, pd.DataFrame)
+        assert list(frame.columns) == list(BAR_DTYPE.names)
+        assert frame['volume'].tolist() == [10.0, 20.0]
+        assert bar_array_to_output(bars, 'numpy') is bars
+
+    def test_candles_to_bar_array(self):
+        candles = [
+            {'datetime': 60_000, 'open': 1.0, 'high': 2.0, 'low': 0.5, 'close': 1.5, 'volume': 10},
+            {'datetime': 120_000, 'open': 1.5, 'high': 2.5, 'low': 1.0, 'close': 2.0, 'adjusted_close': 1.9, 'volume': 20},
+        ]
+        bars = candles_to_bar_array(candles)
+        assert bars.dtype == CANDLE_DTYPE
+        assert bars['timestamp'].tolist() == [60_000, 120_000]
+        assert bars['close'].tolist() == [1.5, 2.0]
+        assert bars['volume'].tolist() == [10.0, 20.0]
+        # Missing values become NaN, is_regular_trading_hours is left for the caller
+        assert np.isnan(bars['adjusted_close'][0]) and bars['adjusted_close'][1] == 1.9
+        assert bars['is_regular_trading_hours'].all()
+
+    def test_candles_to_bar_array_scales_and_empty(self):
+        bars = candles_to_bar_array([{'date': 60, 'open': 1.0, 'high': 2.0, 'low': 0.5, 'close': 1.5, 'volume': 10}], timestamp_key='date', timestamp_scale=1000)
+        assert bars['timestamp'].tolist() == [60_000]
+        empty = candles_to_bar_array([])
+        assert len(empty) == 0 and empty.dtype == CANDLE_DTYPE
@@ -0,0 +1,66 @@
+import asyncio
+import pytest
+from helpers.rate_limit_helper import Token_Bucket
+
+
+class Fake_Clock:
+    """A clock that only moves when slept on, so waits are measured without waiting."""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class Test_Token_Bucket:
+
+    @pytest.fixture
+    def fake_clock(self):
+        return Fake_Clock()
+
+    @pytest.fixture
+    def make_bucket(self, fake_clock):
+        def make(**kwargs):
+            return Token_Bucket(clock=fake_clock, sleep=fake_clock.sleep, **kwargs)
+        return make
+
+    def test_burst_then_refill_rate(self, make_bucket):
+        bucket = make_bucket(rate=2, capacity=3)
+        assert [bucket.acquire() for _ in range(3)] == [0, 0, 0]
+        assert bucket.acquire() == pytest.approx(0.5)
+        assert bucket.acquire(weight=2) == pytest.approx(1.0)
+        stats = bucket.stats()
+        assert (stats['requests'], stats['tokens_taken'], stats['waited_requests']) == (5, 6, 2)
+        assert stats['wait_seconds'] == pytest.approx(1.5)
+        with pytest.raises(ValueError):
+            bucket.acquire(weight=4)
+
+    def test_requests_per_minute_cap_holds(self, fake_clock):
+        bucket = Token_Bucket.for_requests_per_minute(120, capacity=10, clock=fake_clock, sleep=fake_clock.sleep)
+        taken_at = []
+        while fake_clock.now < 180:
+            bucket.acquire()
+            taken_at.append(fake_clock.now)
+        assert max(sum(1 for taken in taken_at if start <= taken < start + 60) for start in taken_at) <= 120
+
+    def test_throttle_blocks_slows_down_and_recovers(self, make_bucket, fake_clock):
+        bucket = make_bucket(rate=4, capacity=4, recovery_seconds=10, recovery_factor=2)
+        bucket.throttle(retry_after=5)
+        assert bucket.stats()['rate_per_second'] == 2
+        assert bucket.acquire() == pytest.approx(5.5)
+        fake_clock.now += 10
+        assert bucket.stats()['rate_per_second'] == 4
+        assert bucket.stats()['throttles'] == 1
+
+    def test_async_acquire_shares_tokens(self):
+        bucket = Token_Bucket(rate=1000, capacity=2)
+
+        async def take_all():
+            return await asyncio.gather(*(bucket.async_acquire() for _ in range(4)))
+
+        asyncio.run(take_all())
+        assert bucket.stats()['requests'] == 4
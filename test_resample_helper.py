@@ -0,0 +1,34 @@
+import numpy as np
+from helpers.resample_helper import assign_buckets, count_per_bucket, resample_bars
+
+
+class Test_Resample_Helper:
+
+    def test_assign_buckets_marks_bars_outside_buckets(self):
+        bucket_starts = np.array([0, 300_000], dtype=np.int64)
+        bucket_ends = np.array([300_000, 390_000], dtype=np.int64)
+        assert list(assign_buckets(np.array([-60_000, 0, 299_999, 300_000, 390_000]), bucket_starts, bucket_ends)) == [-1, 0, 0, 1, -1]
+
+    def test_resample_bars_ohlcv(self, make_bars):
+        # Five 1 minute bars into one 5 minute bucket and two into the next, a bar in between buckets is dropped
+        timestamps = np.array([0, 60_000, 120_000, 180_000, 240_000, 300_000, 360_000, 420_000], dtype=np.int64)
+        bars = make_bars(timestamps, [10, 12, 8, 11, 9, 20, 21, 30], volumes=[1, 2, 3, 4, 5, 6, 7, 8])
+        bucket_starts = np.array([0, 300_000], dtype=np.int64)
+        bucket_ends = np.array([300_000, 420_000], dtype=np.int64)
+
+        resampled, bucket_index = resample_bars(bars, bucket_starts, bucket_ends)
+
+        assert list(bucket_index) == [0, 1]
+        assert list(resampled['timestamp']) == [0, 300_000]
+        assert list(resampled['open']) == [10, 20]
+        assert list(resampled['high']) == [13, 22]
+        assert list(resampled['low']) == [7, 19]
+        assert list(resampled['close']) == [9.5, 21.5]
+        assert list(resampled['volume']) == [15, 13]
+
+    def test_count_per_bucket_detects_incomplete_buckets(self):
+        bucket_starts = np.array([0, 300_000], dtype=np.int64)
+        bucket_ends = np.array([300_000, 600_000], dtype=np.int64)
+        expected = count_per_bucket(np.arange(10, dtype=np.int64) * 60_000, bucket_starts, bucket_ends)
+        stored = count_per_bucket(np.delete(np.arange(10, dtype=np.int64) * 60_000, 7), bucket_starts, bucket_ends)
+        assert list(stored >= expected) == [True, False]
@@ -0,0 +1,124 @@
+import asyncio
+import json
+import os
+from datetime import datetime
+import pytest
+import pytz
+from helpers.response_cache_helper import Response_Cache, Response_Cache_Miss, Cached_Response
+
+# 2023-06-15 16:00 US/Eastern
+NOW = datetime(2023, 6, 15, 20, 0, tzinfo=pytz.UTC).timestamp()
+
+
+class Fake_Response:
+
+    def __init__(self, payload, status_code=200):
+        self.status_code = status_code
+        self.content = json.dumps(payload).encode('utf-8')
+
+    def json(self):
+        return json.loads(self.content)
+
+
+class Counting_Request:
+
+    def __init__(self, payload, status_code=200):
+        self.calls = 0
+        self.payload, self.status_code = payload, status_code
+
+    def __call__(self):
+        self.calls += 1
+        return Fake_Response(self.payload, self.status_code)
+
+
+class Test_Response_Cache:
+
+    @pytest.fixture
+    def make_cache(self, tmp_path):
+        """
+        Returns a builder of a cache in tmp_path whose clock reads clock[0], so a test moves time by changing it.
+        """
+        def make(clock, **kwargs):
+            return Response_Cache(root=str(tmp_path), clock=lambda: clock[0], ttl_seconds=300, **kwargs)
+        return make
+
+    def test_closed_window_is_cached_forever(self, make_cache):
+        clock = [NOW]
+        cache = make_cache(clock)
+        request = Counting_Request({'candles': [{'datetime': 1}]})
+        params = {'symbol': 'AAPL', 'start': 1, 'end': 2}
+        window_end = datetime(2023, 6, 14, 23, 59, tzinfo=pytz.UTC)
+        assert cache.fetch('td/get_price_history', params, request, window_end=window_end).json() == {'candles': [{'datetime': 1}]}
+        clock[0] += 365 * 86400
+        response = cache.fetch('td/get_price_history', params, request, window_end=window_end)
+        assert isinstance(response, Cached_Response) and response.json() == {'candles': [{'datetime': 1}]}
+        assert request.calls == 1
+        assert cache.stats()['hits'] == 1
+
+    def test_window_touching_today_expires(self, make_cache):
+        clock = [NOW]
+        cache = make_cache(clock)
+        request = Counting_Request({'candles': []})
+        window_end = datetime(2023, 6, 15, 19, 0, tzinfo=pytz.UTC)
+        cache.fetch('td/get_price_history', {'symbol': 'AAPL'}, request, window_end=window_end)
+        cache.fetch('td/get_price_history', {'symbol': 'AAPL'}, request, window_end=window_end)
+        assert request.calls == 1
+        clock[0] += 301
+        cache.fetch('td/get_price_history', {'symbol': 'AAPL'}, request, window_end=window_end)
+        assert request.calls == 2
+        assert cache.stats()['expired'] == 1
+
+    def test_failed_responses_are_not_cached_and_bodies_are_shared(self, tmp_path, make_cache):
+        clock = [NOW]
+        cache = make_cache(clock)
+        window_end = datetime(2023, 1, 3, tzinfo=pytz.UTC)
+        failing = Counting_Request({'error': 'throttled'}, status_code=429)
+        cache.fetch('td/get_price_history', {'symbol': 'AAPL'}, failing, window_end=window_end)
+        cache.fetch('td/get_price_history', {'symbol': 'AAPL'}, failing, window_end=window_end)
+        assert failing.calls == 2
+        for symbol in ('AAPL', 'MSFT'):
+            cache.fetch('td/get_price_history', {'symbol': symbol}, Counting_Request({'candles': []}), window_end=window_end)
+        blobs = [name for _, _, names in os.walk(tmp_path / 'blobs') for name in names]
+        assert len(blobs) == 1
+
+    def test_error_bodies_are_not_cached(self, make_cache):
+        cache = make_cache([NOW])
+        window_end = datetime(2023, 1, 3, tzinfo=pytz.UTC)
+        rejected = Counting_Request({'error': "Individual App's transactions per seconds restriction reached."})
+        cache.fetch('td/get_price_history', {'symbol': 'AAPL'}, rejected, window_end=window_end)
+        cache.fetch('td/get_price_history', {'symbol': 'AAPL'}, rejected, window_end=window_end)
+        assert rejected.calls == 2
+        assert not cache.store('td/get_price_history', {'symbol': 'MSFT'}, Fake_Response({'candles': []}), window_end=window_end, is_valid=lambda response: bool(response.json()['candles']))
+        assert cache.store('td/get_price_history', {'symbol': 'MSFT'}, Fake_Response({'candles': [{'datetime': 1}]}), window_end=window_end)
+        assert cache.stats()['stored'] == 1
+
+    def test_with_mode_leaves_the_shared_mode(self, make_cache):
+        cache = make_cache([NOW])
+        request = Counting_Request({'candles': []})
+        replay = cache.with_mode('replay')
+        assert cache.mode == 'read_write'
+        cache.fetch('td/get_price_history', {'symbol': 'AAPL'}, request)
+        assert replay.fetch('td/get_price_history', {'symbol': 'AAPL'}, request).json() == {'candles': []}
+        with pytest.raises(Response_Cache_Miss):
+            replay.fetch('td/get_price_history', {'symbol': 'MSFT'}, request)
+        assert request.calls == 1
+        assert cache.stats() == replay.stats()
+
+    def test_replay_mode_never_requests(self, make_cache):
+        clock = [NOW]
+        cache = make_cache(clock)
+        request = Counting_Request({'candles': []})
+        cache.fetch('td/get_price_history', {'symbol': 'AAPL'}, request, window_end=None)
+        clock[0] += 86400
+        cache.set_mode('replay')
+        assert cache.fetch('td/get_price_history', {'symbol': 'AAPL'}, request).json() == {'candles': []}
+        with pytest.raises(Response_Cache_Miss):
+            cache.fetch('td/get_price_history', {'symbol': 'MSFT'}, request)
+        with pytest.raises(Response_Cache_Miss):
+            asyncio.run(cache.async_fetch('td/get_price_history', {'symbol': 'MSFT'}, request))
+        assert request.calls == 1
+
+    def test_window_end_of_day(self, make_cache):
+        cache = make_cache([NOW])
+        assert not cache.is_closed_window(cache.window_end_of_day('2023-06-15'))
+        assert cache.is_closed_window(cache.window_end_of_day('2023-06-14'))
@@ -0,0 +1,61 @@
+import threading
+import time
+from helpers.single_flight_helper import Single_Flight
+
+
+def run_concurrently(single_flight, key, fn, callers):
+    results, errors = [], []
+
+    def caller():
+        try:
+            results.append(single_flight.do(key, fn))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=caller) for _ in range(callers)]
+    for thread in threads:
+        thread.start()
+    return threads, results, errors
+
+
+class Test_Single_Flight:
+
+    def test_concurrent_identical_calls_share_one_result(self):
+        single_flight, release, calls = Single_Flight(), threading.Event(), []
+
+        def fetch():
+            calls.append(1)
+            release.wait(5)
+            return ['candle']
+
+        threads, results, errors = run_concurrently(single_flight, ('AAPL', 1, 'minute'), fetch, 5)
+        while single_flight.stats()['shared'] < 4:
+            time.sleep(0.001)
+        release.set()
+        for thread in threads:
+            thread.join()
+        assert len(calls) == 1
+        assert len(results) == 5 and all(result is results[0] for result in results)
+        assert single_flight.stats() == {'executed': 1, 'shared': 4, 'in_flight': 0}
+
+    def test_exception_is_shared_and_key_is_released(self):
+        single_flight, release = Single_Flight(), threading.Event()
+
+        def fail():
+            release.wait(5)
+            raise ValueError('api failed')
+
+        threads, results, errors = run_concurrently(single_flight, 'key', fail, 3)
+        while single_flight.stats()['shared'] < 2:
+            time.sleep(0.001)
+        release.set()
+        for thread in threads:
+            thread.join()
+        assert len(errors) == 3 and all(isinstance(error, ValueError) for error in errors)
+        # Nothing is cached, the next call runs again
+        assert single_flight.do('key', lambda: 'fresh') == 'fresh'
+
+    def test_different_keys_run_separately(self):
+        single_flight = Single_Flight()
+        assert [single_flight.do(key, lambda key=key: key * 2) for key in (1, 2, 1)] == [2, 4, 2]
+        assert single_flight.stats()['executed'] == 3
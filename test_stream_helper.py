@@ -0,0 +1,49 @@
+import time
+import pytest
+from helpers.stream_helper import prefetch
+
+
+class Test_Prefetch:
+
+    def test_yields_every_item_in_order(self):
+        assert list(prefetch(iter(range(100)), max_buffered=3)) == list(range(100))
+
+    def test_reraises_producer_exception(self):
+        def producer():
+            yield 1
+            raise ValueError('api failed')
+
+        consumed = []
+        with pytest.raises(ValueError, match='api failed'):
+            for item in prefetch(producer()):
+                consumed.append(item)
+        assert consumed == [1]
+
+    def test_producer_waits_for_consumer(self):
+        produced = []
+
+        def producer():
+            for item in range(10):
+                produced.append(item)
+                yield item
+
+        stream = prefetch(producer(), max_buffered=2)
+        assert next(stream) == 0
+        # The producer is blocked on the full buffer: one item consumed, two buffered, one waiting to be put
+        time.sleep(0.5)
+        assert len(produced) <= 4
+        assert list(stream) == list(range(1, 10))
+
+    def test_consumer_stopping_early_stops_producer(self):
+        produced = []
+
+        def producer():
+            for item in range(1000):
+                produced.append(item)
+                yield item
+
+        for item in prefetch(producer(), max_buffered=1):
+            if item == 2:
+                break
+        time.sleep(0.5)
+        assert len(produced) < 10
@@ -0,0 +1,30 @@
+import pytest
+from sqlalchemy import create_engine, text
+from support.table_registry import Table_Registry
+
+
+class Test_Table_Registry:
+
+    @pytest.fixture(autouse=True)
+    def empty_registry(self):
+        Table_Registry.invalidate()
+        yield
+        Table_Registry.invalidate()
+
+    def test_table_is_reflected_once(self):
+        engine = create_engine('sqlite://')
+        with engine.begin() as connection:
+            connection.execute(text('CREATE TABLE bars (entity_id INTEGER, timestamp BIGINT)'))
+        table = Table_Registry.get_table('bars', engine)
+        assert list(table.c.keys()) == ['entity_id', 'timestamp']
+        assert Table_Registry.get_table('bars', engine) is table
+
+    def test_missing_table_is_found_once_its_miss_expires(self):
+        engine = create_engine('sqlite://')
+        assert Table_Registry.get_table('bars', engine) is None
+        with engine.begin() as connection:
+            connection.execute(text('CREATE TABLE bars (entity_id INTEGER)'))
+        # Still remembered as missing until the miss expires or the table is invalidated
+        assert Table_Registry.get_table('bars', engine) is None
+        Table_Registry._missing['bars'] = 0.0
+        assert Table_Registry.get_table('bars', engine) is not None
@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+from datetime import datetime, timezone
+from support.trading_calendar import Trading_Calendar
+
+
+def to_ms(*args):
+    return int(datetime(*args, tzinfo=timezone.utc).timestamp() * 1000)
+
+
+@pytest.fixture(scope='module')
+def calendar():
+    return Trading_Calendar.default()
+
+
+class Test_Trading_Calendar:
+
+    def test_is_session_follows_dst(self, calendar):
+        # 2023-03-10 is EST (open 14:30 UTC), 2023-03-13 the first session in EDT (open 13:30 UTC, close 20:00 UTC)
+        timestamps = [to_ms(2023, 3, 10, 14, 29), to_ms(2023, 3, 10, 14, 30), to_ms(2023, 3, 10, 20, 59), to_ms(2023, 3, 13, 13, 30), to_ms(2023, 3, 13, 20, 0)]
+        assert list(calendar.is_session(timestamps)) == [False, True, True, True, False]
+        assert calendar.is_session(to_ms(2023, 3, 11, 15)).tolist() == [False]
+
+    def test_holidays_and_half_days(self, calendar):
+        # Independence Day and Thanksgiving are closed, the day after Thanksgiving closes at 13:00 EST (18:00 UTC)
+        assert list(calendar.is_session([to_ms(2023, 7, 4, 15), to_ms(2023, 11, 23, 15)])) == [False, False]
+        assert list(calendar.is_session([to_ms(2023, 11, 24, 17, 59), to_ms(2023, 11, 24, 18, 0)])) == [True, False]
+
+    def test_next_open_and_next_close(self, calendar):
+        # Friday after the close to the Monday open, across the weekend the clocks change on
+        assert calendar.next_open(to_ms(2023, 3, 10, 21)) == to_ms(2023, 3, 13, 13, 30)
+        assert calendar.next_close(to_ms(2023, 3, 13, 14)) == to_ms(2023, 3, 13, 20)
+        # An open is strictly after the given time, Good Friday 2023-04-07 is skipped
+        assert calendar.next_open(to_ms(2023, 4, 6, 13, 30)) == to_ms(2023, 4, 10, 13, 30)
+
+    def test_sessions_between(self, calendar):
+        opens, closes = calendar.sessions_between(to_ms(2023, 7, 1, 12), to_ms(2023, 7, 5, 23))
+        assert list(opens) == [to_ms(2023, 7, 3, 13, 30), to_ms(2023, 7, 5, 13, 30)]
+        # July 3 is a half-day, 13:00 EDT
+        assert list(closes) == [to_ms(2023, 7, 3, 17), to_ms(2023, 7, 5, 20)]
+
+    def test_find_covered_ranges_splits_at_missing_bars(self, calendar):
+        bucket_starts, _ = calendar.expected_buckets(to_ms(2023, 3, 10), to_ms(2023, 3, 13, 23), 1, 'minute')
+        hole = (bucket_starts >= to_ms(2023, 3, 13, 15)) & (bucket_starts < to_ms(2023, 3, 13, 15, 5))
+        covered_from, covered_to = calendar.find_covered_ranges(bucket_starts[~hole], 1, 'minute')
+        # The weekend (and the DST change) between the sessions is not a gap
+        assert list(covered_from) == [to_ms(2023, 3, 10, 14, 30), to_ms(2023, 3, 13, 15, 5)]
+        assert list(covered_to) == [to_ms(2023, 3, 13, 15) - 1, to_ms(2023, 3, 13, 19, 59)]
+        assert len(calendar.find_covered_ranges(np.empty(0, dtype=np.int64), 1, 'minute')[0]) == 0
+
+    def test_find_missing_ranges_skips_holidays(self, calendar):
+        # Daily bars stamped at New York midnight for the sessions around Independence Day, nothing is missing
+        stored = [to_ms(2023, 7, 3, 4), to_ms(2023, 7, 5, 4)]
+        assert calendar.find_missing_ranges(np.array(stored), to_ms(2023, 7, 3), to_ms(2023, 7, 5, 23), 1, 'daily') == []
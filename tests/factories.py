@@ -5,6 +5,9 @@ from models.entity import Entity
 from models.exchange_eodhistoricaldata import Exchange_EODHistoricalData
 from models.historical_price_data import Historical_Price_Data
 
+# 2023-05-01 13:30 UTC, on the grid of every intraday partition type
+FIRST_BAR_TIMESTAMP = 1_682_947_800_000
+
 class Entity_Factory(factory.alchemy.SQLAlchemyModelFactory):
     class Meta:
         model = Entity
@@ -78,14 +81,15 @@ class Historical_Price_Data_Factory(factory.alchemy.SQLAlchemyModelFactory):
         model = Historical_Price_Data
 
     entity_id = factory.SubFactory(Entity_Factory)
-    timestamp = timestamp = Faker('past_datetime', start_date="-30d")  # Generates a datetime within the last 30 days
-    open = factory.Float()
-    high = factory.Float()
-    low = factory.Float()
-    close = factory.Float()
-    adjusted_close = factory.Float()
-    volume = factory.Float()
-    is_regular_trading_hours = factory.Boolean()
+    # Consecutive 1 minute bars (UTC ms) from an on-grid start, with consistent OHLC so they pass Historical_Price_Data.validate_bars
+    timestamp = factory.Sequence(lambda n: FIRST_BAR_TIMESTAMP + n * 60_000)
+    open = factory.Faker('pyfloat', min_value=2, max_value=500, right_digits=2)
+    high = factory.LazyAttribute(lambda bar: bar.open + 1)
+    low = factory.LazyAttribute(lambda bar: bar.open - 1)
+    close = factory.LazyAttribute(lambda bar: bar.open + 0.5)
+    adjusted_close = factory.SelfAttribute('close')
+    volume = factory.Faker('pyfloat', min_value=0, max_value=1_000_000, right_digits=0)
+    is_regular_trading_hours = factory.Faker('pybool')
     source = factory.Faker('company')
     last_updated = factory.Faker('date_time')
     updated_by = factory.Faker('name')